@@ -0,0 +1,114 @@
+'''
+Streaming parser for AEMO "C/I/D" multi-table csv files.
+
+AEMO files hold several tables in one csv: C records are comments, each I record is the header of a table and
+the D records that follow are its rows. Rather than loading the whole file with dummy column names, the lines are
+streamed one at a time, only the records of the requested table are kept, and each block of kept rows is handed to
+the pandas C parser with the real header. Date columns are converted to datetime64 on the way out.
+'''
+
+import io
+import re
+import csv
+from zipfile import ZipFile
+import pandas as pd
+import instrumentation
+
+DATETIME_FORMAT = '%Y/%m/%d %H:%M:%S'
+_datetime_pattern = re.compile(r'^\d{4}/\d{2}/\d{2} \d{2}:\d{2}:\d{2}$')
+
+
+def _field(line, n):
+    # n-th (1 based) comma separated field of a raw line, without quotes
+    parts = line.split(b',', n)
+    if len(parts) < n:
+        return None
+    return parts[n-1].strip().strip(b'"')
+
+
+def _parse_header(line):
+    return [name.strip() for name in next(csv.reader([line.decode('utf-8', errors='replace')]))]
+
+
+def _convert_datetimes(df):
+    with instrumentation.span('to_datetime'):
+        return _convert_datetime_columns(df)
+
+
+def _convert_datetime_columns(df):
+    for column in df.columns[df.dtypes == object]:
+        first_valid = df[column].first_valid_index()
+        if first_valid is None or not _datetime_pattern.match(str(df[column].loc[first_valid])):
+            continue
+        try:
+            df[column] = pd.to_datetime(df[column], format=DATETIME_FORMAT)
+        except (ValueError, TypeError):
+            pass
+    return df
+
+
+def _lines_to_frame(header, lines, keep_empty=False):
+    # keep_empty keeps every column of the header, even if it is empty in these lines, so that all chunks of a
+    # streamed table have the same columns
+    with instrumentation.span('csv_parse') as s:
+        body = b''.join(lines)
+        df = pd.read_csv(io.BytesIO(body), header=None, low_memory=False)
+        s.update(bytes = len(body), rows = len(df))
+    df.columns = header[:len(df.columns)] + [f'col_{str(x).zfill(3)}' for x in range(len(header)+1, len(df.columns)+1)]
+    if keep_empty:
+        df = df.reindex(columns = header + list(df.columns[len(header):]))
+    else:
+        df = df.dropna(axis=1, how='all')
+    return _convert_datetimes(df)
+
+
+def iter_table_chunks(lines, filter_column_n=3, filter_value='', chunksize=None):
+    '''
+    Yields dataframes for the records of lines (an iterable of bytes) whose filter_column_n-th field equals
+    filter_value. The first matching record (the I record) provides the column names; a new I record for the same
+    table starts a new chunk with its own header. If chunksize is given, chunks hold at most chunksize rows and have
+    every column of their I record, including ones that are empty in that chunk (which are dropped otherwise).
+    '''
+    filter_value = filter_value.encode() if isinstance(filter_value, str) else filter_value
+    keep_empty = chunksize is not None
+    header = None
+    rows = []
+    for line in lines:
+        if _field(line, filter_column_n) != filter_value:
+            continue
+        if not line.endswith(b'\n'):
+            line += b'\n'
+        if header is None or line[:1] == b'I':
+            if rows:
+                yield _lines_to_frame(header, rows, keep_empty)
+                rows = []
+            header = _parse_header(line)
+            continue
+        rows.append(line)
+        if keep_empty and len(rows) >= chunksize:
+            yield _lines_to_frame(header, rows, keep_empty)
+            rows = []
+    if rows:
+        yield _lines_to_frame(header, rows, keep_empty)
+
+
+def iter_zip_member_chunks(z, filename, filter_column_n=3, filter_value='', chunksize=None):
+    '''
+    Streams the requested table out of one member of an open ZipFile. Members that are themselves zips
+    (as in the multi-file NEMWEB bundles) are opened and each of their csvs streamed in turn.
+    '''
+    if filename[-3:].lower() == 'zip':
+        with ZipFile(io.BytesIO(z.read(filename))) as inner_zip:
+            for inner_filename in inner_zip.namelist():
+                yield from iter_zip_member_chunks(inner_zip, inner_filename, filter_column_n, filter_value, chunksize)
+        return
+
+    with z.open(filename) as member:
+        yield from iter_table_chunks(member, filter_column_n, filter_value, chunksize)
+
+
+def read_aemo_table(lines, filter_column_n=3, filter_value=''):
+    chunks = list(iter_table_chunks(lines, filter_column_n, filter_value))
+    if not chunks:
+        return pd.DataFrame()
+    return pd.concat(chunks)
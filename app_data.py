@@ -0,0 +1,207 @@
+'''
+Data layer shared by every Streamlit session served by this process.
+
+Settled prices, predispatch runs and charts are kept in one module level store (modules are imported once per
+server process, so all sessions and reruns see the same entries). Each entry expires according to where its data
+comes from:
+
+    archive   ranges ending before the current month, served from MMSDM archives: never expire
+    daily     past days not archived yet (Public_Prices / TradingIS): NEMWEB_DAILY_TTL seconds
+    current   ranges reaching into today (CURRENT reports): NEMWEB_SETTLED_TTL / NEMWEB_PREDISPATCH_TTL seconds
+
+Ranges reaching into today are loaded through live_tail, so once they expire (or are refreshed) only the files
+published since the last load are downloaded.
+
+Requests in flight are de-duplicated: while one session downloads a range, other sessions asking for the same
+range wait for its result instead of starting their own download.
+
+With NEMWEB_ARROW=1 prices are kept as pyarrow Tables (see price_arrow) instead of compact frames. Tables are
+immutable, so every caller gets the stored table itself rather than a copy, and the chart only converts the state
+and market it draws to pandas.
+'''
+
+import os
+import time
+import datetime
+import threading
+import collections
+import pandas as pd
+import predispatch_daily
+import price_frames
+import live_tail
+
+DAILY_TTL = float(os.environ.get('NEMWEB_DAILY_TTL', 3600))
+SETTLED_TTL = float(os.environ.get('NEMWEB_SETTLED_TTL', 300))
+PREDISPATCH_TTL = float(os.environ.get('NEMWEB_PREDISPATCH_TTL', 900))
+MAX_ENTRIES = int(os.environ.get('NEMWEB_APP_CACHE_ENTRIES', 64))
+ARROW = os.environ.get('NEMWEB_ARROW', '0') == '1'
+
+# ttl of 'current' data per source, None means the entry never expires
+SOURCE_TTLS = {'settled': {'archive': None, 'daily': DAILY_TTL, 'current': SETTLED_TTL},
+               'predispatch': {'archive': None, 'daily': DAILY_TTL, 'current': PREDISPATCH_TTL}}
+
+# key -> {'value': ..., 'expires': time.monotonic() deadline or None}, least recently used first
+_entries = collections.OrderedDict()
+_entries_lock = threading.Lock()
+_locks = {}
+
+
+def source_class(start, end, now=None):
+    '''
+    Which kind of NEMWEB source answers [start, end]: 'archive', 'daily' or 'current'.
+    '''
+    now = pd.to_datetime(now or datetime.datetime.now())
+    end = pd.to_datetime(end)
+    if end <= now.floor('1d').replace(day=1):
+        return 'archive'
+    if end <= now.floor('1d'):
+        return 'daily'
+    return 'current'
+
+
+def _key_lock(key):
+    with _entries_lock:
+        return _locks.setdefault(key, threading.Lock())
+
+
+def _lookup(key):
+    with _entries_lock:
+        entry = _entries.get(key)
+        if entry is None:
+            return None
+        if entry['expires'] is not None and time.monotonic() >= entry['expires']:
+            del _entries[key]
+            return None
+        _entries.move_to_end(key)
+        return entry
+
+
+def _store(key, value, ttl):
+    with _entries_lock:
+        _entries[key] = {'value': value, 'expires': None if ttl is None else time.monotonic() + ttl}
+        _entries.move_to_end(key)
+        while len(_entries) > MAX_ENTRIES:
+            evicted, _ = _entries.popitem(last=False)
+            _locks.pop(evicted, None)
+
+
+def get_or_load(key, load, ttl=None, on_wait=None):
+    '''
+    Returns the stored value of key, or calls load() once to produce it and keeps it for ttl seconds.
+    Concurrent callers with the same key wait for the first one's result; on_wait() is called (once) by a caller
+    that has to wait, e.g. to show a spinner.
+    '''
+    entry = _lookup(key)
+    if entry is not None:
+        return entry['value']
+
+    lock = _key_lock(key)
+    if not lock.acquire(blocking=False):
+        if on_wait is not None:
+            on_wait()
+        lock.acquire()
+    try:
+        # whoever held the lock may have just stored it
+        entry = _lookup(key)
+        if entry is not None:
+            return entry['value']
+        value = load()
+        _store(key, value, ttl)
+        return value
+    finally:
+        lock.release()
+
+
+def _range_key(source, start, end):
+    return (source, pd.to_datetime(start), pd.to_datetime(end))
+
+
+def _shared(data):
+    # tables can't be modified, frames are copied so callers can't change the stored one
+    return data if ARROW else data.copy()
+
+
+def _compact(data):
+    if ARROW:
+        import price_arrow
+        return price_arrow.from_frame(data)
+    if 'settled_5min' in data.columns:
+        return price_frames.compact_settled(data)
+    return price_frames.compact_predispatch(data)
+
+
+def get_settled_prices(start, end, on_wait=None, progress_callback=None):
+    '''
+    Cached get_trading_price_NEMWEB(start, end), kept in the compact form of price_frames (a price_arrow table if
+    ARROW). Callers get their own copy of frames. progress_callback(fraction, text) is passed on to the loader if
+    this caller ends up loading the data.
+    '''
+    kind = source_class(start, end)
+    if kind == 'current':
+        load = lambda: _compact(live_tail.get_settled_prices(start, end, progress_callback))
+    else:
+        load = lambda: predispatch_daily.get_trading_price_NEMWEB(start, end, compact=True, arrow=ARROW,
+                                                                     progress_callback=progress_callback)
+    data = get_or_load(_range_key('settled', start, end), load, SOURCE_TTLS['settled'][kind], on_wait)
+    return _shared(data)
+
+
+def get_predispatch_prices(start, end, on_wait=None, progress_callback=None):
+    '''
+    Cached get_predispatch_price_NEMWEB(start, end), kept in the compact form of price_frames (a price_arrow table
+    if ARROW). Callers get their own copy of frames. progress_callback(fraction, text) is passed on to the loader if
+    this caller ends up loading the data.
+    '''
+    kind = source_class(start, end)
+    if kind == 'current':
+        load = lambda: _compact(live_tail.get_predispatch_prices(start, end, progress_callback))
+    else:
+        load = lambda: predispatch_daily.get_predispatch_price_NEMWEB(start, end, compact=True, arrow=ARROW,
+                                                                         progress_callback=progress_callback)
+    data = get_or_load(_range_key('predispatch', start, end), load, SOURCE_TTLS['predispatch'][kind], on_wait)
+    return _shared(data)
+
+
+def get_chart(start, end, state='NSW', on_wait=None, progress_callback=None, with_payload=False, **chart_kwargs):
+    '''
+    Forecast vs actuals chart of state for [start, end], built once per version of the underlying data.
+    The chart expires with the shorter lived of its two datasets. progress_callback(fraction, text) reports the
+    loading of either dataset. with_payload = True returns (chart, predispatch_daily.chart_payload_stats of it),
+    worked out once when the chart is built.
+    '''
+    if on_wait is not None:
+        # only tell the caller once, however many of the three entries it ends up waiting for
+        notify, waited = on_wait, []
+        on_wait = lambda: waited or (waited.append(True), notify())
+    actuals = get_settled_prices(start, end, on_wait, progress_callback)
+    predispatch = get_predispatch_prices(start, end, on_wait, progress_callback)
+    kind = source_class(start, end)
+    ttls = [SOURCE_TTLS[source][kind] for source in SOURCE_TTLS if SOURCE_TTLS[source][kind] is not None]
+    key = (_range_key('chart', start, end), state, tuple(sorted(chart_kwargs.items())))
+    def build():
+        fig = predispatch_daily.create_forecast_vs_actuals_chart(actuals, predispatch, state, **chart_kwargs)
+        return fig, predispatch_daily.chart_payload_stats(fig)
+    fig, payload = get_or_load(key, build, min(ttls) if ttls else None, on_wait)
+    return (fig, payload) if with_payload else fig
+
+
+def refresh(start, end):
+    '''
+    Expires the data and charts of [start, end] if it reaches into today, so the next request picks up newly
+    published files. Older ranges are left alone since their data no longer changes.
+    '''
+    if source_class(start, end) != 'current':
+        return
+    start = pd.to_datetime(start)
+    end = pd.to_datetime(end)
+    with _entries_lock:
+        for key in list(_entries):
+            range_key = key[0] if isinstance(key[0], tuple) else key
+            if range_key[1:] == (start, end):
+                del _entries[key]
+
+
+def clear():
+    with _entries_lock:
+        _entries.clear()
+        _locks.clear()
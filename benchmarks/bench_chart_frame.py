@@ -0,0 +1,120 @@
+'''
+Checks that predispatch_daily.build_forecast_vs_actuals_frame produces the same frame as the original
+apply/explode implementation of create_forecast_vs_actuals_chart, and times both.
+
+    python benchmarks/bench_chart_frame.py --days 7
+'''
+
+import os
+import sys
+import time
+import argparse
+import warnings
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import predispatch_daily
+
+REGIONS = ['NSW', 'QLD', 'SA', 'TAS', 'VIC']
+
+
+def synthetic_prices(start, days, seed=0):
+    '''
+    Settled prices and half hourly predispatch runs for days in the loader schemas, with random prices.
+    '''
+    rng = np.random.default_rng(seed)
+    start = pd.to_datetime(start)
+    end = start + pd.Timedelta(days=days)
+
+    intervals = pd.date_range(start + pd.Timedelta('5min'), end, freq='5min')
+    actuals = pd.DataFrame({'interval_5': np.repeat(intervals, len(REGIONS)),
+                            'region': np.tile(REGIONS, len(intervals)),
+                            'settled_5min': rng.normal(100, 30, len(intervals) * len(REGIONS))})
+    actuals = predispatch_daily.add_settled_30min(actuals)
+
+    runs = []
+    for run in pd.date_range(start, end - pd.Timedelta('30min'), freq='30min'):
+        # each run forecasts until 4am of the next day, capped to the requested range as the loader does
+        horizon = min(end, run.floor('1d') + pd.Timedelta('1d') + pd.Timedelta('4h'))
+        periods = pd.date_range(run + pd.Timedelta('30min'), horizon, freq='30min')
+        runs.append(pd.DataFrame({'from_datetime': run,
+                                  'interval_30': np.repeat(periods, len(REGIONS)),
+                                  'region': np.tile(REGIONS, len(periods))}))
+    predispatch = pd.concat(runs, ignore_index=True)
+    predispatch['forecast_30min'] = rng.normal(100, 30, len(predispatch))
+    return actuals, predispatch
+
+
+def reference_forecast_vs_actuals_frame(actuals, predispatch, state='NSW'):
+    # the original implementation, kept verbatim apart from returning the frame instead of the figure
+    resampled_predispatch = (predispatch.copy())
+    resampled_predispatch['interval_5'] = resampled_predispatch.apply(lambda df: pd.date_range(df.interval_30-pd.Timedelta('30min'),
+                                                                       df.interval_30, freq = '5min'), axis=1)
+    resampled_predispatch = resampled_predispatch.explode('interval_5')
+
+    actuals_df = actuals.query('region == @state')
+
+    unique_froms = list(resampled_predispatch.from_datetime.unique())
+    expanded_actuals = (actuals_df)
+    expanded_actuals['from_datetime'] = expanded_actuals.apply(lambda df:unique_froms, axis=1)
+    expanded_actuals = expanded_actuals.explode('from_datetime')
+
+    df = (resampled_predispatch
+          .query('region == @state')
+          .query('interval_30> from_datetime')
+          .merge(right= expanded_actuals, on = ['from_datetime','region','interval_5','interval_30'], how = 'outer')
+          .sort_values(by = ['interval_5','interval_30','from_datetime'])
+          .reset_index(drop=True)
+         )
+
+    last_settled=(df.filter(['from_datetime','interval_5','settled_5min'])
+                  .dropna()
+                  .interval_5.max()
+                 )
+
+    df['from_datetime_str'] = df.from_datetime.dt.strftime('%Y-%m-%d %H:%M')
+    df['keep'] = np.where(((df.settled_5min.isnull()) & (df.settled_30min.isnull())),'True','False')
+    df['keep'] = np.where((df.keep == "True") & np.logical_not( df.forecast_30min.isnull()),'False','True')
+    df['keep'] = np.where((df.keep == "True") | (df.interval_5>=last_settled),'True','False')
+    df = (df
+          .query('keep=="True"')
+         )
+    return df.drop(columns='keep')
+
+
+def _normalise(df):
+    df = df.copy()
+    for column in ['from_datetime', 'interval_5', 'interval_30']:
+        df[column] = pd.to_datetime(df[column])
+    return df.sort_values(by=list(df.columns)).reset_index(drop=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--state', default='NSW')
+    args = parser.parse_args(argv)
+
+    actuals, predispatch = synthetic_prices('2022-10-01', args.days)
+    print(f'{len(actuals)} settled rows, {len(predispatch)} predispatch rows, '
+          f'{predispatch.from_datetime.nunique()} runs')
+
+    start = time.perf_counter()
+    new = predispatch_daily.build_forecast_vs_actuals_frame(actuals, predispatch, args.state)
+    new_seconds = time.perf_counter() - start
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        start = time.perf_counter()
+        reference = reference_forecast_vs_actuals_frame(actuals, predispatch, args.state)
+        reference_seconds = time.perf_counter() - start
+
+    pd.testing.assert_frame_equal(_normalise(new), _normalise(reference), check_dtype=False)
+    print(f'frames match ({len(new)} rows)')
+    print(f'reference: {reference_seconds:.2f}s  vectorised: {new_seconds:.2f}s  '
+          f'speedup: {reference_seconds / new_seconds:.1f}x')
+
+
+if __name__ == '__main__':
+    main()
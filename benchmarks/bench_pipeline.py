@@ -0,0 +1,194 @@
+'''
+Times the NEMWEB pipeline offline: get_nemweb_file, both price loaders and create_forecast_vs_actuals_chart, for
+windows of increasing size, against synthetic fixtures served by a local stand-in for nemweb.com.au.
+
+Each measurement runs in a fresh process with empty caches (or warmed caches with --warm) and reports wall time,
+peak RSS of the process and (summed) of its parse workers during the measured call, and the bytes and requests it
+downloaded. The chart is timed on its own, with the time to load its data reported as load_s. Results can be saved
+with --json and compared against an earlier run with --baseline to spot regressions.
+
+    python benchmarks/bench_pipeline.py --days 1 7 28
+    python benchmarks/bench_pipeline.py --json after.json --baseline before.json
+
+With NEMWEB_ARROW=1 the loaders return pyarrow Tables (see price_arrow) and the chart is built from those.
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import re
+import tempfile
+import subprocess
+import datetime
+import pandas as pd
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, REPO_DIR)
+
+import nemweb_fixtures
+from nemweb_server import NemwebServer
+
+SCENARIOS = ['get_nemweb_file', 'settled', 'predispatch', 'chart']
+
+
+def _window(window, days):
+    # archive windows start at the archived month, the current window ends at the fixtures' now
+    if window == 'archive':
+        start = pd.Timestamp(nemweb_fixtures.ARCHIVE_MONTH)
+        return start, start + pd.Timedelta(days=days)
+    end = pd.Timestamp(nemweb_fixtures.NOW)
+    return end - pd.Timedelta(days=days), end
+
+
+def _server_stats(url):
+    import requests
+    return requests.get(url + '/_stats').json()
+
+
+def _worker_pids():
+    import nemweb_fetch
+    pool = nemweb_fetch._process_pool
+    return list(pool._processes or {}) if pool is not None else []
+
+
+def _peak_rss_mb(pid='self'):
+    # VmHWM rather than ru_maxrss, which keeps the peak of the benchmark process this one was forked from
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            return int(re.search(r'VmHWM:\s+(\d+) kB', f.read()).group(1)) / 1024
+    except (OSError, AttributeError):
+        return 0.0
+
+
+def _reset_peak_rss():
+    # so the peak only covers the measured call, not the imports, warm up run or loading the chart's data
+    for pid in ['self'] + _worker_pids():
+        try:
+            with open(f'/proc/{pid}/clear_refs', 'w') as f:
+                f.write('5')
+        except OSError:
+            pass
+
+
+def run_scenario(scenario, window, days, warm=False):
+    '''
+    Runs one measurement in this process (called in the child processes) and returns its result dict.
+    '''
+    import predispatch_daily
+
+    start, end = _window(window, days)
+    archive_url = predispatch_daily.get_dispatch_price_archive_files(start, start).links.values[0]
+    arrow = os.environ.get('NEMWEB_ARROW', '0') == '1'
+    calls = {'get_nemweb_file': lambda: predispatch_daily.get_nemweb_file(archive_url, **predispatch_daily.ARCHIVE_PRICE_FILTER),
+             'settled': lambda: predispatch_daily.get_trading_price_NEMWEB(start, end, use_store=False, arrow=arrow),
+             'predispatch': lambda: predispatch_daily.get_predispatch_price_NEMWEB(start, end, use_store=False, arrow=arrow)}
+    load = None
+    if scenario == 'chart':
+        # only the chart is timed, the data it is built from is loaded (and timed) beforehand
+        started = time.perf_counter()
+        actuals, predispatch = calls['settled'](), calls['predispatch']()
+        load = round(time.perf_counter() - started, 3)
+        calls['chart'] = lambda: predispatch_daily.create_forecast_vs_actuals_chart(actuals, predispatch, 'NSW')
+    if warm:
+        calls[scenario]()
+
+    url = predispatch_daily.nemweb_listing.NEMWEB_HOST
+    before = _server_stats(url)
+    _reset_peak_rss()
+    started = time.perf_counter()
+    result = calls[scenario]()
+    wall = time.perf_counter() - started
+    after = _server_stats(url)
+    peak_rss = _peak_rss_mb()
+    workers_rss = sum(_peak_rss_mb(pid) for pid in _worker_pids())
+    rows = len(result.frames) if scenario == 'chart' else len(result)
+    return {'scenario': scenario, 'window': window, 'days': days, 'warm': warm, 'wall_s': round(wall, 3),
+            'load_s': load, 'peak_rss_mb': round(peak_rss, 1), 'workers_rss_mb': round(workers_rss, 1),
+            'downloaded_mb': round((after['bytes'] - before['bytes']) / 1e6, 3),
+            'requests': after['requests'] - before['requests'], 'rows': rows}
+
+
+def _run_child(server, scenario, window, days, warm, verbose):
+    scratch = tempfile.mkdtemp(prefix='bench-nemweb-')
+    env = dict(os.environ,
+               NEMWEB_URL = server.url,
+               NEMWEB_CACHE_DIR = os.path.join(scratch, 'cache'),
+               NEMWEB_STORE_DIR = os.path.join(scratch, 'store'),
+               NEMWEB_SPOOL_DIR = os.path.join(scratch, 'spool'),
+               PYTHONPATH = os.pathsep.join([REPO_DIR, BENCHMARKS_DIR, os.environ.get('PYTHONPATH', '')]))
+    try:
+        completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', scenario,
+                                    '--window', window, '--days', str(days)] + (['--warm'] if warm else []),
+                                   env = env, capture_output = True, text = True)
+    finally:
+        shutil.rmtree(scratch, ignore_errors = True)
+    if verbose or completed.returncode != 0:
+        sys.stderr.write(completed.stderr)
+    if completed.returncode != 0:
+        return {'scenario': scenario, 'window': window, 'days': days, 'warm': warm, 'error': completed.stderr.strip().splitlines()[-1]}
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def _compare(results, baseline_path):
+    baseline = pd.DataFrame(json.load(open(baseline_path))['results'])
+    keys = ['scenario', 'window', 'days', 'warm']
+    merged = pd.DataFrame(results).merge(baseline, on = keys, suffixes = ('', '_baseline'))
+    for column in ['wall_s', 'peak_rss_mb', 'downloaded_mb']:
+        merged[f'{column}_ratio'] = (merged[column] / merged[f'{column}_baseline']).round(2)
+    return merged.filter(keys + ['wall_s_ratio', 'peak_rss_mb_ratio', 'downloaded_mb_ratio'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--days', nargs='+', type=int, default=[1, 7, 28],
+                        help='window sizes, in days from the start of the archived month')
+    parser.add_argument('--current-days', type=int, default=1,
+                        help='size of the window ending at the fixtures\' now (0 to skip)')
+    parser.add_argument('--warm', action='store_true', help='measure with caches filled by a first run')
+    parser.add_argument('--fixtures', default=nemweb_fixtures.DEFAULT_ROOT)
+    parser.add_argument('--rebuild-fixtures', action='store_true')
+    parser.add_argument('--json', help='save the results to this file')
+    parser.add_argument('--baseline', help='compare with results saved by an earlier --json run')
+    parser.add_argument('--verbose', action='store_true')
+    parser.add_argument('--child', choices=SCENARIOS, help=argparse.SUPPRESS)
+    parser.add_argument('--window', default='archive', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child:
+        print(json.dumps(run_scenario(args.child, args.window, args.days[0], args.warm)))
+        return
+
+    if args.rebuild_fixtures or not os.path.isdir(args.fixtures):
+        print(f'Building fixtures in {args.fixtures}...')
+        nemweb_fixtures.build_fixtures(args.fixtures)
+    server = NemwebServer(args.fixtures).start()
+
+    runs = [(scenario, 'archive', days) for scenario in args.scenarios for days in args.days]
+    if args.current_days:
+        runs += [(scenario, 'current', args.current_days) for scenario in args.scenarios if scenario != 'get_nemweb_file']
+    runs = list(dict.fromkeys((s, w, 0 if s == 'get_nemweb_file' else d) for s, w, d in runs))
+
+    results = []
+    for scenario, window, days in runs:
+        result = _run_child(server, scenario, window, days, args.warm, args.verbose)
+        print(' '.join(f'{k}={v}' for k, v in result.items()), flush=True)
+        results.append(result)
+    server.shutdown()
+
+    print()
+    print(pd.DataFrame(results).to_string(index=False))
+    if args.baseline:
+        print()
+        print(_compare(results, args.baseline).to_string(index=False))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'created': datetime.datetime.now().isoformat(), 'results': results}, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
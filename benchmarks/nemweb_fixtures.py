@@ -0,0 +1,228 @@
+'''
+Synthetic NEMWEB tree for offline benchmarks.
+
+Writes AEMO format zips under the same paths as on nemweb.com.au, with the autoindex pages of the CURRENT
+directories, for a fixed timeline:
+
+    MMSDM monthly archives    DISPATCHPRICE and PREDISPATCHPRICE of archive_month
+    Public_Prices             daily DREGION files of the market day (4am to 4am) from the last one of archive_month,
+                              published just after it ends
+    TradingIS_Reports         5 min PRICE files for the last two days before now
+    Predispatch_Reports       half hourly PDREGION (legacy format) runs for the last two days before now
+
+Prices are random but every table has the columns the loaders read, including the FCAS prices.
+
+    python benchmarks/nemweb_fixtures.py --root /tmp/nemweb-fixtures
+'''
+
+import os
+import io
+import csv
+import zipfile
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+
+DEFAULT_ROOT = os.path.join(tempfile.gettempdir(), 'backtoNEMfuture-fixtures')
+ARCHIVE_MONTH = '2022-09'
+NOW = '2022-10-08 00:00'
+CURRENT_DAYS = 2
+
+REGIONS = ['NSW1', 'QLD1', 'SA1', 'TAS1', 'VIC1']
+FCAS = ['RAISE6SECRRP', 'RAISE60SECRRP', 'RAISE5MINRRP', 'RAISEREGRRP',
+        'LOWER6SECRRP', 'LOWER60SECRRP', 'LOWER5MINRRP', 'LOWERREGRRP']
+MMSDM = '/Data_Archive/Wholesale_Electricity/MMSDM'
+CURRENT = '/Reports/CURRENT'
+
+_rng = np.random.default_rng(0)
+
+
+def _quoted(times):
+    return '"' + pd.Series(times).dt.strftime('%Y/%m/%d %H:%M:%S') + '"'
+
+
+def _table_lines(record, table, version, data):
+    # I record followed by the D records of one table
+    header = f'I,{record},{table},{version},' + ','.join(data.columns) + '\n'
+    body = (data.assign(**{'_d': 'D', '_r': record, '_t': table, '_v': version})
+            .filter(['_d', '_r', '_t', '_v'] + list(data.columns))
+            .to_csv(header=False, index=False, quoting=csv.QUOTE_NONE, quotechar="'", float_format='%.5f'))
+    return header + body
+
+
+def aemo_csv(report, tables):
+    '''
+    C/I/D csv text of report, tables being (record, table, version, dataframe) tuples.
+    '''
+    text = f'C,NEMP.WORLD,{report},AEMO,PUBLIC,2022/10/01,00:00:00,0000000000,{report},0000000000\n'
+    rows = 1
+    for record, table, version, data in tables:
+        text += _table_lines(record, table, version, data)
+        rows += len(data) + 1
+    return text + f'C,"END OF REPORT",{rows + 1}\n'
+
+
+def _prices(n):
+    return dict({'RRP': _rng.normal(100, 40, n).round(5)},
+                **{column: _rng.random(n).round(3) for column in FCAS})
+
+
+def _per_region(times):
+    times = pd.DatetimeIndex(times)
+    return np.repeat(times, len(REGIONS)), np.tile(REGIONS, len(times))
+
+
+def dispatchprice(times):
+    settlement, regions = _per_region(times)
+    data = pd.DataFrame({'SETTLEMENTDATE': _quoted(settlement), 'RUNNO': 1, 'REGIONID': regions,
+                         'DISPATCHINTERVAL': 1, 'INTERVENTION': 0})
+    prices = _prices(len(data))
+    data = data.assign(RRP = prices.pop('RRP'), EEP = 0, ROP = 0, APCFLAG = 0, MARKETSUSPENDEDFLAG = 0,
+                       LASTCHANGED = _quoted(settlement), **prices)
+    return aemo_csv('DISPATCHPRICE', [('DISPATCH', 'PRICE', 4, data)])
+
+
+def dregion(times):
+    settlement, regions = _per_region(times)
+    data = pd.DataFrame({'SETTLEMENTDATE': _quoted(settlement), 'RUNNO': 1, 'REGIONID': regions, 'INTERVENTION': 0})
+    prices = _prices(len(data))
+    data = data.assign(RRP = prices.pop('RRP'), EEP = 0, ROP = 0, APCFLAG = 0, MARKETSUSPENDEDFLAG = 0, **prices)
+    return aemo_csv('PUBLIC_PRICES', [('DREGION', '', 3, data)])
+
+
+def tradingis_price(time):
+    settlement, regions = _per_region([time])
+    data = pd.DataFrame({'SETTLEMENTDATE': _quoted(settlement), 'RUNNO': 1, 'REGIONID': regions, 'PERIODID': 1})
+    prices = _prices(len(data))
+    data = data.assign(RRP = prices.pop('RRP'), EEP = 0, INVALIDFLAG = 0, LASTCHANGED = _quoted(settlement),
+                       ROP = 0, **prices)
+    return aemo_csv('TRADINGIS', [('TRADING', 'PRICE', 3, data)])
+
+
+def _forecast_periods(run):
+    # each run forecasts the rest of the trading day and the next one (to 4am)
+    return pd.date_range(run + pd.Timedelta('30min'), run.floor('1d') + pd.Timedelta('1d') + pd.Timedelta('4h'), freq='30min')
+
+
+def predispatch_current(run):
+    run = pd.Timestamp(run)
+    periods, regions = _per_region(_forecast_periods(run))
+    data = pd.DataFrame({'PREDISPATCHSEQNO': _quoted([run] * len(periods)), 'RUNNO': 1, 'REGIONID': regions,
+                         'PERIODID': _quoted(periods), 'INTERVENTION': 0})
+    prices = _prices(len(data))
+    data = data.assign(RRP = prices.pop('RRP'), EEP = 0, **prices, LASTCHANGED = _quoted([run] * len(periods)))
+    return aemo_csv('PREDISPATCHIS', [('PDREGION', '', 5, data)])
+
+
+def predispatch_archive(month_start):
+    month_start = pd.Timestamp(month_start)
+    runs = pd.date_range(month_start, month_start + pd.offsets.MonthBegin(1), freq='30min', inclusive='left')
+    frames = []
+    for run in runs:
+        periods, regions = _per_region(_forecast_periods(run))
+        frames.append(pd.DataFrame({'run': run, 'DATETIME': periods, 'REGIONID': regions}))
+    data = pd.concat(frames, ignore_index=True)
+    prices = _prices(len(data))
+    data = pd.DataFrame({'PREDISPATCHSEQNO': data.run.dt.strftime('%Y%m%d') + '01', 'RUNNO': 1,
+                         'REGIONID': data.REGIONID, 'PERIODID': 1, 'INTERVENTION': 0,
+                         'RRP': prices.pop('RRP'), 'EEP': 0, **prices,
+                         'LASTCHANGED': _quoted(data.run + pd.Timedelta('2min')),
+                         'DATETIME': _quoted(data.DATETIME)})
+    return aemo_csv('PREDISPATCHPRICE', [('PREDISPATCH', 'REGION_PRICES', 1, data)])
+
+
+def zip_bytes(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as z:
+        for name, text in members.items():
+            z.writestr(name, text)
+    return buffer.getvalue()
+
+
+def listing_html(path, entries):
+    '''
+    IIS style autoindex page of path, entries being (file name, modified time, size) tuples.
+    '''
+    rows = []
+    for name, modified, size in entries:
+        modified = pd.Timestamp(modified)
+        rows.append(f'{modified:%A, %B} {modified.day}, {modified.year} {modified.hour % 12 or 12:>2}:{modified:%M} '
+                    f'{modified:%p} {size:>12} <A HREF="{path}{name}">{name}</A><br>')
+    parent = path.rstrip('/').rsplit('/', 1)[0] + '/'
+    return (f'<html><head><title>nemweb.com.au - {path}</title></head><body><H1>nemweb.com.au - {path}</H1><hr>\n\n'
+            f'<pre><A HREF="{parent}">[To Parent Directory]</A><br><br>' + ''.join(rows) + '</pre><hr></body>\n</html>')
+
+
+def _write(root, path, content):
+    full_path = os.path.join(root, path.lstrip('/'))
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+    with open(full_path, 'wb') as f:
+        f.write(content)
+    return len(content)
+
+
+def _write_directory(root, path, files):
+    # files: {name: (modified time, content)}
+    entries = [(name, modified, _write(root, path + name, content)) for name, (modified, content) in files.items()]
+    _write(root, path + 'index.html', listing_html(path, sorted(entries, key=lambda entry: entry[1])).encode())
+
+
+def build_fixtures(root=None, archive_month=ARCHIVE_MONTH, now=NOW, current_days=CURRENT_DAYS):
+    '''
+    Writes the fixture tree under root (see the module docstring) and returns root.
+    '''
+    root = root or DEFAULT_ROOT
+    month_start = pd.Timestamp(archive_month)
+    month_end = month_start + pd.offsets.MonthBegin(1)
+    now = pd.Timestamp(now)
+    current_start = now - pd.Timedelta(days=current_days)
+    y, m = f'{month_start.year}', f'{month_start.month:02d}'
+
+    # monthly archives
+    archive_dir = f'{MMSDM}/{y}/MMSDM_{y}_{m}/MMSDM_Historical_Data_SQLLoader'
+    times = pd.date_range(month_start + pd.Timedelta('5min'), month_end, freq='5min')
+    _write(root, f'{archive_dir}/DATA/PUBLIC_DVD_DISPATCHPRICE_{y}{m}010000.zip',
+           zip_bytes({f'PUBLIC_DVD_DISPATCHPRICE_{y}{m}010000.CSV': dispatchprice(times)}))
+    _write(root, f'{archive_dir}/PREDISP_ALL_DATA/PUBLIC_DVD_PREDISPATCHPRICE_{y}{m}010000.zip',
+           zip_bytes({f'PUBLIC_DVD_PREDISPATCHPRICE_{y}{m}010000.CSV': predispatch_archive(month_start)}))
+
+    # daily public prices for the market day named, which runs from 4am to 4am the next day, published as it ends
+    files = {}
+    for day in pd.date_range(month_end - pd.Timedelta('1d'), now - pd.Timedelta('1d'), freq='1d'):
+        published = day + pd.Timedelta('1d') + pd.Timedelta('4h5min')
+        if published > now:
+            continue
+        name = f'PUBLIC_PRICES_{day:%Y%m%d}0000_{published:%Y%m%d%H%M%S}.zip'
+        times = pd.date_range(day + pd.Timedelta('4h5min'), day + pd.Timedelta('1d') + pd.Timedelta('4h'), freq='5min')
+        files[name] = (published, zip_bytes({name.replace('.zip', '.CSV'): dregion(times)}))
+    _write_directory(root, f'{CURRENT}/Public_Prices/', files)
+
+    # 5 min trading prices
+    files = {}
+    for i, time in enumerate(pd.date_range(current_start + pd.Timedelta('5min'), now, freq='5min')):
+        name = f'PUBLIC_TRADINGIS_{time:%Y%m%d%H%M}_{i:016d}.zip'
+        files[name] = (time, zip_bytes({name.replace('.zip', '.CSV'): tradingis_price(time)}))
+    _write_directory(root, f'{CURRENT}/TradingIS_Reports/', files)
+
+    # half hourly predispatch runs, published a little before the run starts
+    files = {}
+    for run in pd.date_range(current_start, now - pd.Timedelta('30min'), freq='30min'):
+        published = run - pd.Timedelta('29min')
+        name = f'PUBLIC_PREDISPATCHIS_{run:%Y%m%d%H%M}_{published:%Y%m%d%H%M%S}_LEGACY.zip'
+        files[name] = (published, zip_bytes({name.replace('.zip', '.CSV'): predispatch_current(run)}))
+    _write_directory(root, f'{CURRENT}/Predispatch_Reports/', files)
+    return root
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--root', default=DEFAULT_ROOT)
+    parser.add_argument('--archive-month', default=ARCHIVE_MONTH)
+    parser.add_argument('--now', default=NOW)
+    args = parser.parse_args(argv)
+    print(build_fixtures(args.root, args.archive_month, args.now))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+'''
+Local HTTP stand-in for nemweb.com.au, serving a fixture tree (see nemweb_fixtures.py).
+
+Paths are matched case-insensitively (the loaders lowercase the links they scrape), directories serve their
+index.html, and the server answers Range requests and conditional requests (ETag / If-Modified-Since) like NEMWEB.
+It counts the requests and bytes it serves; GET /_stats returns them as json.
+
+    python benchmarks/nemweb_server.py --root /tmp/nemweb-fixtures --port 8765
+    NEMWEB_URL=http://localhost:8765 streamlit run streamlit_app.py
+'''
+
+import os
+import re
+import json
+import hashlib
+import argparse
+import threading
+import email.utils
+import http.server
+import nemweb_fixtures
+
+
+class NemwebHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b'', headers=None, count=True):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+        if count:
+            self.server.count(0 if self.command == 'HEAD' else len(body))
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        if path == '/_stats':
+            return self._send(200, json.dumps(self.server.stats()).encode(), {'Content-Type': 'application/json'},
+                              count=False)
+
+        file_path = self.server.lookup(path)
+        if file_path is None:
+            return self._send(404)
+
+        stat = os.stat(file_path)
+        etag = '"' + hashlib.sha1(f'{file_path}{stat.st_mtime_ns}{stat.st_size}'.encode()).hexdigest()[:16] + '"'
+        last_modified = email.utils.formatdate(stat.st_mtime, usegmt=True)
+        headers = {'ETag': etag, 'Last-Modified': last_modified, 'Accept-Ranges': 'bytes',
+                   'Content-Type': 'text/html' if file_path.endswith('.html') else 'application/zip'}
+        if self.headers.get('If-None-Match') == etag or self.headers.get('If-Modified-Since') == last_modified:
+            return self._send(304, headers={'ETag': etag, 'Last-Modified': last_modified})
+
+        with open(file_path, 'rb') as f:
+            body = f.read()
+        match = re.match(r'bytes=(\d+)-(\d*)$', self.headers.get('Range', ''))
+        if match:
+            first = int(match.group(1))
+            last = int(match.group(2)) if match.group(2) else len(body) - 1
+            if first >= len(body):
+                return self._send(416, headers={'Content-Range': f'bytes */{len(body)}'})
+            headers['Content-Range'] = f'bytes {first}-{last}/{len(body)}'
+            return self._send(206, body[first:last + 1], headers)
+        return self._send(200, body, headers)
+
+
+class NemwebServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, root, port=0):
+        super().__init__(('localhost', port), NemwebHandler)
+        self.root = root
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._bytes = 0
+        # lowercased url path -> file
+        self._paths = {}
+        for directory, _, files in os.walk(root):
+            for name in files:
+                full_path = os.path.join(directory, name)
+                url_path = '/' + os.path.relpath(full_path, root).replace(os.sep, '/')
+                self._paths[url_path.lower()] = full_path
+                if name == 'index.html':
+                    self._paths[url_path[:-len('index.html')].lower()] = full_path
+
+    @property
+    def url(self):
+        return f'http://localhost:{self.server_address[1]}'
+
+    def lookup(self, path):
+        return self._paths.get(path.lower())
+
+    def count(self, num_bytes):
+        with self._lock:
+            self._requests += 1
+            self._bytes += num_bytes
+
+    def stats(self):
+        with self._lock:
+            return {'requests': self._requests, 'bytes': self._bytes}
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--root', default=nemweb_fixtures.DEFAULT_ROOT)
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.root):
+        nemweb_fixtures.build_fixtures(args.root)
+    server = NemwebServer(args.root, args.port)
+    print(f'Serving {args.root} at {server.url}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+'''
+Pre-rendered forecast vs actuals charts of recent days.
+
+Most visits are for yesterday or today in one of the five regions, so a scheduler builds those charts as soon as
+new data lands and writes them to SNAPSHOT_DIR:
+
+    <day>/<state>_<market>.json              {'meta': {..., 'payload': chart_payload_stats}, 'figure': plotly figure json}
+    <day>/<state>_<market>_settled.parquet   the frames the chart is drawn from (see build_forecast_frames)
+    <day>/<state>_<market>_forecasts.parquet
+
+A day's snapshots are final once the day is over and all of its settled prices and predispatch runs are in;
+until then they are rebuilt whenever a newer TradingIS or predispatch file is published, and readers only accept
+them for MAX_AGE seconds. streamlit_app serves a snapshot when there is one and computes the chart live otherwise.
+
+The scheduler runs in the background of the streamlit server (see start_scheduler), or separately:
+
+    python chart_snapshots.py warm          # one pass, e.g. from cron
+    python chart_snapshots.py run           # every SNAPSHOT_INTERVAL seconds
+'''
+
+import os
+import json
+import time
+import argparse
+import datetime
+import threading
+import pandas as pd
+import price_store
+import price_frames
+import price_arrow
+import predispatch_daily
+import app_data
+
+SNAPSHOT_DIR = os.environ.get('NEMWEB_SNAPSHOT_DIR',
+                              os.path.join(os.path.expanduser('~'), '.cache', 'backtoNEMfuture', 'snapshots'))
+SNAPSHOT_DAYS = int(os.environ.get('NEMWEB_SNAPSHOT_DAYS', 2))
+SNAPSHOT_MARKETS = os.environ.get('NEMWEB_SNAPSHOT_MARKETS', 'ENERGY').split(',')
+# a new dispatch interval is published every 5 minutes
+SNAPSHOT_INTERVAL = float(os.environ.get('NEMWEB_SNAPSHOT_INTERVAL', 300))
+MAX_AGE = float(os.environ.get('NEMWEB_SNAPSHOT_MAX_AGE', 2 * SNAPSHOT_INTERVAL))
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def _day(day):
+    return pd.to_datetime(day).floor('1d')
+
+
+def snapshot_path(day, state, market, suffix='.json', snapshot_dir=None):
+    return os.path.join(snapshot_dir or SNAPSHOT_DIR, f'{_day(day):%Y%m%d}', f'{state}_{market}{suffix}')
+
+
+def recent_days(days=None, now=None):
+    '''
+    Today and the days before it, most recent first.
+    '''
+    today = _day(now or datetime.datetime.now())
+    return [today - pd.Timedelta(days=i) for i in range(days or SNAPSHOT_DAYS)]
+
+
+def read_meta(day, state, market, snapshot_dir=None):
+    path = snapshot_path(day, state, market, snapshot_dir=snapshot_dir)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)['meta']
+
+
+def load_snapshot(day, state='NSW', market='ENERGY', max_age=None, snapshot_dir=None):
+    '''
+    Returns (figure, meta) of the snapshot of state and market on day, or None if there is none or it is not
+    final and older than max_age seconds (MAX_AGE by default).
+    '''
+    import plotly.io
+
+    path = snapshot_path(day, state, market, snapshot_dir=snapshot_dir)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        snapshot = json.load(f)
+    meta = snapshot['meta']
+    if not meta['final'] and time.time() - meta['built'] > (MAX_AGE if max_age is None else max_age):
+        return None
+    return plotly.io.from_json(json.dumps(snapshot['figure']), skip_invalid=True), meta
+
+
+def load_snapshot_frames(day, state='NSW', market='ENERGY', snapshot_dir=None):
+    '''
+    Returns the (settled, forecasts) frames stored with a snapshot, or None.
+    '''
+    paths = [snapshot_path(day, state, market, f'_{name}.parquet', snapshot_dir) for name in ('settled', 'forecasts')]
+    if not all(os.path.exists(path) for path in paths):
+        return None
+    return tuple(pd.read_parquet(path) for path in paths)
+
+
+def _write_atomic(path, write):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write(path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+
+def _write_text(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def _is_final(start, end, intervals, runs):
+    # over, with every 5 min interval settled and every half hourly run of the day in
+    if app_data.source_class(start, end) == 'current' or len(intervals) == 0:
+        return False
+    expected_runs = pd.date_range(start, end - pd.Timedelta('30min'), freq='30min')
+    return intervals.max() >= end and expected_runs.isin(runs.unique()).all()
+
+
+def build_snapshots(day, states=None, markets=None, snapshot_dir=None):
+    '''
+    Builds and writes the snapshots of day for each of states and markets (all regions and SNAPSHOT_MARKETS by
+    default). The data and charts go through app_data, so the server's own cache is warmed at the same time.
+    '''
+    start = _day(day)
+    end = start + pd.Timedelta('1d')
+    app_data.refresh(start, end)
+    actuals = app_data.get_settled_prices(start, end)
+    predispatch = app_data.get_predispatch_prices(start, end)
+    # frames or price_arrow tables, depending on app_data.ARROW
+    intervals = price_arrow.column(actuals, 'interval_5')
+    runs = price_arrow.column(predispatch, 'from_datetime')
+    meta = {'day': f'{start:%Y-%m-%d}', 'built': time.time(), 'final': bool(_is_final(start, end, intervals, runs)),
+            'settled_until': str(intervals.max()), 'runs_until': str(runs.max())}
+
+    for market in markets or SNAPSHOT_MARKETS:
+        for state in states or price_store.REGIONS:
+            fig, payload = app_data.get_chart(start, end, state, market = market, with_payload = True)
+            settled_prices = price_frames.expand_settled(predispatch_daily.select_chart_rows(actuals, state, market))
+            predispatch_prices = price_frames.expand_predispatch(predispatch_daily.select_chart_rows(predispatch, state, market))
+            frames = predispatch_daily.build_forecast_frames(settled_prices, predispatch_prices, state)
+            # frames first, so a snapshot's json is only there once its frames are
+            for name, frame in zip(('settled', 'forecasts'), frames):
+                _write_atomic(snapshot_path(start, state, market, f'_{name}.parquet', snapshot_dir),
+                              lambda path: frame.to_parquet(path, index = False))
+            # the payload is kept with the snapshot so serving it does not serialise the figure again
+            snapshot = json.dumps({'meta': dict(meta, state = state, market = market, payload = payload),
+                                   'figure': json.loads(fig.to_json())})
+            _write_atomic(snapshot_path(start, state, market, snapshot_dir=snapshot_dir),
+                          lambda path: _write_text(path, snapshot))
+    return meta
+
+
+def _latest_published():
+    # newest 5 min interval and predispatch run on NEMWEB
+    intervals = predispatch_daily.get_tradingis_reports_list().end.max()
+    runs = (predispatch_daily.get_predispatch_reports_list().start + pd.Timedelta('5min')).max()
+    return intervals, runs
+
+
+def needs_build(day, states=None, markets=None, latest=None, snapshot_dir=None):
+    '''
+    Whether any snapshot of day is missing, or not final and either older than data published since or half way
+    to MAX_AGE.
+    '''
+    start = _day(day)
+    end = start + pd.Timedelta('1d')
+    for market in markets or SNAPSHOT_MARKETS:
+        for state in states or price_store.REGIONS:
+            meta = read_meta(start, state, market, snapshot_dir)
+            if meta is None:
+                return True
+            if meta['final']:
+                continue
+            if latest is None:
+                # can't tell what has been published, so go by age
+                return time.time() - meta['built'] >= SNAPSHOT_INTERVAL
+            intervals, runs = latest
+            settled_until = pd.to_datetime(meta['settled_until'])
+            runs_until = pd.to_datetime(meta['runs_until'])
+            # rebuilt before readers stop accepting it, even if nothing new was published
+            if (pd.isna(settled_until) or pd.isna(runs_until) or time.time() - meta['built'] >= MAX_AGE / 2 or
+                min(intervals, end) > settled_until or min(runs, end - pd.Timedelta('30min')) > runs_until):
+                return True
+    return False
+
+
+def warm(days=None, states=None, markets=None, now=None, snapshot_dir=None):
+    '''
+    One scheduler pass: (re)builds the snapshots of the recent days that need it. Returns the days built.
+    '''
+    try:
+        latest = _latest_published()
+    except Exception as e:
+        print(f'Could not check for newly published data: {e!r}')
+        latest = None
+    built = []
+    for day in recent_days(days, now):
+        if needs_build(day, states, markets, latest, snapshot_dir):
+            build_snapshots(day, states, markets, snapshot_dir)
+            built.append(day)
+    return built
+
+
+def run_forever(interval=None, **warm_kwargs):
+    while True:
+        started = time.monotonic()
+        try:
+            built = warm(**warm_kwargs)
+            if built:
+                print(f'Chart snapshots built for {", ".join(f"{day:%Y-%m-%d}" for day in built)}')
+        except Exception as e:
+            print(f'Chart snapshot pass failed: {e!r}')
+        time.sleep(max(0, (interval or SNAPSHOT_INTERVAL) - (time.monotonic() - started)))
+
+
+def start_scheduler(interval=None):
+    '''
+    Starts run_forever in a daemon thread, once per process.
+    '''
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None or not _scheduler.is_alive():
+            _scheduler = threading.Thread(target=run_forever, args=(interval,), name='chart-snapshots', daemon=True)
+            _scheduler.start()
+    return _scheduler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Pre-render forecast vs actuals charts of recent days.')
+    parser.add_argument('command', choices=['warm', 'run'])
+    parser.add_argument('--days', type=int, default=None, help=f'number of recent days (default {SNAPSHOT_DAYS})')
+    parser.add_argument('--markets', nargs='+', default=None, help=f'default {",".join(SNAPSHOT_MARKETS)}')
+    parser.add_argument('--interval', type=float, default=None, help=f'seconds between passes (default {SNAPSHOT_INTERVAL:.0f})')
+    args = parser.parse_args(argv)
+    if args.command == 'warm':
+        built = warm(args.days, markets = args.markets)
+        print(f'Built snapshots for {len(built)} days')
+    else:
+        run_forever(args.interval, days = args.days, markets = args.markets)
+
+
+if __name__ == '__main__':
+    main()
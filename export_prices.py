@@ -0,0 +1,138 @@
+'''
+Command line bulk export of settled and predispatch prices, for headless jobs (no streamlit or plotly involved).
+
+    python export_prices.py --start 2022-01-01 --end 2022-07-01 --regions NSW VIC --format parquet --output-dir out
+
+writes out/settled_20220101_20220701.parquet and out/predispatch_20220101_20220701.parquet in the loader schemas
+(see get_trading_price_NEMWEB and get_predispatch_price_NEMWEB). The range is loaded a month at a time and appended
+to the output files, so long ranges do not have to fit in memory.
+'''
+
+import os
+import sys
+import argparse
+import pandas as pd
+import predispatch_daily
+
+DATASETS = ['settled', 'predispatch']
+FORMATS = ['parquet', 'csv']
+# predispatch runs of a month are loaded with this much of the next month so their horizons are complete
+PREDISPATCH_HORIZON = pd.Timedelta('2d')
+
+
+def month_chunks(start, end):
+    '''
+    Splits [start, end] at month starts into consecutive (chunk_start, chunk_end) pairs.
+    '''
+    edges = [start] + [month for month in pd.date_range(start, end, freq='MS') if start < month < end] + [end]
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def _load_chunk(dataset, chunk_start, chunk_end, end, use_store, progress_callback):
+    if dataset == 'settled':
+        return predispatch_daily.get_trading_price_NEMWEB(chunk_start, chunk_end, use_store = use_store,
+                                                          progress_callback = progress_callback)
+    # each run belongs to the chunk it starts in, the last chunk also keeps the runs starting at end
+    data = predispatch_daily.get_predispatch_price_NEMWEB(chunk_start, min(chunk_end + PREDISPATCH_HORIZON, end),
+                                                          use_store = use_store,
+                                                          progress_callback = progress_callback)
+    return data[(data.from_datetime < chunk_end) | (data.from_datetime == end)]
+
+
+def iter_prices(dataset, start, end, regions=None, markets=None, use_store=True, progress_callback=None):
+    '''
+    Yields dataset ('settled' or 'predispatch') for [start, end] a month at a time, with the same rows as a single
+    loader call over the whole range, keeping only regions and markets if given.
+    '''
+    start = pd.to_datetime(start)
+    end = pd.to_datetime(end)
+    for chunk_start, chunk_end in month_chunks(start, end):
+        data = _load_chunk(dataset, chunk_start, chunk_end, end, use_store, progress_callback)
+        if regions is not None:
+            data = data[data.region.isin(regions)]
+        if markets is not None:
+            data = data[data.market.isin(markets)]
+        yield data.reset_index(drop=True)
+
+
+def export_prices(dataset, start, end, path, file_format='parquet', regions=None, markets=None, use_store=True,
+                  progress_callback=None):
+    '''
+    Writes dataset for [start, end] to path as parquet or csv, one month at a time. Returns the number of rows.
+    The file is written next to path and only moved there once complete, so a failed export leaves no partial file.
+    '''
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    rows = 0
+    writer = None
+    empty = None
+    tmp_path = path + '.tmp'
+    try:
+        for data in iter_prices(dataset, start, end, regions, markets, use_store, progress_callback):
+            # plain strings so every month has the same schema
+            data = data.assign(region = data.region.astype(str), market = data.market.astype(str))
+            if len(data) == 0:
+                # months without any prices add nothing (and would give the parquet schema null columns)
+                empty = data
+                continue
+            if file_format == 'csv':
+                data.to_csv(tmp_path, mode = 'w' if rows == 0 else 'a', header = rows == 0, index = False)
+            else:
+                table = pa.Table.from_pandas(data, preserve_index = False)
+                if writer is None:
+                    writer = pq.ParquetWriter(tmp_path, table.schema)
+                writer.write_table(table)
+            rows += len(data)
+
+        if writer is not None:
+            writer.close()
+            writer = None
+        elif rows == 0 and empty is not None:
+            # still write a file with the columns
+            if file_format == 'csv':
+                empty.to_csv(tmp_path, index = False)
+            else:
+                empty.to_parquet(tmp_path, index = False)
+        if os.path.exists(tmp_path):
+            os.replace(tmp_path, path)
+    finally:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return rows
+
+
+def _print_progress(fraction, text):
+    sys.stderr.write(f'\r{text} {fraction:4.0%}')
+    sys.stderr.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export NEMWEB settled and predispatch prices to parquet or csv.')
+    parser.add_argument('--start', required=True)
+    parser.add_argument('--end', required=True)
+    parser.add_argument('--datasets', nargs='+', choices=DATASETS, default=DATASETS)
+    parser.add_argument('--regions', nargs='+', default=None, help='e.g. NSW VIC (default all)')
+    parser.add_argument('--markets', nargs='+', default=None, help='e.g. ENERGY RAISEREG (default all)')
+    parser.add_argument('--format', choices=FORMATS, default='parquet')
+    parser.add_argument('--output-dir', default='.')
+    parser.add_argument('--no-store', action='store_true', help='do not answer ranges from the local price store')
+    parser.add_argument('--quiet', action='store_true', help='no progress output')
+    args = parser.parse_args(argv)
+
+    start = pd.to_datetime(args.start)
+    end = pd.to_datetime(args.end)
+    os.makedirs(args.output_dir, exist_ok=True)
+    for dataset in args.datasets:
+        path = os.path.join(args.output_dir, f'{dataset}_{start:%Y%m%d}_{end:%Y%m%d}.{args.format}')
+        rows = export_prices(dataset, start, end, path, args.format, args.regions, args.markets,
+                             use_store = not args.no_store, progress_callback = None if args.quiet else _print_progress)
+        if not args.quiet:
+            sys.stderr.write('\n')
+        print(f'{path}: {rows} rows')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+'''
+Predispatch forecast accuracy over long horizons.
+
+Every forecast (one predispatch run's price for a half hour, region and market) is lined up with the settled
+30 min price of that half hour, and its error is accumulated by market, region, lead time (in half hours, 1 being
+the half hour the run starts) and hour of day (of the start of the half hour):
+
+    n, sum of absolute, signed and squared errors (forecast - settled),
+    number of settled spikes, forecast spikes and spikes that were forecast (hits)
+
+Months are processed independently in a process pool, each reading its runs and settled prices, joining them on a
+sorted integer key and reducing them to fixed size arrays, so memory does not grow with the length of the range.
+summarise() then rolls the statistics up to MAE, RMSE, bias and spike hit rate by any of the dimensions.
+
+By default prices are read from the local price store, so sync it first:
+
+    python price_store.py sync --start 2022-01-01 --end 2023-01-01
+    python forecast_accuracy.py --start 2022-01-01 --end 2023-01-01 --by lead region
+'''
+
+import os
+import argparse
+import multiprocessing
+import concurrent.futures
+import numpy as np
+import pandas as pd
+import price_store
+import price_frames
+
+MAX_PROCESSES = int(os.environ.get('NEMWEB_PARSE_PROCESSES', os.cpu_count() or 1))
+SPIKE_THRESHOLD = 300.0
+# predispatch looks at most ~40 hours ahead, longer leads are dropped
+MAX_LEAD = 96
+HOURS = 24
+STATISTICS = ['n', 'sum_abs_error', 'sum_error', 'sum_squared_error', 'settled_spikes', 'forecast_spikes', 'hits']
+
+
+def _month_bounds(start, end):
+    start = pd.to_datetime(start)
+    end = pd.to_datetime(end)
+    if start >= end:
+        return []
+    bounds = list(pd.date_range(start.floor('1d').replace(day=1), end, freq='MS'))
+    edges = [max(start, bounds[0])] + [b for b in bounds[1:] if b < end] + [end]
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def _load_month(start, end, regions, source):
+    # runs starting in [start, end) with their whole horizon, and settled prices far enough past end to score them
+    settled_end = end + pd.Timedelta(minutes=30 * MAX_LEAD)
+    if source == 'store':
+        settled = price_store.read_dataset('settled', start, settled_end, regions)
+        predispatch = price_store.read_dataset('predispatch', start, end, regions)
+    else:
+        import predispatch_daily
+        settled = predispatch_daily.get_trading_price_NEMWEB(start, settled_end, compact=True)
+        predispatch = predispatch_daily.get_predispatch_price_NEMWEB(start, settled_end, compact=True)
+    if len(settled) == 0 or len(predispatch) == 0:
+        # nothing to score (an empty store read has no columns to compact)
+        return None, None
+    predispatch = predispatch[(predispatch.from_datetime >= start) & (predispatch.from_datetime < end)]
+    return price_frames.compact_settled(settled), price_frames.compact_predispatch(predispatch)
+
+
+def _keys(interval_30, region_codes, market_codes):
+    # half hours since the epoch, region and market packed into one sortable int64
+    half_hours = interval_30.values.astype('datetime64[m]').astype(np.int64) // 30
+    return (half_hours * len(price_store.REGIONS) + region_codes) * len(price_store.MARKETS) + market_codes
+
+
+def settled_30min(settled):
+    '''
+    Mean settled price of each complete half hour (all six 5 min intervals present), per region and market.
+    '''
+    data = settled.assign(interval_30 = settled.interval_5.dt.ceil('30min'))
+    data = (data
+            .groupby(['interval_30', 'region', 'market'], observed=True)
+            .settled_5min.agg(['mean', 'size'])
+            .query('size == 6')
+            .reset_index()
+           )
+    return data.rename(columns = {'mean': 'settled_30min'}).drop(columns = 'size')
+
+
+def _no_statistics():
+    return np.zeros((len(STATISTICS), len(price_store.MARKETS), len(price_store.REGIONS), MAX_LEAD + 1, HOURS))
+
+
+def month_statistics(start, end, regions=None, markets=None, spike_threshold=SPIKE_THRESHOLD, source='store'):
+    '''
+    Error statistics of the runs starting in [start, end), as an array of shape
+    (len(STATISTICS), markets, regions, MAX_LEAD + 1, 24).
+    '''
+    statistics = _no_statistics()
+    settled, predispatch = _load_month(start, end, regions, source)
+    if settled is None:
+        return statistics
+    if markets is not None:
+        settled = settled[settled.market.isin(markets)]
+        predispatch = predispatch[predispatch.market.isin(markets)]
+    if len(settled) == 0 or len(predispatch) == 0:
+        return statistics
+
+    # sorted key join of each forecast to the settled price of its half hour
+    actuals = settled_30min(settled)
+    actual_keys = _keys(actuals.interval_30, actuals.region.cat.codes.values, actuals.market.cat.codes.values)
+    order = np.argsort(actual_keys, kind='mergesort')
+    actual_keys = actual_keys[order]
+    actual_prices = actuals.settled_30min.values[order].astype(np.float64)
+
+    lead = predispatch.horizon.values.astype(np.int64)
+    interval_30 = predispatch.from_datetime + pd.to_timedelta(lead * 30, unit='min')
+    region_codes = predispatch.region.cat.codes.values.astype(np.int64)
+    market_codes = predispatch.market.cat.codes.values.astype(np.int64)
+    forecast_keys = _keys(interval_30, region_codes, market_codes)
+    positions = np.minimum(np.searchsorted(actual_keys, forecast_keys), len(actual_keys) - 1)
+    matched = (actual_keys[positions] == forecast_keys) & (lead >= 1) & (lead <= MAX_LEAD)
+
+    forecast = predispatch.forecast_30min.values[matched].astype(np.float64)
+    actual = actual_prices[positions[matched]]
+    hour = (interval_30 - pd.Timedelta('30min')).dt.hour.values[matched]
+    cells = np.ravel_multi_index((market_codes[matched], region_codes[matched], lead[matched], hour),
+                                 statistics.shape[1:])
+
+    error = forecast - actual
+    settled_spike = actual >= spike_threshold
+    forecast_spike = forecast >= spike_threshold
+    size = statistics[0].size
+    for i, weights in enumerate([None, np.abs(error), error, error ** 2,
+                                 settled_spike, forecast_spike, settled_spike & forecast_spike]):
+        statistics[i] = np.bincount(cells, weights=weights, minlength=size).reshape(statistics.shape[1:])
+    return statistics
+
+
+def _init_worker():
+    # loaders running inside a worker parse in their download threads rather than starting another pool
+    import nemweb_fetch
+    nemweb_fetch.MAX_PROCESSES = 0
+
+
+def forecast_accuracy(start, end, regions=None, markets=None, spike_threshold=SPIKE_THRESHOLD, source='store',
+                      max_workers=None):
+    '''
+    Error statistics of the predispatch runs starting in [start, end), one row per market, region, lead and hour
+    with forecasts (columns STATISTICS). Months run in parallel over max_workers processes. source is 'store' to
+    read the local price store or 'nemweb' to go through the loaders. See summarise for the usual measures.
+    '''
+    import nemweb_fetch
+
+    months = _month_bounds(start, end)
+    # months without any prices add nothing, so a range with none gives an empty frame
+    total = _no_statistics()
+    kwargs = dict(regions=regions, markets=markets, spike_threshold=spike_threshold, source=source)
+    context = multiprocessing.get_context(nemweb_fetch.PROCESS_START_METHOD)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers or MAX_PROCESSES, initializer=_init_worker,
+                                                mp_context=context) as pool:
+        futures = [pool.submit(month_statistics, month_start, month_end, **kwargs) for month_start, month_end in months]
+        for future in concurrent.futures.as_completed(futures):
+            statistics = future.result()
+            total += statistics
+
+    index = pd.MultiIndex.from_product([pd.Categorical(price_store.MARKETS, categories=price_store.MARKETS),
+                                        pd.Categorical(price_store.REGIONS, categories=price_store.REGIONS),
+                                        np.arange(MAX_LEAD + 1), np.arange(HOURS)],
+                                       names=['market', 'region', 'lead', 'hour'])
+    data = pd.DataFrame(total.reshape(len(STATISTICS), -1).T, index=index, columns=STATISTICS)
+    data = data[data.n > 0].reset_index()
+    count_columns = ['n', 'settled_spikes', 'forecast_spikes', 'hits']
+    data[count_columns] = data[count_columns].astype(np.int64)
+    return data
+
+
+def summarise(statistics, by=('lead',)):
+    '''
+    Rolls statistics from forecast_accuracy up to the dimensions in by (any of market, region, lead, hour):
+    n, MAE, RMSE, bias (mean of forecast - settled), spike hit rate (share of settled spikes that were forecast)
+    and spike false alarm rate (share of forecast spikes that did not happen).
+    '''
+    data = statistics.groupby(list(by), observed=True)[STATISTICS].sum()
+    return (pd.DataFrame({'n': data.n,
+                          'mae': data.sum_abs_error / data.n,
+                          'rmse': np.sqrt(data.sum_squared_error / data.n),
+                          'bias': data.sum_error / data.n,
+                          'settled_spikes': data.settled_spikes,
+                          'spike_hit_rate': data.hits / data.settled_spikes.replace(0, np.nan),
+                          'spike_false_alarm_rate': 1 - data.hits / data.forecast_spikes.replace(0, np.nan)})
+            .reset_index()
+           )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Predispatch forecast accuracy.')
+    parser.add_argument('--start', required=True)
+    parser.add_argument('--end', required=True)
+    parser.add_argument('--by', nargs='+', default=['lead'], choices=['market', 'region', 'lead', 'hour'])
+    parser.add_argument('--market', nargs='+', default=['ENERGY'], help='markets to include (default ENERGY)')
+    parser.add_argument('--region', nargs='+', default=None)
+    parser.add_argument('--spike-threshold', type=float, default=SPIKE_THRESHOLD)
+    parser.add_argument('--source', choices=['store', 'nemweb'], default='store')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--output', help='write the summary to this csv file')
+    args = parser.parse_args(argv)
+
+    statistics = forecast_accuracy(args.start, args.end, args.region, args.market, args.spike_threshold,
+                                   args.source, args.workers)
+    summary = summarise(statistics, args.by)
+    if args.output:
+        summary.to_csv(args.output, index=False)
+    print(summary.to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
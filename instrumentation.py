@@ -0,0 +1,158 @@
+'''
+Lightweight per-stage timing of the pipeline.
+
+Stages are wrapped in spans that record their duration and any metrics (bytes, rows, ...) attached to them:
+
+    with instrumentation.span('download', url=url) as s:
+        content = ...
+        s['bytes'] = len(content)
+
+or with the @instrumentation.timed() decorator, which also records the number of rows of a returned frame.
+Finished spans are kept in a bounded buffer and handed to every active collector, whichever thread they were
+recorded in; spans recorded in worker processes are sent back with the results (see call_collecting).
+
+    with instrumentation.collect() as spans:
+        predispatch_daily.get_trading_price_NEMWEB(start, end)
+    instrumentation.summarise(spans)      # time, bytes and rows per stage
+    instrumentation.to_json(spans)
+
+Set NEMWEB_INSTRUMENT=0 to turn recording off.
+'''
+
+import os
+import json
+import time
+import functools
+import threading
+import contextlib
+import collections
+import pandas as pd
+
+ENABLED = os.environ.get('NEMWEB_INSTRUMENT', '1') != '0'
+MAX_SPANS = 10000
+
+# most recent finished spans, for looking at after the fact
+recent_spans = collections.deque(maxlen=MAX_SPANS)
+_collectors = []
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def _stack():
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def _finish(record):
+    with _lock:
+        recent_spans.append(record)
+        for collector in _collectors:
+            collector.append(record)
+
+
+@contextlib.contextmanager
+def span(name, **metrics):
+    '''
+    Times the enclosed block as stage name. Yields a dict of metrics that the block can add to.
+    '''
+    if not ENABLED:
+        yield {}
+        return
+    stack = _stack()
+    record = {'name': name, 'parent': stack[-1]['name'] if stack else None, 'thread': threading.current_thread().name,
+              'started': time.time(), 'duration_s': None, **metrics}
+    stack.append(record)
+    started = time.perf_counter()
+    try:
+        yield record
+    except BaseException as e:
+        record['error'] = repr(e)
+        raise
+    finally:
+        record['duration_s'] = time.perf_counter() - started
+        stack.pop()
+        _finish(record)
+
+
+def timed(name=None):
+    '''
+    Decorator recording each call of a function as a span (named after the function unless name is given),
+    with the number of rows of the result if it is a dataframe.
+    '''
+    def decorator(func):
+        stage = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage) as record:
+                result = func(*args, **kwargs)
+                if isinstance(result, pd.DataFrame):
+                    record['rows'] = len(result)
+                return result
+        return wrapper
+    return decorator
+
+
+@contextlib.contextmanager
+def collect():
+    '''
+    Collects the spans finished while the block runs, in any thread. Yields the list they are appended to.
+    '''
+    spans = []
+    with _lock:
+        _collectors.append(spans)
+    try:
+        yield spans
+    finally:
+        with _lock:
+            _collectors.remove(spans)
+
+
+def add_spans(spans):
+    '''
+    Records spans finished elsewhere (e.g. in a worker process).
+    '''
+    for record in spans:
+        _finish(record)
+
+
+def call_collecting(func, *args, **kwargs):
+    '''
+    Runs func in a worker process and returns (result, spans recorded during the call), for add_spans.
+    '''
+    with collect() as spans:
+        result = func(*args, **kwargs)
+    for record in spans:
+        record['thread'] = f'pid {os.getpid()} ' + record['thread']
+    return result, spans
+
+
+def summarise(spans):
+    '''
+    Per stage count, total and mean duration, and total bytes and rows, slowest stages first.
+    '''
+    columns = ['name', 'calls', 'total_s', 'mean_s', 'max_s', 'bytes', 'rows']
+    if not spans:
+        return pd.DataFrame(columns = columns)
+    data = pd.DataFrame(list(spans)).reindex(columns = ['name', 'duration_s', 'bytes', 'rows'])
+    return (data
+            .groupby('name')
+            .agg(calls = ('duration_s', 'size'), total_s = ('duration_s', 'sum'), mean_s = ('duration_s', 'mean'),
+                 max_s = ('duration_s', 'max'), bytes = ('bytes', 'sum'), rows = ('rows', 'sum'))
+            .sort_values(by = 'total_s', ascending = False)
+            .reset_index()
+            .filter(columns)
+           )
+
+
+def to_json(spans, path=None):
+    '''
+    Spans and their summary as json text, also written to path if given.
+    '''
+    text = json.dumps({'spans': list(spans), 'summary': summarise(spans).to_dict(orient = 'records')},
+                      indent = 1, default = str)
+    if path is not None:
+        with open(path, 'w') as f:
+            f.write(text)
+    return text
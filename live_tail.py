@@ -0,0 +1,131 @@
+'''
+Incremental updates of the prices of ranges that reach into today.
+
+The first request for such a range runs the normal loaders. After that, each range remembers the last settled
+interval (SETTLEMENTDATE) and the last predispatch run (PREDISPATCHSEQNO) it holds. A refresh then only fetches the
+TradingIS and Predispatch_Reports files published after those, appends them to the held frames and recomputes the
+30 min averages of the half hours the new intervals fall in.
+'''
+
+import threading
+import datetime
+import pandas as pd
+import predispatch_daily
+
+# (dataset, start, end) -> {'data': frame in the loader schema, 'last': last interval_5 / from_datetime held}
+_tails = {}
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def _tail_lock(key):
+    with _locks_lock:
+        return _locks.setdefault(key, threading.Lock())
+
+
+def _drop_finished_tails():
+    # ranges that ended before today will not get new data, the normal caches take over from here
+    today = pd.to_datetime(datetime.date.today())
+    for key in [key for key in _tails if key[2] <= today]:
+        _tails.pop(key, None)
+
+
+def update_settled_30min(price_data, since):
+    '''
+    Recomputes settled_30min for the half hours from the one containing since onwards, leaving earlier ones as is.
+    '''
+    affected = (price_data.interval_30 >= pd.to_datetime(since).ceil('30min')).values
+    keys = ['interval_30', 'region'] + (['market'] if 'market' in price_data.columns else [])
+    price_data.loc[affected, 'settled_30min'] = (price_data[affected]
+                                                 .groupby(by=keys, observed=True)['settled_5min']
+                                                 .transform('mean'))
+    return price_data
+
+
+def _new_settled_prices(last, end, progress_callback=None):
+    files = (predispatch_daily.get_tradingis_reports_list()
+             .query('end > @last')
+             .query('end <= @end')
+            )
+    tables = predispatch_daily.get_nemweb_files([dict(url = url, **predispatch_daily.TRADINGIS_PRICE_FILTER)
+                                                 for url in files.links.values],
+                                                progress_callback = predispatch_daily.progress_reporter(
+                                                    progress_callback, 'getting settled prices data...'))
+    if not tables:
+        return None
+    return (predispatch_daily.tidy_settled_prices(pd.concat(tables))
+            .query('interval_5 > @last')
+            .query('interval_5 <= @end')
+           )
+
+
+def _new_predispatch_prices(last, start, end, progress_callback=None):
+    files = (predispatch_daily.get_predispatch_reports_list()
+             .query('end > @last')
+             .query('end <= @end')
+            )
+    tables = predispatch_daily.get_nemweb_files([dict(url = url, **predispatch_daily.CURRENT_PD_FILTER)
+                                                 for url in files.links.values],
+                                                progress_callback = predispatch_daily.progress_reporter(
+                                                    progress_callback, 'getting forecast data...'))
+    if not tables:
+        return None
+    return (predispatch_daily.tidy_predispatch_prices(predispatch_daily.crunch_current_predispatch_data(pd.concat(tables)))
+            .query('from_datetime > @last')
+            .query('from_datetime <= @end')
+            .query('interval_30 >= @start')
+            .query('interval_30 <= @end')
+           )
+
+
+def get_settled_prices(start, end, progress_callback=None):
+    '''
+    get_trading_price_NEMWEB(start, end), topped up with only the TradingIS files published since the last call.
+    '''
+    start = pd.to_datetime(start)
+    end = pd.to_datetime(end)
+    key = ('settled', start, end)
+    with _tail_lock(key):
+        tail = _tails.get(key)
+        if tail is None:
+            _drop_finished_tails()
+            data = predispatch_daily.get_trading_price_NEMWEB(start, end, progress_callback=progress_callback)
+        else:
+            data = tail['data']
+            new_data = _new_settled_prices(tail['last'], end, progress_callback)
+            if new_data is not None and len(new_data) > 0:
+                data = (pd.concat([data, predispatch_daily.add_settled_30min(new_data)], ignore_index=True)
+                        .sort_values(by = ['interval_5','region','market'])
+                        .reset_index(drop=True)
+                       )
+                data = update_settled_30min(data, new_data.interval_5.min())
+        _tails[key] = {'data': data, 'last': data.interval_5.max() if len(data) else start}
+        return data.copy()
+
+
+def get_predispatch_prices(start, end, progress_callback=None):
+    '''
+    get_predispatch_price_NEMWEB(start, end), topped up with only the predispatch runs published since the last call.
+    '''
+    start = pd.to_datetime(start)
+    end = pd.to_datetime(end)
+    key = ('predispatch', start, end)
+    with _tail_lock(key):
+        tail = _tails.get(key)
+        if tail is None:
+            _drop_finished_tails()
+            data = predispatch_daily.get_predispatch_price_NEMWEB(start, end, progress_callback=progress_callback)
+        else:
+            data = tail['data']
+            new_data = _new_predispatch_prices(tail['last'], start, end, progress_callback)
+            if new_data is not None and len(new_data) > 0:
+                data = (pd.concat([data, new_data], ignore_index=True)
+                        .sort_values(by = ['from_datetime','interval_30','region','market'])
+                        .reset_index(drop=True)
+                       )
+        _tails[key] = {'data': data, 'last': data.from_datetime.max() if len(data) else start - pd.Timedelta('1h')}
+        return data.copy()
+
+
+def clear_tails():
+    _tails.clear()
@@ -0,0 +1,278 @@
+'''
+Persistent on-disk cache for the tables parsed by predispatch_daily.get_nemweb_file.
+
+Each parsed table is stored as a parquet file keyed on url + table filter + as_of, so repeat requests
+(including after a Streamlit restart) are served without any network traffic or csv parsing.
+The cache has a size budget and evicts the least recently used tables once it is exceeded.
+'''
+
+import os
+import json
+import hashlib
+import tempfile
+import pandas as pd
+import instrumentation
+
+CACHE_DIR = os.environ.get('NEMWEB_CACHE_DIR',
+                           os.path.join(os.path.expanduser('~'), '.cache', 'backtoNEMfuture', 'tables'))
+CACHE_MAX_BYTES = int(os.environ.get('NEMWEB_CACHE_MAX_BYTES', 2 * 1024**3))
+# bump when the format of parsed tables changes so stale entries are never served
+TABLE_FORMAT_VERSION = 3
+
+
+def is_immutable_url(url):
+    # MMSDM monthly archives never change once published
+    return 'data_archive' in url.lower()
+
+
+def make_cache_key(url, table_name='', filter_column_n=None, filter_value=None, as_of=None,
+                   members_start=None, members_end=None):
+    if as_of is not None:
+        as_of = pd.to_datetime(as_of).isoformat()
+    key_parts = [TABLE_FORMAT_VERSION, url, table_name.upper(), filter_column_n, filter_value, as_of]
+    # member ranges only appear in the key when used, so existing cache entries keep their keys
+    if members_start is not None or members_end is not None:
+        key_parts += [None if t is None else pd.to_datetime(t).isoformat() for t in (members_start, members_end)]
+    raw_key = json.dumps(key_parts)
+    return hashlib.sha1(raw_key.encode()).hexdigest()
+
+
+def _cache_paths(key, cache_dir=None):
+    cache_dir = cache_dir or CACHE_DIR
+    return (os.path.join(cache_dir, key + '.parquet'),
+            os.path.join(cache_dir, key + '.json'))
+
+
+def _file_checksum(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def remove_cached_table(key, cache_dir=None):
+    for path in _cache_paths(key, cache_dir):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def has_cached_table(key, cache_dir=None):
+    return all(os.path.exists(path) for path in _cache_paths(key, cache_dir))
+
+
+def cached_urls(cache_dir=None):
+    '''
+    Returns {key: url} of every table in the cache, so callers can tell which files they would not have to
+    download without asking NEMWEB.
+    '''
+    cache_dir = cache_dir or CACHE_DIR
+    if not os.path.isdir(cache_dir):
+        return {}
+    urls = {}
+    for entry in os.scandir(cache_dir):
+        if not entry.name.endswith('.json'):
+            continue
+        try:
+            with open(entry.path) as f:
+                urls[entry.name[:-len('.json')]] = json.load(f)['url']
+        except (OSError, ValueError, KeyError):
+            # being written or evicted right now
+            continue
+    return urls
+
+
+@instrumentation.timed('cache_read')
+def read_cached_table(key, cache_dir=None, filters=None):
+    '''
+    Returns the cached dataframe for key, or None on a miss.
+    filters (in pyarrow/parquet filter format) are pushed down to the parquet reader so only matching rows are loaded.
+    Entries for files that may be republished are checksummed before use; immutable archive entries are not.
+    '''
+    data_path, meta_path = _cache_paths(key, cache_dir)
+    if not (os.path.exists(data_path) and os.path.exists(meta_path)):
+        return None
+
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if not meta['immutable'] and _file_checksum(data_path) != meta['sha256']:
+            raise ValueError('checksum mismatch')
+        data = pd.read_parquet(data_path, filters=filters)
+    except Exception:
+        print(f'Discarding unreadable cache entry {key}')
+        remove_cached_table(key, cache_dir)
+        return None
+
+    # bump modification time so the entry counts as recently used for eviction
+    os.utime(data_path)
+    return data
+
+
+def _commit_cache_entry(key, tmp_path, url, cache_dir, max_bytes):
+    data_path, meta_path = _cache_paths(key, cache_dir)
+    os.replace(tmp_path, data_path)
+
+    immutable = is_immutable_url(url)
+    meta = {'url': url,
+            'immutable': immutable,
+            'sha256': None if immutable else _file_checksum(data_path),
+            'bytes': os.path.getsize(data_path)}
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+
+    evict_cache(max_bytes=max_bytes, cache_dir=cache_dir)
+
+
+def _new_tmp_path(cache_dir):
+    # written to a temporary file first so readers never see a half written table
+    os.makedirs(cache_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    os.close(fd)
+    return tmp_path
+
+
+@instrumentation.timed('cache_write')
+def write_cached_table(key, data, url, cache_dir=None, max_bytes=None):
+    cache_dir = cache_dir or CACHE_DIR
+    tmp_path = _new_tmp_path(cache_dir)
+    try:
+        data.columns = data.columns.astype(str).rename(None)
+        data.to_parquet(tmp_path)
+    except Exception as e:
+        print(f'Could not cache table from {url}: {e}')
+        os.remove(tmp_path)
+        return False
+
+    _commit_cache_entry(key, tmp_path, url, cache_dir, max_bytes)
+    return True
+
+
+def _null_columns(table):
+    return {name for name, column in zip(table.column_names, table.columns) if column.null_count == len(column)}
+
+
+def _widened_schema(schema, table, empty):
+    # schema grown to take table as well: new columns are added, numbers promoted (e.g. int64 to double) and
+    # columns with no values so far (empty) take the type of the first values they get
+    import pyarrow as pa
+
+    fields = {field.name: field for field in schema}
+    nulls = _null_columns(table)
+    for field in table.schema:
+        if field.name in nulls:
+            fields.setdefault(field.name, pa.field(field.name, pa.float64()))
+        elif field.name not in fields or field.name in empty:
+            fields[field.name] = field
+        elif field.type != fields[field.name].type:
+            fields[field.name] = pa.unify_schemas([pa.schema([fields[field.name]]), pa.schema([field])],
+                                                  promote_options='permissive').field(0)
+    return pa.schema(list(fields.values()))
+
+
+def _conformed(table, schema, empty=()):
+    # table with the columns of schema, missing and empty ones all null
+    import pyarrow as pa
+
+    arrays = [table.column(field.name).cast(field.type)
+              if field.name in table.column_names and field.name not in empty
+              else pa.nulls(len(table), field.type)
+              for field in schema]
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def _rewritten(path, writer, schema, empty):
+    # closes writer and copies what it wrote, one row group at a time, to a new writer for the wider schema
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer.close()
+    old_path = path + '.old'
+    os.replace(path, old_path)
+    try:
+        writer = pq.ParquetWriter(path, schema)
+        old_file = pq.ParquetFile(old_path)
+        for i in range(old_file.num_row_groups):
+            writer.write_table(_conformed(old_file.read_row_group(i), schema, empty))
+    finally:
+        os.remove(old_path)
+    return writer
+
+
+def cache_table_chunks(key, chunks, url, cache_dir=None, max_bytes=None):
+    '''
+    Passes chunks (an iterable of dataframes) through unchanged while appending them to a new cache entry for key,
+    so a table can be cached without ever being held in memory as a whole.
+    The entry is only committed once every chunk has been consumed. A chunk with columns the first ones did not
+    have, or did not have values for, or with ints where there were floats before, widens the entry's schema (the
+    rows written so far are copied over). If a chunk cannot be fitted to the schema, caching is abandoned but the
+    chunks keep flowing.
+    '''
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    cache_dir = cache_dir or CACHE_DIR
+    tmp_path = _new_tmp_path(cache_dir)
+    writer = None
+    # columns without any values so far, written as nulls of a stand in type
+    empty = set()
+    caching = True
+    try:
+        for chunk in chunks:
+            if caching:
+                try:
+                    chunk.columns = chunk.columns.astype(str).rename(None)
+                    table = pa.Table.from_pandas(chunk, preserve_index=False).replace_schema_metadata()
+                    old_schema = pa.schema([]) if writer is None else writer.schema
+                    schema = _widened_schema(old_schema, table, empty)
+                    if writer is None:
+                        writer = pq.ParquetWriter(tmp_path, schema)
+                    elif not schema.equals(old_schema):
+                        writer = _rewritten(tmp_path, writer, schema, empty)
+                    new_columns = set(schema.names) - set(old_schema.names)
+                    empty = (empty | new_columns) - (set(table.column_names) - _null_columns(table))
+                    writer.write_table(_conformed(table, schema))
+                except Exception as e:
+                    print(f'Could not cache table from {url}: {e}')
+                    caching = False
+            yield chunk
+
+        if caching and writer is not None:
+            writer.close()
+            writer = None
+            _commit_cache_entry(key, tmp_path, url, cache_dir, max_bytes)
+    finally:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def evict_cache(max_bytes=None, cache_dir=None):
+    '''
+    Removes least recently used tables until the cache fits in max_bytes. Returns the number of tables removed.
+    '''
+    cache_dir = cache_dir or CACHE_DIR
+    max_bytes = CACHE_MAX_BYTES if max_bytes is None else max_bytes
+    if not os.path.isdir(cache_dir):
+        return 0
+
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith('.parquet'):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.name[:-len('.parquet')]))
+
+    total_bytes = sum(size for _, size, _ in entries)
+    removed = 0
+    for _, size, key in sorted(entries):
+        if total_bytes <= max_bytes:
+            break
+        remove_cached_table(key, cache_dir)
+        total_bytes -= size
+        removed += 1
+    return removed
+
+
+def clear_cache(cache_dir=None):
+    return evict_cache(max_bytes=0, cache_dir=cache_dir)
@@ -0,0 +1,273 @@
+'''
+Bounded-concurrency download engine for NEMWEB files.
+
+Downloads run in a thread pool sharing one pooled requests.Session, while finished downloads are handed to a
+process pool for decoding, so the network stays busy while zips are being parsed.
+
+Large files (the monthly archives run to hundreds of MB) are streamed to a spool file on disk rather than held in
+memory. Failed requests are retried with exponential backoff, and a spooled download that drops part way through
+resumes from where it stopped with an HTTP Range request.
+'''
+
+import os
+import hashlib
+import tempfile
+import threading
+import contextlib
+import multiprocessing
+import concurrent.futures
+import requests
+from requests.adapters import HTTPAdapter
+import tenacity
+from tqdm import tqdm
+try:
+    import fcntl
+except ImportError:
+    # windows, where partial downloads are kept per process instead
+    fcntl = None
+import instrumentation
+import urllib3
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+MAX_DOWNLOADS = int(os.environ.get('NEMWEB_MAX_DOWNLOADS', 8))
+MAX_PROCESSES = int(os.environ.get('NEMWEB_PARSE_PROCESSES', os.cpu_count() or 1))
+SPOOL_DIR = os.environ.get('NEMWEB_SPOOL_DIR', os.path.join(tempfile.gettempdir(), 'backtoNEMfuture-spool'))
+DOWNLOAD_RETRIES = int(os.environ.get('NEMWEB_DOWNLOAD_RETRIES', 5))
+DOWNLOAD_TIMEOUT = float(os.environ.get('NEMWEB_DOWNLOAD_TIMEOUT', 60))
+DOWNLOAD_BLOCKSIZE = 1024 * 1024
+# workers are not forked from the (multi threaded) app, which could copy a lock held by another thread into them
+PROCESS_START_METHOD = os.environ.get('NEMWEB_PROCESS_START_METHOD',
+                                     'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+
+_session = None
+_process_pool = None
+_lock = threading.Lock()
+_spool_locks = {}
+
+
+def get_session():
+    '''
+    Returns the shared requests.Session, with a connection pool large enough for MAX_DOWNLOADS threads.
+    '''
+    global _session
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAX_DOWNLOADS)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.verify = False
+            _session = session
+    return _session
+
+
+def _get_process_pool():
+    global _process_pool
+    with _lock:
+        if _process_pool is None:
+            _process_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=MAX_PROCESSES, mp_context=multiprocessing.get_context(PROCESS_START_METHOD))
+    return _process_pool
+
+
+def _reset_process_pool():
+    global _process_pool
+    with _lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
+
+
+class IncompleteDownload(IOError):
+    pass
+
+
+def _is_retryable(exception):
+    # dropped connections, timeouts, short bodies and server side errors are worth another go, 404s are not
+    if isinstance(exception, requests.HTTPError):
+        return exception.response is not None and (exception.response.status_code >= 500 or
+                                                   exception.response.status_code == 429)
+    return isinstance(exception, (requests.ConnectionError, requests.Timeout,
+                                  requests.exceptions.ChunkedEncodingError, IncompleteDownload))
+
+
+_retry = tenacity.retry(retry = tenacity.retry_if_exception(_is_retryable),
+                        wait = tenacity.wait_exponential(multiplier=1, max=30),
+                        stop = tenacity.stop_after_attempt(DOWNLOAD_RETRIES),
+                        before_sleep = lambda state: print(f'Retrying request after: {state.outcome.exception()}'),
+                        reraise = True)
+
+
+@_retry
+def request(method, url, **kwargs):
+    '''
+    One request of the shared session with DOWNLOAD_TIMEOUT and the retry policy of downloads, for the small
+    requests around them (listings, HEAD). Server side errors (5xx, 429) are retried and raised if they persist,
+    any other response (e.g. a 304 or 404) is returned for the caller to deal with.
+    '''
+    response = get_session().request(method, url, timeout=DOWNLOAD_TIMEOUT, **kwargs)
+    if response.status_code >= 500 or response.status_code == 429:
+        response.raise_for_status()
+    return response
+
+
+@_retry
+def download_file(url):
+    '''
+    Returns the body of url, for files small enough to hold in memory.
+    '''
+    with instrumentation.span('download', url=url) as s:
+        response = get_session().get(url, timeout=DOWNLOAD_TIMEOUT)
+        response.raise_for_status()
+        s['bytes'] = len(response.content)
+    return response.content
+
+
+@_retry
+def _download_to_spool(url, path):
+    # appends the rest of url to path, asking only for the missing bytes if part of it is already there
+    offset = os.path.getsize(path) if os.path.exists(path) else 0
+    headers = {'Range': f'bytes={offset}-'} if offset else {}
+    with instrumentation.span('download', url=url, resumed_from=offset) as s, \
+         get_session().get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+        if response.status_code == 416:
+            # nothing left to send, the previous attempt got everything
+            return
+        response.raise_for_status()
+        if offset and response.status_code != 206:
+            # range ignored by the server, start again
+            offset = 0
+        expected = int(response.headers['Content-Length']) + offset if 'Content-Length' in response.headers else None
+        with open(path, 'ab' if offset else 'wb') as f:
+            for block in response.iter_content(DOWNLOAD_BLOCKSIZE):
+                f.write(block)
+        s['bytes'] = os.path.getsize(path) - offset
+    size = os.path.getsize(path)
+    if expected is not None and size < expected:
+        raise IncompleteDownload(f'{url}: got {size} of {expected} bytes')
+
+
+@contextlib.contextmanager
+def _partial_download(spool_dir, url):
+    # the resumable partial download of url, held by one thread of one process at a time. The app, the CLIs and
+    # process pools share the spool dir, so the thread lock is backed by a file lock across processes
+    name = hashlib.sha1(url.encode()).hexdigest()
+    if fcntl is None:
+        name += f'.{os.getpid()}'
+    path = os.path.join(spool_dir, name + '.part')
+    with _lock:
+        url_lock = _spool_locks.setdefault(path, threading.Lock())
+    with url_lock:
+        if fcntl is None:
+            yield path
+            return
+        with open(path[:-len('.part')] + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield path
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+@contextlib.contextmanager
+def spooled_download(url, spool_dir=None):
+    '''
+    Downloads url to a spool file and yields it opened for reading (e.g. by ZipFile), so peak memory does not grow
+    with the size of the file. The spool file is removed once the block exits; if the download fails the partial
+    file is kept and the next attempt at the same url, from any process, resumes from it.
+    '''
+    spool_dir = spool_dir or SPOOL_DIR
+    os.makedirs(spool_dir, exist_ok=True)
+    with _partial_download(spool_dir, url) as partial_path:
+        _download_to_spool(url, partial_path)
+        # moved to a name of its own so the partial is free for the next download while this one is being read
+        fd, path = tempfile.mkstemp(dir=spool_dir, suffix='.spool')
+        os.close(fd)
+        os.replace(partial_path, path)
+    try:
+        with open(path, 'rb') as f:
+            yield f
+    finally:
+        os.remove(path)
+
+
+def fetch_and_process(urls, process_func, kwargs_list=None, progress_callback=None,
+                      max_downloads=None, max_processes=None):
+    '''
+    Downloads every url and applies process_func(content, **kwargs) to each body.
+    Up to max_downloads requests are kept in flight while completed downloads are processed in a process pool
+    (or inline in the download threads if max_processes is 0).
+    Results are returned in the same order as urls. progress_callback(done, total) is called from the calling
+    thread after each file is processed, so it is safe to drive a Streamlit progress bar with it.
+    '''
+    urls = list(urls)
+    kwargs_list = [{}] * len(urls) if kwargs_list is None else list(kwargs_list)
+    max_downloads = MAX_DOWNLOADS if max_downloads is None else max_downloads
+    max_processes = MAX_PROCESSES if max_processes is None else max_processes
+    total = len(urls)
+    results = [None] * total
+    if total == 0:
+        return results
+
+    def download_and_process(url, kwargs):
+        return process_func(download_file(url), **kwargs)
+
+    process_pool = _get_process_pool() if max_processes > 0 else None
+    done = 0
+    with tqdm(total=total) as bar, concurrent.futures.ThreadPoolExecutor(max_workers=max_downloads) as threads:
+        # each pending future maps to (position in urls, stage)
+        pending = {}
+        for i, (url, kwargs) in enumerate(zip(urls, kwargs_list)):
+            if process_pool is None:
+                pending[threads.submit(download_and_process, url, kwargs)] = (i, 'processed')
+            else:
+                pending[threads.submit(download_file, url)] = (i, 'downloaded')
+
+        try:
+            while pending:
+                finished, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    i, stage = pending.pop(future)
+                    if stage == 'downloaded':
+                        # spans recorded while processing come back with the result
+                        pending[process_pool.submit(instrumentation.call_collecting, process_func, future.result(),
+                                                    **kwargs_list[i])] = (i, 'processed')
+                        continue
+                    if process_pool is None:
+                        results[i] = future.result()
+                    else:
+                        results[i], spans = future.result()
+                        instrumentation.add_spans(spans)
+                    done += 1
+                    bar.update(1)
+                    if progress_callback is not None:
+                        progress_callback(done, total)
+        except concurrent.futures.process.BrokenProcessPool:
+            _reset_process_pool()
+            raise
+        finally:
+            for future in pending:
+                future.cancel()
+
+    return results
+
+
+def run_concurrently(func, kwargs_list, progress_callback=None, max_workers=None):
+    '''
+    Calls func(**kwargs) for each entry of kwargs_list in a thread pool, for jobs that do their own downloading
+    (e.g. streaming a large archive). Results are returned in order and progress_callback(done, total) is called
+    from the calling thread as calls complete.
+    '''
+    kwargs_list = list(kwargs_list)
+    total = len(kwargs_list)
+    results = [None] * total
+    if total == 0:
+        return results
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers or MAX_DOWNLOADS) as threads:
+        futures = {threads.submit(func, **kwargs): i for i, kwargs in enumerate(kwargs_list)}
+        for done, future in enumerate(concurrent.futures.as_completed(futures), start=1):
+            results[futures[future]] = future.result()
+            if progress_callback is not None:
+                progress_callback(done, total)
+    return results
@@ -0,0 +1,142 @@
+'''
+Cached, conditional NEMWEB directory listings.
+
+The CURRENT report directories are large IIS autoindex pages that several helpers scrape on every page load.
+Listings are parsed once with a regular expression and the parsed copy is shared by all callers for LISTING_TTL
+seconds. After that the page is re-requested with If-None-Match / If-Modified-Since, so an unchanged listing
+only costs a 304 response.
+'''
+
+import os
+import re
+import time
+import threading
+import pandas as pd
+import nemweb_fetch
+import instrumentation
+
+LISTING_TTL = float(os.environ.get('NEMWEB_LISTING_TTL', 60))
+# base url of NEMWEB, can point to a mirror or a local stand-in (see benchmarks/nemweb_server.py)
+NEMWEB_HOST = os.environ.get('NEMWEB_URL', 'https://nemweb.com.au').rstrip('/')
+
+# one autoindex entry: "<br> Saturday, October 1, 2022  1:04 AM        19253 <A HREF="/path/file.zip">"
+_entry_pattern = re.compile(r'<br>\s*(\w+, \w+ \d+, \d{4}\s+\d+:\d+ [AP]M\s+\S+)\s*<a href="([^"]+)"', re.IGNORECASE)
+
+# url -> {'files': parsed dataframe, 'fetched': time.monotonic(), 'etag': ..., 'last_modified': ...}
+_listings = {}
+# url -> {'size': bytes or None if missing, 'checked': time.monotonic()}, see get_file_size
+_sizes = {}
+_locks = {}
+_locks_lock = threading.Lock()
+
+
+def parse_listing(html):
+    '''
+    Returns the raw (date text, link) entries of an autoindex page, excluding the link to the parent directory.
+    '''
+    entries = _entry_pattern.findall(html)
+    if entries:
+        return [dates for dates, _ in entries], [NEMWEB_HOST + link for _, link in entries]
+    return _parse_listing_bs4(html)
+
+
+def _parse_listing_bs4(html):
+    # slower fallback in case the page layout ever stops matching the regular expression
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(html, 'html.parser')
+
+    # dates are found between line breaks, links via 'a' elements
+    dates = [br.nextSibling for br in soup.findAll('br')]
+    links = []
+    for link in soup.find_all('a'):
+        link_string = link.get('href')
+        if not link_string is None:
+            link_string = NEMWEB_HOST + link_string
+        links.append(link_string)
+
+    # List of dates has an extra item on top (linking to parent directory) and an extra empty line at the bottom
+    # List of links has one link to remove at the start (that linking to the parent directory)
+    return dates[1:-1], links[1:]
+
+
+def _listing_to_frame(dates, links):
+    files = pd.DataFrame({'dates':dates, 'links':links})
+    files.links = files.links.str.lower()
+
+    # After creating our dataframe we extract the date in datetime format, and the size in bytes that follows it
+    date_and_size = files.dates.str.strip().str.rsplit(' ', n=1, expand=True)
+    files['date'] = pd.to_datetime(date_and_size[0])
+    files['size'] = pd.to_numeric(date_and_size[1], errors = 'coerce')
+
+    # Then query to only keep the zip files with data and drop duplicates
+    files = (files
+             .query("links.str.contains('.zip')", engine = 'python')
+             .sort_values(by = ['date','links'])
+             .drop_duplicates(subset='date',keep='first')
+             .sort_values(by = ['date','links'], ascending= [False,False])
+            )
+    return files
+
+
+def _url_lock(url):
+    with _locks_lock:
+        return _locks.setdefault(url, threading.Lock())
+
+
+@instrumentation.timed('listing')
+def get_directory_listing(url, ttl=None):
+    '''
+    Returns the parsed listing of a NEMWEB directory (columns dates, links, date and size, newest first).
+    Callers get their own copy of the shared parsed listing, so they are free to add columns to it.
+    '''
+    ttl = LISTING_TTL if ttl is None else ttl
+    with _url_lock(url):
+        cached = _listings.get(url)
+        if cached is not None and time.monotonic() - cached['fetched'] < ttl:
+            return cached['files'].copy()
+
+        headers = {}
+        if cached is not None:
+            if cached['etag']:
+                headers['If-None-Match'] = cached['etag']
+            if cached['last_modified']:
+                headers['If-Modified-Since'] = cached['last_modified']
+
+        # with a timeout and retries, so a stalled connection can't hold up everyone waiting on this lock for good
+        response = nemweb_fetch.request('GET', url, headers=headers)
+        if response.status_code == 304 and cached is not None:
+            cached['fetched'] = time.monotonic()
+            return cached['files'].copy()
+        response.raise_for_status()
+
+        files = _listing_to_frame(*parse_listing(response.text))
+        _listings[url] = {'files': files,
+                          'fetched': time.monotonic(),
+                          'etag': response.headers.get('ETag'),
+                          'last_modified': response.headers.get('Last-Modified')}
+        return files.copy()
+
+
+def get_file_size(url):
+    '''
+    Size in bytes of a NEMWEB file from a HEAD request (nan if the server does not say), or None if the file is not
+    there (yet). Any other error is raised, after the retries of nemweb_fetch.request. Sizes are remembered for the
+    life of the process since published files do not change, missing files for LISTING_TTL seconds.
+    '''
+    cached = _sizes.get(url)
+    if cached is not None and (cached['size'] is not None or time.monotonic() - cached['checked'] < LISTING_TTL):
+        return cached['size']
+    with instrumentation.span('head', url=url):
+        response = nemweb_fetch.request('HEAD', url, allow_redirects=True)
+    if response.status_code == 404:
+        size = None
+    else:
+        response.raise_for_status()
+        size = float(response.headers.get('Content-Length', 'nan'))
+    _sizes[url] = {'size': size, 'checked': time.monotonic()}
+    return size
+
+
+def clear_listings():
+    _listings.clear()
+    _sizes.clear()
@@ -1,176 +1,278 @@
 import pandas as pd
 import numpy as np
 import datetime
-import requests
-from bs4 import BeautifulSoup
 import os
 from zipfile import ZipFile
 import io
-from tqdm import tqdm
-import plotly.express as px
 import urllib3
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-import functools
-import streamlit as st
-
-@functools.lru_cache(maxsize=None, typed=False)
-def get_nemweb_file(url, table_name='', filter_column_n = None, filter_value = None, as_of=None):
-    # sourcery skip: use-fstring-for-concatenation
+import aemo_csv
+import nemweb_cache
+import nemweb_fetch
+import nemweb_listing
+import price_store
+import price_frames
+import source_planner
+import zip_index
+import instrumentation
+
+@instrumentation.timed()
+def parse_nemweb_zip(content, table_name='', filter_column_n = None, filter_value = None, as_of=None,
+                     members_start=None, members_end=None, url=None):
     '''
-    By default the function will filter the resultant file by the third column (assumed to contain the table_name).
-    If specified, however, you can filter any column by specifying the column by position (using filter_column_n)
-    and value (using filter_value)
+    Parses a downloaded NEMWEB zip file, given as bytes or an open binary file (see get_nemweb_file for the
+    filtering arguments). Kept separate from the download so it can run in a worker process.
     '''
-    
-    assert url[-3:] =='zip', 'Expect a zip file in url.'
-
     # Capitalise table name
     table_name = table_name.upper()
 
-    # Download file and open zip
-    file = requests.get(url, verify = False)
-    z = ZipFile(io.BytesIO(file.content))
-
-    # Set list of files as a dataframe:
-    files_df = pd.DataFrame(data = z.namelist(), columns = ['filename'])
+    # Open zip
+    z = ZipFile(io.BytesIO(content) if isinstance(content, bytes) else content)
 
-    # if as_of is defined we create timestamps for each file and pick the nearest one
+    # if as_of or a time range is defined only the matching members (by the timestamps in their names) are read
     if as_of is not None:
-        as_of = pd.to_datetime(as_of)
+        filenames = [zip_index.member_as_of(zip_index.get_index(z, url), as_of)]
+    elif members_start is not None or members_end is not None:
+        filenames = zip_index.members_between(zip_index.get_index(z, url), members_start, members_end)
+    else:
+        filenames = z.namelist()
 
-        try:
-            files_df['timestamp'] = pd.to_datetime(files_df.filename.apply(lambda x: x.rsplit('_',1)[-1].rsplit('.')[0]))
-        except Exception:
-            files_df['timestamp'] = pd.to_datetime(files_df.filename.apply(lambda x: x.rsplit('_',2)[-2]))
+    # Slice to only include the table we want
+    if filter_column_n is None or filter_value is None:
+        filter_column_n, filter_value = 3, table_name
 
-        files_df.set_index('timestamp',inplace=True)
-        files_df = pd.DataFrame(files_df.iloc[files_df.index.get_loc(as_of, method='ffill')]).T
-
-    # Create a list of dummy columns names (numbers 1 through 300) to place as column headers for multi-table and multi-headers csvs
-    dummy_cols = ['col_'+ str(x).zfill(3) for x in np.arange(1,300)]    
-
-    # Initialise list of resultant files
+    # Stream each file, keeping only the records of the requested table
     all_files = []
+    for filename in filenames:
+        all_files.extend(aemo_csv.iter_zip_member_chunks(z, filename, filter_column_n, filter_value))
 
-    # Open file
-    for filename in files_df.filename:
-        df = (pd.read_csv(z.open(filename),
-                          compression = 'zip' if filename[-3:]== 'zip' else 'infer',
-                          names = dummy_cols,  engine='python')
-             )
-        # Slice to only include the table we want
-        if not filter_column_n is None and not filter_value is None:
-            column_str = 'col_' + str(filter_column_n).zfill(3)
-            df = (df
-                  .query(f'{column_str} == "{filter_value}"')
-                 )
-        else:
-            df = (df
-                  .query(f'col_003 == "{table_name}"')
-                 )
+    # Concatenate all files
+    if not all_files:
+        return pd.DataFrame()
+    data = pd.concat(all_files)
 
-        # Set actual headers to first row
-        df.columns = df.iloc[0]
+    return data
 
-        # Remove redundant header row and empty/dummy columns
-        df = (df[1:]
-                .dropna(axis=1, how='all')
-               )
+@instrumentation.timed()
+def get_nemweb_file(url, table_name='', filter_column_n = None, filter_value = None, as_of=None,
+                    members_start=None, members_end=None, use_cache=True):
+    '''
+    By default the function will filter the resultant file by the third column (assumed to contain the table_name).
+    If specified, however, you can filter any column by specifying the column by position (using filter_column_n)
+    and value (using filter_value)
+    For zips bundling many timestamped reports, as_of picks the latest report published at or before as_of and
+    members_start / members_end the reports published within that range; other members are not decompressed.
+    Parsed tables are kept in a persistent on-disk cache (see nemweb_cache) unless use_cache is False.
+    '''
+    
+    assert url[-3:] =='zip', 'Expect a zip file in url.'
 
-        # Append to list of all files
-        all_files.append(df)
+    cache_key = nemweb_cache.make_cache_key(url, table_name, filter_column_n, filter_value, as_of,
+                                            members_start, members_end)
+    if use_cache:
+        data = nemweb_cache.read_cached_table(cache_key)
+        if data is not None:
+            return data
 
-    # Concatenate all files
-    data = pd.concat(all_files)
+    # Download file to disk and parse it from there
+    with nemweb_fetch.spooled_download(url) as f:
+        data = parse_nemweb_zip(f, table_name, filter_column_n, filter_value, as_of,
+                                members_start, members_end, url)
 
-    # Change values to numeric where possible
-    data = data.apply(pd.to_numeric, errors='ignore')
+    if use_cache:
+        nemweb_cache.write_cached_table(cache_key, data, url)
 
     return data
 
-def get_files_list_nemweb_directory(url, verify=False):
-    reqs = requests.get(url, verify = verify)
-    soup = BeautifulSoup(reqs.text, 'html.parser')
-    
-    # dates are found between line breaks
-    dates = []
-    for br in soup.findAll('br'):
-        next_s = br.nextSibling
-        dates.append(next_s)
-    
-    # links are found more easily via 'a' elements
-    links = []
-    for link in soup.find_all('a'):
-        link_string = link.get('href')
-        if not link_string is None:
-            link_string = 'https://nemweb.com.au' + link_string
-        links.append(link_string)
-    
-    # List of dates has an extra item on top (linking to parent directory) and an extra empty line at the bottom
-    # so we slice the list using [1:-1]
-    # List of links has one link to remove at the start (that linking to the parent directory) so we slice
-    # the list using [1:]
-    files = pd.DataFrame({'dates':dates[1:-1], 'links':links[1:]})
-    files.links = files.links.str.lower()
-            
-    # After creating our dataframe we extract the date in datetime format
-    files['date'] = pd.to_datetime(files.dates.str.rsplit(' ', n=2, expand=True)[0])
-    
-    # Then query to only keep the zip files with data and drop duplicates
-    files = (files
-             .query("links.str.contains('.zip')", engine = 'python')
-             .sort_values(by = ['date','links'])
-             .drop_duplicates(subset='date',keep='first')
-             .sort_values(by = ['date','links'], ascending= [False,False])
-            )
-    return files
+@instrumentation.timed()
+def get_nemweb_files(jobs, progress_callback=None, use_cache=True):
+    '''
+    Concurrent version of get_nemweb_file. jobs is a list of dicts of get_nemweb_file arguments (url, table_name,
+    filter_column_n, filter_value, as_of, members_start, members_end). Cached tables are served straight away, the rest are downloaded and
+    parsed in parallel by nemweb_fetch. Tables are returned in the same order as jobs and
+    progress_callback(done, total) is called as each one becomes available.
+    '''
+    jobs = [dict(job) for job in jobs]
+    num_jobs = len(jobs)
+    tables = [None] * num_jobs
+    missing = []
+    for i, job in enumerate(jobs):
+        assert job['url'][-3:] =='zip', 'Expect a zip file in url.'
+        job['cache_key'] = nemweb_cache.make_cache_key(**{k:v for k,v in job.items() if k != 'cache_key'})
+        if use_cache:
+            tables[i] = nemweb_cache.read_cached_table(job['cache_key'])
+        if tables[i] is None:
+            missing.append(i)
+
+    num_cached = num_jobs - len(missing)
+
+    def report_progress(done, total):
+        if progress_callback is not None:
+            progress_callback(num_cached + done, num_jobs)
+
+    if num_cached > 0:
+        report_progress(0, len(missing))
+
+    parse_kwargs = [{k:v for k,v in jobs[i].items() if k != 'cache_key'} for i in missing]
+    parsed = nemweb_fetch.fetch_and_process([jobs[i]['url'] for i in missing],
+                                            parse_nemweb_zip,
+                                            kwargs_list = parse_kwargs,
+                                            progress_callback = report_progress)
+    for i, data in zip(missing, parsed):
+        if use_cache:
+            nemweb_cache.write_cached_table(jobs[i]['cache_key'], data, jobs[i]['url'])
+        tables[i] = data
+
+    return tables
+
+def progress_reporter(progress_callback, text, offset=0, total=None):
+    '''
+    Adapts a loader's progress_callback(fraction, text) to the (done, total) callbacks of get_nemweb_files and
+    nemweb_fetch, for a batch that starts offset files into a load of total files (the batch's own total by default).
+    progress_callback has the signature of streamlit's progress bar .progress, so one can be passed directly.
+    '''
+    if progress_callback is None:
+        return None
+    def report(done, batch_total):
+        num_files = total or batch_total
+        progress_callback(min((offset + done) / num_files, 1.0) if num_files else 1.0, text)
+    return report
+
+# rows per chunk when streaming large files (NEMWEB_CHUNKSIZE). A chunk's raw csv lines are held alongside the frame
+# parsed from them, so this rather than the size of the file sets the peak memory of a load
+CHUNKSIZE = int(os.environ.get('NEMWEB_CHUNKSIZE', 20_000))
+
+def filter_frame(df, filters):
+    '''
+    Applies filters given in the pyarrow/parquet format (a list of (column, op, value) tuples that are and-ed
+    together) to a dataframe, so the same predicates can be pushed down to parquet reads and applied to csv chunks.
+    '''
+    ops = {'==': lambda s, v: s == v,
+           '!=': lambda s, v: s != v,
+           '>': lambda s, v: s > v,
+           '>=': lambda s, v: s >= v,
+           '<': lambda s, v: s < v,
+           '<=': lambda s, v: s <= v,
+           'in': lambda s, v: s.isin(v)}
+    if not filters:
+        return df
+    mask = np.ones(len(df), dtype=bool)
+    for column, op, value in filters:
+        mask &= ops[op](df[column], value).values
+    return df[mask]
+
+def iter_nemweb_file_chunks(url, table_name='', filter_column_n = None, filter_value = None, filters=None,
+                            chunksize=None, use_cache=True):
+    '''
+    Generator version of get_nemweb_file for large (e.g. monthly archive) files. Yields the table in chunks of at
+    most chunksize rows (CHUNKSIZE by default), keeping only rows matching filters (see filter_frame), so the whole
+    table is never held in memory. Cached tables are read with the filters pushed down to parquet; otherwise the
+    file is streamed and written to the cache chunk by chunk as it is read.
+    '''
+    assert url[-3:] =='zip', 'Expect a zip file in url.'
 
-def get_public_prices_list():
-    df = get_files_list_nemweb_directory('http://nemweb.com.au/reports/CURRENT/Public_Prices/')
-    df['start'] = df.links.str.split('_',).apply(lambda x: pd.to_datetime(x[-2]))
-    df['end'] = pd.to_datetime(df.links.str.split('_').apply(lambda x: x[-1]).str.replace('.zip','',regex=False))
+    # same key as get_nemweb_file so both share cached tables
+    cache_key = nemweb_cache.make_cache_key(url, table_name, filter_column_n, filter_value)
+    if use_cache:
+        data = nemweb_cache.read_cached_table(cache_key, filters=filters)
+        if data is not None:
+            yield data
+            return
+
+    if filter_column_n is None or filter_value is None:
+        filter_column_n, filter_value = 3, table_name.upper()
+    chunksize = chunksize or CHUNKSIZE
+
+    with nemweb_fetch.spooled_download(url) as f:
+        z = ZipFile(f)
+        chunks = (chunk
+                  for filename in z.namelist()
+                  for chunk in aemo_csv.iter_zip_member_chunks(z, filename, filter_column_n, filter_value, chunksize))
+        if use_cache:
+            chunks = nemweb_cache.cache_table_chunks(cache_key, chunks, url)
+        for chunk in chunks:
+            yield filter_frame(chunk, filters)
+
+def get_files_list_nemweb_directory(url, verify=False):
+    '''
+    Listing of the zip files in a NEMWEB directory, newest first. Listings are cached and shared between all
+    helpers for nemweb_listing.LISTING_TTL seconds, then revalidated with a conditional request.
+    '''
+    return nemweb_listing.get_directory_listing(url)
+
+def get_public_prices_list(files=None):
+    # files: a frame of links to use instead of the directory listing (e.g. the cached ones, see source_planner)
+    if files is None:
+        files = get_files_list_nemweb_directory(f'{nemweb_listing.NEMWEB_HOST}/reports/CURRENT/Public_Prices/')
+    df = files.copy()
+    df['start'] = pd.to_datetime(df.links.str.split('_').str[-2], format='%Y%m%d%H%M')
+    df['end'] = pd.to_datetime(df.links.str.split('_').str[-1].str.replace('.zip','',regex=False))
     return df
 
-def get_tradingis_reports_list():
-    df = get_files_list_nemweb_directory('http://nemweb.com.au/reports/CURRENT/TradingIS_Reports/')
-    df['start'] = df.links.str.split('_',).apply(lambda x: pd.to_datetime(x[-2])) - pd.Timedelta('5min')
+def get_tradingis_reports_list(files=None):
+    # files: a frame of links to use instead of the directory listing (e.g. the cached ones, see source_planner)
+    if files is None:
+        files = get_files_list_nemweb_directory(f'{nemweb_listing.NEMWEB_HOST}/reports/CURRENT/TradingIS_Reports/')
+    df = files.copy()
+    df['start'] = pd.to_datetime(df.links.str.split('_').str[-2], format='%Y%m%d%H%M') - pd.Timedelta('5min')
     df['end'] = df.start + pd.Timedelta('5min')
     return df
 
-def get_predispatch_reports_list():
-    df = get_files_list_nemweb_directory('http://nemweb.com.au/reports/CURRENT/Predispatch_Reports/')
-    df['start'] = (df.links
-                   .str.replace('_LEGACY','')
-                   .str.split('_',).apply(lambda x: pd.to_datetime(x[-2])) - pd.Timedelta('5min')
-                  )
+def get_predispatch_reports_list(files=None):
+    # files: a frame of links to use instead of the directory listing (e.g. the cached ones, see source_planner)
+    if files is None:
+        files = get_files_list_nemweb_directory(f'{nemweb_listing.NEMWEB_HOST}/reports/CURRENT/Predispatch_Reports/')
+    df = files.copy()
+    # links are lowercased, the run time is the second last part once the _LEGACY suffix is gone
+    df['start'] = pd.to_datetime(df.links
+                                 .str.replace('_LEGACY','', case=False, regex=True)
+                                 .str.split('_').str[-2], format='%Y%m%d%H%M') - pd.Timedelta('5min')
     df['end'] = df.start + pd.Timedelta('5min')
     return df
 
 def get_earliest_current_pd_date():
-    current_pd_files = (get_files_list_nemweb_directory('http://nemweb.com.au/reports/CURRENT/Predispatch_Reports/')
+    current_pd_files = (get_files_list_nemweb_directory(f'{nemweb_listing.NEMWEB_HOST}/reports/CURRENT/Predispatch_Reports/')
                         .sort_values(by = ['date'])
                        )
     earliest_pd_file = pd.to_datetime(current_pd_files.iloc[0,:].links.split('_')[-3])
     return earliest_pd_file
     
 
+def _mmsdm_url(month, folder, table):
+    month = pd.to_datetime(month)
+    y, m = f'{month.year}', f'{month.month:02d}'
+    return (f'{nemweb_listing.NEMWEB_HOST}/Data_Archive/Wholesale_Electricity/MMSDM/{y}/MMSDM_{y}_{m}/'
+            f'MMSDM_Historical_Data_SQLLoader/{folder}/PUBLIC_DVD_{table}_{y}{m}010000.zip')
+
+def dispatch_price_archive_url(month):
+    '''
+    Url of the MMSDM DISPATCHPRICE archive of the month containing month.
+    '''
+    return _mmsdm_url(month, 'DATA', 'DISPATCHPRICE')
+
+def predispatch_price_archive_url(month):
+    '''
+    Url of the MMSDM PREDISPATCHPRICE archive of the month containing month.
+    '''
+    return _mmsdm_url(month, 'PREDISP_ALL_DATA', 'PREDISPATCHPRICE')
+
 def get_required_pd_files_list(start, end):
     start = pd.to_datetime(start)
     end = pd.to_datetime(end)
     all_links_df = pd.DataFrame(columns = ['url','source'])
-    if start < get_earliest_current_pd_date():
+    earliest_current_pd_date = get_earliest_current_pd_date()
+    if start < earliest_current_pd_date:
         years_and_dates = pd.DataFrame({'dates':pd.date_range(start,end, freq = '1d')})
         years_and_dates['year'] = years_and_dates.dates.dt.year.astype(str)
         years_and_dates['month'] = years_and_dates.dates.dt.month.astype(str).str.zfill(2)
         years_and_dates = years_and_dates.drop_duplicates(subset=['year','month'])
-        link_prefix = r'http://nemweb.com.au/Data_Archive/Wholesale_Electricity/MMSDM'
-        years_and_dates['url_links'] = years_and_dates.apply(lambda df:f'{link_prefix}/{df.year}/MMSDM_{df.year}_{df.month}/MMSDM_Historical_Data_SQLLoader/PREDISP_ALL_DATA/PUBLIC_DVD_PREDISPATCHPRICE_{df.year}{df.month}010000.zip',axis=1 )
+        years_and_dates['url_links'] = years_and_dates.dates.apply(predispatch_price_archive_url)
         archive_links = list(years_and_dates.url_links)
         archive_links_df = pd.DataFrame({'url':archive_links})
         archive_links_df['source'] = 'archive'
         all_links_df = pd.concat([all_links_df,archive_links_df])
         
-    if end > get_earliest_current_pd_date():
+    if end > earliest_current_pd_date:
         adjusted_start = start - pd.Timedelta('1h')
         files_list = (get_predispatch_reports_list()
                       .query('start >= @adjusted_start')
@@ -189,10 +291,33 @@ def get_required_pd_files_list(start, end):
         
     return all_links_df
 
-def crunch_current_predispatch_file(url):
-    data = (get_nemweb_file(url,filter_column_n = 2, filter_value = 'PDREGION')
-        .dropna(axis=1)
-        .filter(['PREDISPATCHSEQNO','PERIODID','REGIONID','RRP'])
+# price columns of each market in the DISPATCH/PREDISPATCH region price tables
+MARKETS = price_store.MARKETS
+MARKET_COLUMNS = {('RRP' if market == 'ENERGY' else market + 'RRP'): market for market in MARKETS}
+
+def melt_markets(data, id_columns, value_name):
+    '''
+    Turns the energy and FCAS price columns of data into one row per market, with region and market as
+    categoricals. Markets missing from data (e.g. the 1 second FCAS markets in older files) are left out.
+    '''
+    data = data.assign(region = pd.Categorical(data.region, categories = price_store.REGIONS))
+    value_columns = [column for column in MARKET_COLUMNS if column in data.columns]
+    data = data.melt(id_vars = id_columns, value_vars = value_columns, var_name = 'market', value_name = value_name)
+    data['market'] = pd.Categorical(data.market.map(MARKET_COLUMNS), categories = MARKETS)
+    data[value_name] = data[value_name].astype(float)
+    return data.dropna(subset = [value_name])
+
+# get_nemweb_file filters for each source table
+CURRENT_PD_FILTER = dict(filter_column_n = 2, filter_value = 'PDREGION')
+ARCHIVE_PD_FILTER = dict(filter_column_n = 3, filter_value = 'REGION_PRICES')
+ARCHIVE_PRICE_FILTER = dict(filter_column_n = 3, filter_value = 'PRICE')
+PUBLIC_PRICES_FILTER = dict(filter_column_n = 2, filter_value = 'DREGION')
+TRADINGIS_PRICE_FILTER = dict(table_name = 'PRICE')
+
+@instrumentation.timed()
+def crunch_current_predispatch_data(data):
+    data = (data
+        .filter(['PREDISPATCHSEQNO','PERIODID','REGIONID'] + list(MARKET_COLUMNS))
         .rename(columns = {'PREDISPATCHSEQNO':'from_datetime','PERIODID':'interval_30'})
        )
     data.REGIONID = data.REGIONID.str.replace('1','')
@@ -200,10 +325,13 @@ def crunch_current_predispatch_file(url):
     data.from_datetime = pd.to_datetime(data.from_datetime, yearfirst=True)
     return data
 
-def crunch_archive_predispatch_file(url):
-    data = (get_nemweb_file(url,filter_column_n = 3, filter_value = 'REGION_PRICES')
-        .dropna(axis=1)
-        .filter(['LASTCHANGED','DATETIME','REGIONID','RRP'])
+def crunch_current_predispatch_file(url):
+    return crunch_current_predispatch_data(get_nemweb_file(url, **CURRENT_PD_FILTER))
+
+@instrumentation.timed()
+def crunch_archive_predispatch_data(data):
+    data = (data
+        .filter(['LASTCHANGED','DATETIME','REGIONID'] + list(MARKET_COLUMNS))
         .rename(columns = {'DATETIME':'interval_30','LASTCHANGED':'from_datetime'})
        )
     data.interval_30 = pd.to_datetime(data.interval_30, yearfirst = True)
@@ -211,67 +339,138 @@ def crunch_archive_predispatch_file(url):
     data.REGIONID = data.REGIONID.str.replace('1','')
     return data
 
-
+def _window_filters(column, start=None, end=None, margin='0min'):
+    filters = []
+    if start is not None:
+        filters.append((column, '>=', pd.to_datetime(start) - pd.Timedelta(margin)))
+    if end is not None:
+        filters.append((column, '<=', pd.to_datetime(end) + pd.Timedelta(margin)))
+    return filters
+
+def _region_filters(regions):
+    if regions is None:
+        return []
+    return [('REGIONID', 'in', [region + '1' for region in regions])]
+
+@instrumentation.timed()
+def crunch_archive_predispatch_file(url, start=None, end=None, regions=None):
+    '''
+    If any of start, end or regions are given the monthly archive is streamed in chunks and only rows in the
+    time window / regions are kept, instead of loading the whole month.
+    '''
+    if start is None and end is None and regions is None:
+        return crunch_archive_predispatch_data(get_nemweb_file(url, **ARCHIVE_PD_FILTER))
+
+    # LASTCHANGED is floored to the half hour once read, so its window gets half an hour of slack
+    filters = (_window_filters('DATETIME', start, end) +
+               _window_filters('LASTCHANGED', start, end, margin = '30min') +
+               _region_filters(regions))
+    files_data = [crunch_archive_predispatch_data(chunk)
+                  for chunk in iter_nemweb_file_chunks(url, filters = filters, **ARCHIVE_PD_FILTER)]
+    return pd.concat(files_data)
+
+@instrumentation.timed()
 def get_predispatch_price_NEMWEB(start = datetime.date.today(),
-                                 end = datetime.date.today() + datetime.timedelta(days=1)):
-    
-    
+                                 end = datetime.date.today() + datetime.timedelta(days=1),
+                                 use_store = True,
+                                 compact = False,
+                                 progress_callback = None,
+                                 arrow = False):
+    '''
+    Predispatch runs with from_datetime and interval_30 within [start, end], in the long predispatch price schema.
+    compact = True returns the memory compact form instead (see price_frames), arrow = True the same as a pyarrow
+    Table (see price_arrow).
+    progress_callback(fraction, text) is called as files are loaded (see progress_reporter).
+    '''
     pd_data = None
     start = pd.to_datetime(start)
     end = pd.to_datetime(end)
     #TODO FIND ACTUAL START LIMIT
     assert start >= pd.to_datetime('1 jul 2009'), 'predispatch price data only exists from 1 Jul 2009 onwards.'
+
+    # ranges already synced to the local price store are answered from disk
+    if use_store and arrow:
+        import price_arrow
+        stored_data = price_arrow.read_predispatch_prices(start, end)
+        if stored_data is not None:
+            return stored_data
+    elif use_store:
+        stored_data = price_store.read_predispatch_prices(start, end)
+        if stored_data is not None:
+            return price_frames.compact_predispatch(stored_data) if compact else stored_data
     
-    list_of_files = get_required_pd_files_list(start, end)
-    num_files = len(list_of_files)
-    i = 0
+    # monthly archives only for the months the half hourly reports do not cover more cheaply
+    plan = source_planner.plan_predispatch_prices(start, end)
+    print(f'Predispatch prices from {source_planner.format_plan(plan)}')
+    for gap in plan.query('source == "missing"').itertuples():
+        print(f'No NEMWEB source covers predispatch runs from {gap.start} to {gap.end}')
+    archive_urls = list(plan.query('source == "predispatch_archive"').url.values)
+    current_urls = list(plan.query('source == "predispatch_reports"').url.values)
+
+    # monthly archives are streamed with the time window applied while reading,
+    # then the current files are fetched as one concurrent batch
+    num_files = len(archive_urls) + len(current_urls)
+    text = f'getting forecast data ({num_files} files, {plan.bytes.sum()/1e6:.1f} MB)...'
+    archive_data = nemweb_fetch.run_concurrently(crunch_archive_predispatch_file,
+                                                 [dict(url = url, start = start, end = end) for url in archive_urls],
+                                                 progress_callback = progress_reporter(progress_callback, text, 0, num_files))
+    tables = get_nemweb_files([dict(url = url, **CURRENT_PD_FILTER) for url in current_urls],
+                              progress_callback = progress_reporter(progress_callback, text, len(archive_urls), num_files))
 
     files_data = []
-    with st.spinner('getting forecast data...'):
-        pd_progress_bar = st.progress(0)
-        # archive files
-        for url in tqdm(list_of_files.query('source == "archive"').url.values):
-            i+=1
-            pd_progress_bar.progress(i/num_files)
-            data = (crunch_archive_predispatch_file(url)
+    for data in archive_data + [crunch_current_predispatch_data(table) for table in tables]:
+        with instrumentation.span('filter', rows = len(data)):
+            data = (data
                     .query('interval_30>= @start')
                     .query('interval_30<= @end')
                     .query('from_datetime>= @start')
                     .query('from_datetime<= @end')
                 )
-            files_data.append(data)
-
-        # current files
-        for url in tqdm(list_of_files.query('source == "current"').url.values):
-            i+=1
-            pd_progress_bar.progress(i/num_files)
-            data = (crunch_current_predispatch_file(url)
-                    .query('interval_30>= @start')
-                    .query('interval_30<= @end')
-                    .query('from_datetime>= @start')
-                    .query('from_datetime<= @end')
-                )
-            
-            files_data.append(data)
-
-        all_data = (pd.concat(files_data)
-                    .drop_duplicates()
-                    .sort_values(by = ['from_datetime','interval_30','REGIONID'])
-                    .reset_index(drop=True)
-                    .rename(columns = {'REGIONID':'region','RRP':'forecast_30min'})
-                )
-        all_data.from_datetime = pd.to_datetime(all_data.from_datetime)
-        all_data.interval_30 = pd.to_datetime(all_data.interval_30)
-        pd_progress_bar.empty()
-    return all_data
-
-def crunch_archive_dispatch_price_file(url):
-    data = (get_nemweb_file(url,filter_column_n = 3, filter_value = 'PRICE')
-        .dropna(axis=1)
-        .filter(['SETTLEMENTDATE','REGIONID','RRP'])
+        files_data.append(data)
+
+    # no files at all, e.g. a month before its archive is published and older than the half hourly reports
+    all_data = tidy_predispatch_prices(pd.concat(files_data) if files_data
+                                       else pd.DataFrame(columns = ['from_datetime','interval_30','REGIONID'] + list(MARKET_COLUMNS)))
+    if arrow:
+        import price_arrow
+        return price_arrow.from_frame(all_data)
+    return price_frames.compact_predispatch(all_data) if compact else all_data
+
+@instrumentation.timed()
+def tidy_predispatch_prices(data):
+    '''
+    Converts crunched predispatch rows into the long predispatch price schema
+    (from_datetime, interval_30, region, market, forecast_30min), one row per market.
+    '''
+    data = data.drop_duplicates().rename(columns = {'REGIONID':'region'})
+    data.from_datetime = pd.to_datetime(data.from_datetime)
+    data.interval_30 = pd.to_datetime(data.interval_30)
+    return (melt_markets(data, ['from_datetime','interval_30','region'], 'forecast_30min')
+            .sort_values(by = ['from_datetime','interval_30','region','market'])
+            .reset_index(drop=True)
+           )
+
+@instrumentation.timed()
+def crunch_archive_dispatch_price_data(data):
+    data = (data
+        .filter(['SETTLEMENTDATE','REGIONID'] + list(MARKET_COLUMNS))
        )
     return data
 
+@instrumentation.timed()
+def crunch_archive_dispatch_price_file(url, start=None, end=None, regions=None):
+    '''
+    If any of start, end or regions are given the monthly archive is streamed in chunks and only rows in the
+    time window / regions are kept, instead of loading the whole month.
+    '''
+    if start is None and end is None and regions is None:
+        return crunch_archive_dispatch_price_data(get_nemweb_file(url, **ARCHIVE_PRICE_FILTER))
+
+    filters = _window_filters('SETTLEMENTDATE', start, end) + _region_filters(regions)
+    files_data = [crunch_archive_dispatch_price_data(chunk)
+                  for chunk in iter_nemweb_file_chunks(url, filters = filters, **ARCHIVE_PRICE_FILTER)]
+    return pd.concat(files_data)
+
 def get_dispatch_price_archive_files(start, end):
     start = pd.to_datetime(start)
     end = pd.to_datetime(end)
@@ -281,206 +480,302 @@ def get_dispatch_price_archive_files(start, end):
              .assign(year = dates.dates.dt.year.astype(str))
              .drop_duplicates(subset=['month','year'])
             )
-    prefix = r'https://nemweb.com.au/data_archive/Wholesale_Electricity/MMSDM/'
-    dates['links'] = dates.apply(lambda df: prefix +f'{df.year}/MMSDM_{df.year}_{df.month}/MMSDM_Historical_Data_SQLLoader/DATA/PUBLIC_DVD_DISPATCHPRICE_{df.year}{df.month}010000.zip',axis=1)
+    dates['links'] = dates.dates.apply(dispatch_price_archive_url)
     
     return dates
 
 
+@instrumentation.timed()
 def get_trading_price_NEMWEB(start = datetime.date.today(),
-                             end = datetime.date.today() + datetime.timedelta(days=1)):
-    price_data=None
+                             end = datetime.date.today() + datetime.timedelta(days=1),
+                             use_store = True,
+                             compact = False,
+                             progress_callback = None,
+                             arrow = False):
+    '''
+    Settled prices with start < interval_5 <= end in the long settled price schema, with 30 min averages.
+    compact = True returns the memory compact form instead, without the 30 min columns (see price_frames),
+    arrow = True the same as a pyarrow Table (see price_arrow).
+    progress_callback(fraction, text) is called as files are loaded (see progress_reporter).
+    '''
     start = pd.to_datetime(start)
     end = pd.to_datetime(end)
     assert start >= pd.to_datetime('1 jul 2009'), 'trading price data only exists from 1 Jul 2009 onwards.'
-    start_str = start.strftime('%Y/%m/%d %H:%M:%S')
-    end_str = end.strftime('%Y/%m/%d %H:%M:%S')
-    archive_success = False
-
-
-    with st.spinner('getting settled prices data...'):
-        settled_prices_progress_bar = st.progress(0.0)
-        try:
-            files_data =[]
-            archive_tp_list = get_dispatch_price_archive_files(start, end)                
-            num_of_files = len(archive_tp_list)
-            print(f'{num_of_files} to download')
-            i=0
-            for url in tqdm(archive_tp_list.links.values):
-                i+=1
-                settled_prices_progress_bar.progress(i/num_of_files)
-                price_data = crunch_archive_dispatch_price_file(url)
-                price_data.SETTLEMENTDATE = pd.to_datetime(price_data.SETTLEMENTDATE)
-                price_data.RRP = price_data.RRP.astype(float)
-                files_data.append(price_data)
-            price_data = pd.concat(files_data)
-
-            if (len(price_data)> 0 and
-                price_data.SETTLEMENTDATE.max() >= end and
-                price_data.SETTLEMENTDATE.min() <= start+pd.Timedelta('5min')):
-                settled_prices_progress_bar.progress(1.0)
-                archive_success = True
-        except:
-            print('Incomplete or failed attempt to get data from archive.')
-            archive_success = False
-
-        settled_prices_progress_bar.empty()
-        
-        public_prices_success = False
-        
-        if not archive_success:
-            try:
-                print('Sourcing data from public prices...')
-                if not price_data is None:
-                    if len(price_data)>0:
-                        adjusted_start = price_data.SETTLEMENTDATE.max() - pd.Timedelta('1d')
-                    else:
-                        adjusted_start = start
-                else:
-                    adjusted_start = start
-
-                later_end = end + pd.Timedelta('1d')
-                public_prices_list = (get_public_prices_list()
-                                    .query('start >= @adjusted_start')
-                                    .query('end <= @later_end')
-                                    )
-                
-
-                files_data = []
-                num_of_files = len(public_prices_list)
-                i=0
-                for url in tqdm(public_prices_list.links.values):
-                    i+=1
-                    settled_prices_progress_bar.progress(i/num_of_files)
-                    data = (get_nemweb_file(url,filter_column_n = 2, filter_value = 'DREGION')
-                            .dropna(axis=1)
-                            .filter(['SETTLEMENTDATE','REGIONID','RRP'])
-                            .drop_duplicates()
-                            .query('SETTLEMENTDATE != "SETTLEMENTDATE"')
-                        )
-
-                    files_data.append(data)
-
-                daily_report_data = pd.concat(files_data)
-
-                if not price_data is None:
-                    price_data = pd.concat([price_data,daily_report_data])
-                    price_data.SETTLEMENTDATE = pd.to_datetime(price_data.SETTLEMENTDATE)
-                    price_data.RRP = price_data.RRP.astype(float)
-
-                    if (len(price_data)> 0 and
-                        price_data.SETTLEMENTDATE.max() >= end and
-                        price_data.SETTLEMENTDATE.min() <= start+pd.Timedelta('5min')):
-
-                        public_prices_success = True
-            except:
-                print('Incomplete or failed attempt to get data daily public prices.')
-                public_prices_success = False
-                
-        if not archive_success and not public_prices_success:
-            print('Sourcing most recent data...')
-            if not price_data is None:
-                if len(price_data)>0:
-                    adjusted_start = price_data.SETTLEMENTDATE.max() - pd.Timedelta('1d')
-                else:
-                    adjusted_start = start
-            else:
-                adjusted_start = start
-                
-            later_end = end
-            recent_prices_list = (get_tradingis_reports_list()
-                                .query('start >= @adjusted_start')
-                                .query('end <= @later_end')
-                                )
-            
-            files_data = []
-            num_of_files = len(recent_prices_list)
-            i=0
-            for url in tqdm(recent_prices_list.links.values):
-                i+=1
-                settled_prices_progress_bar.progress(i/num_of_files)
-                data = (get_nemweb_file(url,table_name = 'PRICE')
-                        .dropna(axis=1)
-                        .filter(['SETTLEMENTDATE','REGIONID','RRP'])
-                        .drop_duplicates()
-                        .query('SETTLEMENTDATE != "SETTLEMENTDATE"')
-                    )
-                
-                files_data.append(data)
-
-            settled_prices_progress_bar.empty()    
-
-            recent_prices_data = pd.concat(files_data)
-            
-            if not price_data is None:
-                price_data = pd.concat([price_data,recent_prices_data])
-            else:
-                price_data = recent_prices_data
+
+    # ranges already synced to the local price store are answered from disk
+    if use_store and arrow:
+        import price_arrow
+        stored_data = price_arrow.read_settled_prices(start, end)
+        if stored_data is not None:
+            return stored_data
+    elif use_store:
+        stored_data = price_store.read_settled_prices(start, end)
+        if stored_data is not None:
+            return price_frames.compact_settled(stored_data) if compact else add_settled_30min(stored_data)
+    # the cheapest set of archive, daily and 5 min files covering the range, decided before downloading anything
+    plan = source_planner.plan_settled_prices(start, end)
+    print(f'Settled prices from {source_planner.format_plan(plan)}')
+    for gap in plan.query('source == "missing"').itertuples():
+        print(f'No NEMWEB source covers settled prices from {gap.start} to {gap.end}')
+
+    archives = plan.query('source == "archive"')
+    # a market day's Public_Prices file can serve the end of one month's piece and the start of the next
+    files = plan.query('source in ["public_prices", "tradingis"]').drop_duplicates(subset='url')
+    num_files = len(archives) + len(files)
+    text = f'getting settled prices data ({num_files} files, {plan.bytes.sum()/1e6:.1f} MB)...'
+    # monthly archives are streamed with their part of the range applied while reading
+    files_data = nemweb_fetch.run_concurrently(crunch_archive_dispatch_price_file,
+                                               [dict(url = row.url, start = row.start, end = row.end) for row in archives.itertuples()],
+                                               progress_callback = progress_reporter(progress_callback, text, 0, num_files))
+    file_filters = {'public_prices': PUBLIC_PRICES_FILTER, 'tradingis': TRADINGIS_PRICE_FILTER}
+    tables = get_nemweb_files([dict(url = row.url, **file_filters[row.source]) for row in files.itertuples()],
+                              progress_callback = progress_reporter(progress_callback, text, len(archives), num_files))
+    for table in tables:
+        files_data.append(table.filter(['SETTLEMENTDATE','REGIONID'] + list(MARKET_COLUMNS)))
+    price_data = (pd.concat(files_data) if files_data
+                  else pd.DataFrame(columns = ['SETTLEMENTDATE','REGIONID'] + list(MARKET_COLUMNS)))
     
+    price_data = tidy_settled_prices(price_data)
+    with instrumentation.span('filter', rows = len(price_data)):
+        price_data = (price_data
+                      .query('interval_5 > @start')
+                      .query('interval_5 <= @end')
+                      .reset_index(drop=True)
+                     )
+    if arrow:
+        import price_arrow
+        return price_arrow.from_frame(price_data)
+    return price_frames.compact_settled(price_data) if compact else add_settled_30min(price_data)
+
+@instrumentation.timed()
+def tidy_settled_prices(price_data):
+    '''
+    Converts raw SETTLEMENTDATE/REGIONID/RRP (and FCAS ...RRP) rows into the long settled price schema
+    (interval_5, region, market, settled_5min), one row per market.
+    '''
+    price_data = price_data.filter(['SETTLEMENTDATE','REGIONID'] + list(MARKET_COLUMNS))
     price_data.SETTLEMENTDATE = pd.to_datetime(price_data.SETTLEMENTDATE)
-    price_data.RRP = price_data.RRP.astype(float)
     price_data.REGIONID = price_data.REGIONID.str.replace('1','')
     price_data = (price_data
-                  .filter(['SETTLEMENTDATE','REGIONID','RRP'])
-                  .sort_values(by = ['SETTLEMENTDATE','REGIONID'])
-                  .query('SETTLEMENTDATE > @start')
-                  .query('SETTLEMENTDATE <= @end')
                   .drop_duplicates()
-                  .reset_index(drop=True)
-                  .rename(columns = {'REGIONID':'region','RRP':'settled_5min','SETTLEMENTDATE':'interval_5'})
+                  .rename(columns = {'REGIONID':'region','SETTLEMENTDATE':'interval_5'})
                  )
+    return (melt_markets(price_data, ['interval_5','region'], 'settled_5min')
+            .sort_values(by = ['interval_5','region','market'])
+            .reset_index(drop=True)
+           )
+
+@instrumentation.timed()
+def add_settled_30min(price_data):
     price_data = (price_data
                  .assign(interval_30 = price_data.interval_5.dt.ceil('30min'))
                 )
-    price_data['settled_30min'] = price_data.groupby(by=['interval_30','region'])['settled_5min'].transform('mean')
+    keys = ['interval_30','region'] + (['market'] if 'market' in price_data.columns else [])
+    price_data['settled_30min'] = price_data.groupby(by=keys, observed=True)['settled_5min'].transform('mean')
     price_data.columns.name = ''
     return price_data
 
 
+def _expand_forecasts(actuals_df, predispatch, state):
+    # spread the 30 min forecasts of state over the 5 min stamps from interval_30 - 30min to interval_30
+    # and look up the settled prices of each stamp
+    steps_per_30min = 7
+    forecasts = predispatch[(predispatch.region == state) &
+                            (predispatch.interval_30 > predispatch.from_datetime)]
+    expanded = forecasts.iloc[np.repeat(np.arange(len(forecasts)), steps_per_30min)].reset_index(drop=True)
+    offsets = np.tile(np.arange(steps_per_30min) * np.timedelta64(5, 'm'), len(forecasts))
+    expanded['interval_5'] = expanded.interval_30.values - np.timedelta64(30, 'm') + offsets
+    return expanded.merge(actuals_df.assign(actual_position = np.arange(len(actuals_df))),
+                          on = ['region','interval_5','interval_30'], how = 'left')
+
+def _keep_mask(df, last_settled):
+    # drop forecasts with no settled price, apart from those beyond the last settled interval
+    return (np.logical_not(df.settled_5min.isnull() & df.settled_30min.isnull() & df.forecast_30min.notnull()) |
+            (df.interval_5 >= last_settled)).values
+
+def _format_runs(froms):
+    return pd.DatetimeIndex(froms).strftime('%Y-%m-%d %H:%M')
+
+@instrumentation.timed()
+def build_forecast_vs_actuals_frame(actuals,
+                                    predispatch,
+                                    state = 'NSW'):
+    '''
+    Lines up each predispatch run with the settled prices of state on a 5 min grid: every 30 min forecast is
+    spread over the 5 min stamps from interval_30 - 30min to interval_30, and every run gets its own copy of the
+    settled series (forecast_30min is empty where a run has no forecast).
+    Built with vectorised lookups rather than exploding lists of timestamps and cross joining the actuals with
+    every run, so the cost is linear in the size of the resulting frame.
+    '''
+    froms = np.sort(predispatch.from_datetime.unique())
+    actuals_df = actuals[actuals.region == state].reset_index(drop=True)
+    num_actuals = len(actuals_df)
+    matched = _expand_forecasts(actuals_df, predispatch, state)
+
+    # settled prices for every (run, actual) pair without a forecast
+    paired = np.zeros(len(froms) * num_actuals, dtype=bool)
+    has_actual = matched.actual_position.notna().values
+    paired[np.searchsorted(froms, matched.from_datetime.values[has_actual]) * num_actuals +
+           matched.actual_position.values[has_actual].astype(int)] = True
+    unpaired = np.flatnonzero(~paired)
+    settled_only = actuals_df.iloc[unpaired % max(num_actuals, 1)].reset_index(drop=True)
+    settled_only['from_datetime'] = froms[unpaired // max(num_actuals, 1)]
+
+    columns = [column for column in matched.columns if column != 'actual_position']
+    df = (pd.concat([matched[columns], settled_only.reindex(columns = columns)], ignore_index=True)
+          .sort_values(by = ['interval_5','interval_30','from_datetime'], kind = 'mergesort')
+          .reset_index(drop=True)
+         )
 
-def create_forecast_vs_actuals_chart(actuals,
-                                     predispatch,
-                                     state = 'NSW'):
-    resampled_predispatch = (predispatch.copy())
-    resampled_predispatch['interval_5'] = resampled_predispatch.apply(lambda df: pd.date_range(df.interval_30-pd.Timedelta('30min'),
-                                                                       df.interval_30, freq = '5min'), axis=1)
-    resampled_predispatch = resampled_predispatch.explode('interval_5')
-
-
-    actuals_df = actuals.query('region == @state')
+    last_settled = df.interval_5[df.settled_5min.notnull() & df.from_datetime.notnull()].max()
+    df = df[_keep_mask(df, last_settled)]
 
-    unique_froms = list(resampled_predispatch.from_datetime.unique())
-    expanded_actuals = (actuals_df)
-    expanded_actuals['from_datetime'] = expanded_actuals.apply(lambda df:unique_froms, axis=1)
-    expanded_actuals = expanded_actuals.explode('from_datetime')
+    # format each run once rather than once per row
+    return df.assign(from_datetime_str = _format_runs(froms)[np.searchsorted(froms, df.from_datetime.values)])
 
-    df = (resampled_predispatch
-          .query('region == @state')
-          .query('interval_30> from_datetime')
-          .merge(right= expanded_actuals, on = ['from_datetime','region','interval_5','interval_30'], how = 'outer')
-          .sort_values(by = ['interval_5','interval_30','from_datetime'])
-          .reset_index(drop=True)
-         )
+def select_market(data, market = 'ENERGY'):
+    '''
+    Rows of a long price frame for one market, without the market column (frames without one are returned as is).
+    '''
+    if 'market' not in data.columns:
+        return data
+    return data[data.market == market].drop(columns = 'market').reset_index(drop=True)
 
-    last_settled=(df.filter(['from_datetime','interval_5','settled_5min'])
-                  .dropna()
-                  .interval_5.max()
-                 )
+def select_chart_rows(data, state = 'NSW', market = 'ENERGY'):
+    '''
+    Rows of one region and market of a long price frame, or of a price_arrow table, as a frame without the market
+    column. Tables are filtered with arrow compute kernels and only the selected rows are converted to pandas.
+    '''
+    if not isinstance(data, pd.DataFrame):
+        import price_arrow
+        return select_market(price_arrow.to_frame(price_arrow.select(data, regions = [state], markets = [market])), market)
+    return select_market(data[data.region == state], market)
 
-    df['from_datetime_str'] = df.from_datetime.dt.strftime('%Y-%m-%d %H:%M')
-    df['keep'] = np.where(((df.settled_5min.isnull()) & (df.settled_30min.isnull())),'True','False')
-    df['keep'] = np.where((df.keep == "True") & np.logical_not( df.forecast_30min.isnull()),'False','True')
-    df['keep'] = np.where((df.keep == "True") | (df.interval_5>=last_settled),'True','False')
-    df = (df
-          .query('keep=="True"')
-         )
+def select_runs(froms, run_stride = 1, max_runs = None):
+    '''
+    Thins out the predispatch run times to animate: keeps every run_stride-th run (counting back from the latest,
+    which is always kept) and then at most max_runs evenly spaced runs.
+    '''
+    froms = np.sort(froms)[::-1][::run_stride][::-1]
+    if max_runs is not None and len(froms) > max_runs:
+        froms = froms[np.unique(np.linspace(0, len(froms) - 1, max_runs).round().astype(int))]
+    return froms
+
+@instrumentation.timed()
+def build_forecast_frames(actuals,
+                          predispatch,
+                          state = 'NSW',
+                          run_stride = 1,
+                          max_runs = None):
+    '''
+    Compact alternative to build_forecast_vs_actuals_frame for the animated chart. Returns the settled series of
+    state once (interval_5, settled_5min, settled_30min) and only the forecast points of each selected run
+    (from_datetime_str, interval_5, forecast_30min), instead of a copy of the settled series per run.
+    '''
+    actuals_df = actuals[actuals.region == state].reset_index(drop=True)
+    froms = select_runs(predispatch.from_datetime.unique(), run_stride, max_runs)
+    predispatch = predispatch[predispatch.from_datetime.isin(froms)]
+
+    settled = (actuals_df
+               .filter(['interval_5','settled_5min','settled_30min'])
+               .sort_values(by = ['interval_5'], kind = 'mergesort')
+               .reset_index(drop=True)
+              )
+    last_settled = actuals_df.interval_5[actuals_df.settled_5min.notnull()].max() if len(froms) else pd.NaT
+
+    forecasts = _expand_forecasts(actuals_df, predispatch, state)
+    forecasts = (forecasts[_keep_mask(forecasts, last_settled)]
+                 .sort_values(by = ['from_datetime','interval_5','interval_30'], kind = 'mergesort')
+                 .reset_index(drop=True)
+                )
+    forecasts['from_datetime_str'] = _format_runs(froms)[np.searchsorted(froms, forecasts.from_datetime.values)]
+    return settled, forecasts.filter(['from_datetime_str','interval_5','forecast_30min'])
+
+def _animation_controls(run_names):
+    # same play/pause buttons and slider as plotly express builds for animation_frame
+    def animate_args(frame_duration, transition_duration):
+        return dict(frame = dict(duration = frame_duration, redraw = False), mode = 'immediate', fromcurrent = True,
+                    transition = dict(duration = transition_duration, easing = 'linear'))
+
+    updatemenus = [dict(type = 'buttons', direction = 'left', showactive = False,
+                        x = 0.1, xanchor = 'right', y = 0, yanchor = 'top', pad = dict(r = 10, t = 70),
+                        buttons = [dict(label = '&#9654;', method = 'animate', args = [None, animate_args(500, 500)]),
+                                   dict(label = '&#9724;', method = 'animate', args = [[None], animate_args(0, 0)])])]
+    sliders = [dict(active = 0, currentvalue = dict(prefix = 'from_datetime_str='), len = 0.9,
+                    x = 0.1, xanchor = 'left', y = 0, yanchor = 'top', pad = dict(b = 10, t = 60),
+                    steps = [dict(label = name, method = 'animate', args = [[name], animate_args(0, 0)])
+                             for name in run_names])]
+    return updatemenus, sliders
+
+@instrumentation.timed('plotly_build')
+def _compact_forecast_chart(settled, forecasts, title):
+    import plotly.graph_objects as go
+
+    run_names = list(forecasts.from_datetime_str.unique())
+    runs = dict(tuple(forecasts.groupby('from_datetime_str', sort = False)))
+
+    def forecast_trace(name):
+        run = runs.get(name, forecasts.iloc[:0])
+        return go.Scatter(x = run.interval_5, y = run.forecast_30min, mode = 'lines', name = 'forecast_30min',
+                          legendgroup = 'forecast_30min', line = dict(color = 'red'))
+
+    # settled traces are static; each frame only replaces the forecast trace (trace 0)
+    data = [forecast_trace(run_names[0] if run_names else None),
+            go.Scatter(x = settled.interval_5, y = settled.settled_5min, mode = 'lines', name = 'settled_5min',
+                       legendgroup = 'settled_5min', line = dict(color = 'grey')),
+            go.Scatter(x = settled.interval_5, y = settled.settled_30min, mode = 'lines', name = 'settled_30min',
+                       legendgroup = 'settled_30min', line = dict(color = 'black'))]
+    frames = [go.Frame(name = name, data = [forecast_trace(name)], traces = [0]) for name in run_names]
+
+    updatemenus, sliders = _animation_controls(run_names)
+    fig = go.Figure(data = data, frames = frames)
+    fig.update_layout(title = title,
+                      xaxis_title = 'interval_5', yaxis_title = 'value', legend_title = 'variable',
+                      updatemenus = updatemenus, sliders = sliders)
+    return fig
 
+def chart_payload_stats(fig):
+    '''
+    Size of what is sent to the browser for a figure: number of animation frames, data points and bytes of json.
+    '''
+    points = sum(len(trace.x) for trace in fig.data if trace.x is not None)
+    points += sum(len(trace.x) for frame in fig.frames for trace in frame.data if trace.x is not None)
+    return {'frames': len(fig.frames), 'points': points, 'json_bytes': len(fig.to_json())}
 
-    fig = px.line(df, x = 'interval_5', y = ['forecast_30min','settled_5min','settled_30min'],
-                  color_discrete_map = {'forecast_30min':'red','settled_5min':'grey','settled_30min':'black'},
-                  animation_frame = 'from_datetime_str',
-                  title = f'{state} Predispatch prices vs settled'
-                 )
+@instrumentation.timed()
+def create_forecast_vs_actuals_chart(actuals,
+                                     predispatch,
+                                     state = 'NSW',
+                                     market = 'ENERGY',
+                                     compact = True,
+                                     run_stride = 1,
+                                     max_runs = None,
+                                     report = False):
+    '''
+    Animated chart of each predispatch run of a market against settled prices, from loader frames, compact frames
+    or price_arrow tables. In compact mode the settled traces are sent once and each animation frame only carries
+    its run's forecast; run_stride and max_runs thin out the runs.
+    compact = False rebuilds the original plotly express figure with the settled series repeated in every frame.
+    If report is True the build time and payload size are printed.
+    '''
+    build_start = datetime.datetime.now()
+    # only the state and market drawn are expanded (and, for arrow tables, converted to pandas at all)
+    actuals = price_frames.expand_settled(select_chart_rows(actuals, state, market))
+    predispatch = price_frames.expand_predispatch(select_chart_rows(predispatch, state, market))
+    title = f'{state} Predispatch prices vs settled' if market == 'ENERGY' else f'{state} {market} Predispatch prices vs settled'
+    if compact:
+        settled, forecasts = build_forecast_frames(actuals, predispatch, state, run_stride, max_runs)
+        fig = _compact_forecast_chart(settled, forecasts, title)
+    else:
+        import plotly.express as px
+        froms = select_runs(predispatch.from_datetime.unique(), run_stride, max_runs)
+        df = build_forecast_vs_actuals_frame(actuals, predispatch[predispatch.from_datetime.isin(froms)], state)
+        with instrumentation.span('plotly_build'):
+            fig = px.line(df, x = 'interval_5', y = ['forecast_30min','settled_5min','settled_30min'],
+                          color_discrete_map = {'forecast_30min':'red','settled_5min':'grey','settled_30min':'black'},
+                          animation_frame = 'from_datetime_str',
+                          title = title
+                         )
 
     fig.update_layout(legend=dict(
     orientation="h",
@@ -488,7 +783,10 @@ def create_forecast_vs_actuals_chart(actuals,
     y=1.02,
     xanchor="right",
     x=1))
-    return fig
-
-    
 
+    if report:
+        build_seconds = (datetime.datetime.now() - build_start).total_seconds()
+        stats = chart_payload_stats(fig)
+        print(f"Chart built in {build_seconds:.2f}s: {stats['frames']} frames, {stats['points']} points, "
+              f"{stats['json_bytes']/1e6:.1f} MB of json")
+    return fig
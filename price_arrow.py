@@ -0,0 +1,179 @@
+'''
+Arrow form of the compact price frames (see price_frames), for passing prices from the loaders to the charts
+without copying them.
+
+    settled       interval_5 timestamp[ns], region, market, settled_5min
+    predispatch   from_datetime timestamp[ns], horizon int16, region, market, forecast_30min
+
+region and market are dictionary columns over the fixed price_store.REGIONS and MARKETS, so the codes mean the
+same in every table, and prices are PRICE_DTYPE. Tables are immutable, so one table can be shared by every
+session and chart of the app without handing out copies. Rows are picked with compute kernels on the columns
+(select) and only the slice a chart draws is turned back into a pandas frame (to_frame).
+
+The loaders return this form with arrow = True; ranges in the local price store are then read straight into a
+table (read_settled_prices / read_predispatch_prices) without going through pandas at all.
+'''
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import price_store
+import price_frames
+
+SETTLED_COLUMNS = ['interval_5', 'region', 'market', 'settled_5min']
+PREDISPATCH_COLUMNS = ['from_datetime', 'horizon', 'region', 'market', 'forecast_30min']
+HALF_HOUR_NS = 30 * 60 * 10**9
+
+
+def is_table(data):
+    return isinstance(data, pa.Table)
+
+
+def _time_column(table):
+    return 'interval_5' if 'interval_5' in table.column_names else 'from_datetime'
+
+
+def _codes(column, categories):
+    # position of each value in categories (the same codes pandas gives a categorical with those categories)
+    return pc.index_in(column.cast(pa.string()), value_set = pa.array(categories, pa.string())).cast(pa.int8())
+
+
+def _timestamps(column):
+    return column.cast(pa.timestamp('ns'))
+
+
+def _compact_table(table, columns, keys):
+    # distinct rows sorted by keys (regions and markets in category order, like sorted categoricals),
+    # with fixed dictionaries and PRICE_DTYPE prices
+    table = table.group_by(table.column_names).aggregate([])
+    table = (table
+             .set_column(table.column_names.index('region'), 'region', _codes(table.column('region'), price_store.REGIONS))
+             .set_column(table.column_names.index('market'), 'market', _codes(table.column('market'), price_store.MARKETS)))
+    table = table.take(pc.sort_indices(table, sort_keys = [(key, 'ascending') for key in keys]))
+    price_type = pa.from_numpy_dtype(np.dtype(price_frames.PRICE_DTYPE))
+    arrays = {'region': pa.DictionaryArray.from_arrays(table.column('region').combine_chunks(),
+                                                       pa.array(price_store.REGIONS, pa.string())),
+              'market': pa.DictionaryArray.from_arrays(table.column('market').combine_chunks(),
+                                                       pa.array(price_store.MARKETS, pa.string())),
+              columns[-1]: table.column(columns[-1]).cast(price_type)}
+    return pa.table({column: arrays.get(column, table.column(column)) for column in columns})
+
+
+def from_frame(data):
+    '''
+    Settled or predispatch prices in the loader (or compact) schema as a compact table.
+    '''
+    if 'settled_5min' in data.columns:
+        data = price_frames.compact_settled(data)
+    else:
+        data = price_frames.compact_predispatch(data)
+    return pa.Table.from_pandas(data, preserve_index = False)
+
+
+def to_frame(table):
+    '''
+    Compact table back to a compact frame (see price_frames), with region and market categoricals over all
+    regions and markets.
+    '''
+    data = table.to_pandas()
+    if 'settled_5min' in data.columns:
+        return price_frames.compact_settled(data)
+    return price_frames.compact_predispatch(data)
+
+
+def column(data, name):
+    '''
+    One column of a frame or table as a pandas series, without converting the rest of a table.
+    '''
+    if is_table(data):
+        return data.column(name).to_pandas()
+    return data[name]
+
+
+def _is_in(column, values):
+    # compares the dictionary codes rather than decoding every row to a string
+    values = pa.array(list(values), pa.string())
+    if not pa.types.is_dictionary(column.type):
+        return pc.is_in(column, value_set = values)
+    masks = []
+    for chunk in column.chunks:
+        codes = pc.drop_null(pc.index_in(values, value_set = chunk.dictionary)).cast(chunk.indices.type)
+        masks.append(pc.is_in(chunk.indices, value_set = codes))
+    return pa.chunked_array(masks, pa.bool_())
+
+
+def select(table, regions=None, markets=None, start=None, end=None):
+    '''
+    Rows of a compact table in regions and markets with start <= interval_5 (from_datetime) <= end, each
+    condition only applied if given. Returns the table itself if nothing is to be filtered.
+    '''
+    masks = []
+    if regions is not None:
+        masks.append(_is_in(table.column('region'), regions))
+    if markets is not None:
+        masks.append(_is_in(table.column('market'), markets))
+    time = table.column(_time_column(table))
+    if start is not None:
+        masks.append(pc.greater_equal(time, pa.scalar(pd.to_datetime(start), pa.timestamp('ns'))))
+    if end is not None:
+        masks.append(pc.less_equal(time, pa.scalar(pd.to_datetime(end), pa.timestamp('ns'))))
+    if not masks:
+        return table
+    mask = masks[0]
+    for other in masks[1:]:
+        mask = pc.and_(mask, other)
+    return table.filter(mask)
+
+
+def read_settled_prices(start, end, regions=None, store_dir=None):
+    '''
+    Same rows as price_store.read_settled_prices as a compact table, or None unless every 5 min interval of the
+    range is stored for every region.
+    '''
+    start = pd.to_datetime(start)
+    end = pd.to_datetime(end)
+    regions = price_store.REGIONS if regions is None else list(regions)
+    table = price_store.read_table('settled', start, end, regions, store_dir = store_dir)
+    if table is None:
+        return None
+    table = table.set_column(0, 'interval_5', _timestamps(table.column('interval_5')))
+    table = table.filter(pc.greater(table.column('interval_5'), pa.scalar(start, pa.timestamp('ns'))))
+    table = _compact_table(table, SETTLED_COLUMNS, ['interval_5', 'region', 'market'])
+
+    expected_intervals = len(pd.date_range(start.floor('5min') + pd.Timedelta('5min'), end, freq='5min'))
+    counts = table.group_by('region').aggregate([('interval_5', 'count_distinct')]).to_pydict()
+    intervals_per_region = dict(zip(counts['region'], counts['interval_5_count_distinct']))
+    if expected_intervals == 0 or any(intervals_per_region.get(region, 0) < expected_intervals for region in regions):
+        return None
+    return table
+
+
+def read_predispatch_prices(start, end, regions=None, store_dir=None):
+    '''
+    Same rows as price_store.read_predispatch_prices as a compact table, or None unless a run is stored for every
+    half hour of the range.
+    '''
+    start = pd.to_datetime(start)
+    end = pd.to_datetime(end)
+    table = price_store.read_table('predispatch', start, end, regions, store_dir = store_dir)
+    if table is None:
+        return None
+    from_datetime = _timestamps(table.column('from_datetime'))
+    interval_30 = _timestamps(table.column('interval_30'))
+    table = (table
+             .set_column(table.column_names.index('interval_30'), 'horizon',
+                         pc.divide(pc.subtract(interval_30.cast(pa.int64()), from_datetime.cast(pa.int64())),
+                                   HALF_HOUR_NS).cast(pa.int16()))
+             .set_column(table.column_names.index('from_datetime'), 'from_datetime', from_datetime)
+             .filter(pc.and_(pc.greater_equal(interval_30, pa.scalar(start, pa.timestamp('ns'))),
+                             pc.less_equal(interval_30, pa.scalar(end, pa.timestamp('ns')))))
+            )
+    table = _compact_table(table, PREDISPATCH_COLUMNS, ['from_datetime', 'horizon', 'region', 'market'])
+
+    # the last run with an interval inside the range starts half an hour before the end
+    expected_runs = pd.date_range(start.ceil('30min'), (end - pd.Timedelta('30min')).floor('30min'), freq='30min')
+    runs = pc.unique(table.column('from_datetime'))
+    if len(table) == 0 or not pc.all(pc.is_in(pa.array(expected_runs, pa.timestamp('ns')), value_set = runs)).as_py():
+        return None
+    return table
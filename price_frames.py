@@ -0,0 +1,79 @@
+'''
+Compact in-memory representation of the long price frames, for holding long ranges of all regions and markets.
+
+    settled       interval_5, region, market, settled_5min
+    predispatch   from_datetime, horizon, region, market, forecast_30min
+
+region and market are categoricals and prices are stored as PRICE_DTYPE (float32 by default, which keeps prices to
+about 1e-3 $/MWh at the market cap). The derived columns are not stored: interval_30 and settled_30min of settled
+prices are recomputed from interval_5, and the interval_30 of a forecast is from_datetime + horizon half hours.
+expand_settled / expand_predispatch restore the full loader schema, and the chart code calls them itself, so
+compact frames can be passed anywhere a loader frame is expected.
+'''
+
+import os
+import numpy as np
+import pandas as pd
+import price_store
+
+PRICE_DTYPE = os.environ.get('NEMWEB_PRICE_DTYPE', 'float32')
+
+
+def _categorise(data):
+    data = data.assign(region = pd.Categorical(data.region, categories = price_store.REGIONS))
+    if 'market' in data.columns:
+        data = data.assign(market = pd.Categorical(data.market, categories = price_store.MARKETS))
+    return data
+
+
+def compact_settled(data, price_dtype=None):
+    data = _categorise(data.drop(columns = ['interval_30', 'settled_30min'], errors = 'ignore'))
+    return data.assign(settled_5min = data.settled_5min.astype(price_dtype or PRICE_DTYPE))
+
+
+def compact_predispatch(data, price_dtype=None):
+    if 'interval_30' in data.columns:
+        horizon = (data.interval_30 - data.from_datetime) // pd.Timedelta('30min')
+        data = data.drop(columns = 'interval_30').assign(horizon = horizon.astype(np.int16))
+    data = _categorise(data)
+    columns = ['from_datetime', 'horizon', 'region', 'market', 'forecast_30min']
+    return data.assign(forecast_30min = data.forecast_30min.astype(price_dtype or PRICE_DTYPE)).filter(columns)
+
+
+def expand_settled(data):
+    '''
+    Adds interval_30 and settled_30min back to compact settled prices (frames that have them are returned as is).
+    '''
+    if 'settled_30min' in data.columns:
+        return data
+    import predispatch_daily
+    return predispatch_daily.add_settled_30min(data)
+
+
+def expand_predispatch(data):
+    '''
+    Puts interval_30 back in place of horizon (frames that have it are returned as is).
+    '''
+    if 'horizon' not in data.columns:
+        return data
+    interval_30 = data.from_datetime + pd.to_timedelta(data.horizon.astype(np.int64) * 30, unit = 'min')
+    data = data.assign(interval_30 = interval_30).drop(columns = 'horizon')
+    return data.filter(['from_datetime', 'interval_30'] + [c for c in data.columns if c not in ('from_datetime', 'interval_30')])
+
+
+def memory_report(frames):
+    '''
+    Memory used by each column of one frame or a dict of named frames, as a dataframe with the dtype, total
+    bytes and bytes per row of each column (including the contents of object columns).
+    '''
+    if isinstance(frames, pd.DataFrame):
+        frames = {'data': frames}
+    rows = []
+    for name, data in frames.items():
+        usage = data.memory_usage(deep = True, index = False)
+        for column, nbytes in usage.items():
+            rows.append({'frame': name, 'column': column, 'dtype': str(data[column].dtype), 'bytes': int(nbytes),
+                         'bytes_per_row': nbytes / max(len(data), 1)})
+        rows.append({'frame': name, 'column': '(total)', 'dtype': '', 'bytes': int(usage.sum()),
+                     'bytes_per_row': usage.sum() / max(len(data), 1)})
+    return pd.DataFrame(rows, columns = ['frame', 'column', 'dtype', 'bytes', 'bytes_per_row'])
@@ -0,0 +1,283 @@
+'''
+Local columnar warehouse of settled 5 min prices and predispatch runs.
+
+Prices are stored as parquet datasets partitioned by year/month/region (hive style, e.g.
+v2/settled/year=2022/month=10/region=NSW/...), with one row per market (energy and FCAS). The store is filled incrementally from NEMWEB with
+
+    python price_store.py sync --start 2022-09-01 --end 2022-10-01
+
+which records every source file it ingests in a manifest so that re-running a sync only fetches new files.
+get_trading_price_NEMWEB and get_predispatch_price_NEMWEB answer date ranges fully covered by the store
+straight from disk.
+'''
+
+import os
+import json
+import hashlib
+import argparse
+import datetime
+import pandas as pd
+
+STORE_DIR = os.environ.get('NEMWEB_STORE_DIR',
+                           os.path.join(os.path.expanduser('~'), '.cache', 'backtoNEMfuture', 'store'))
+REGIONS = ['NSW', 'QLD', 'SA', 'TAS', 'VIC']
+MARKETS = ['ENERGY', 'RAISE1SEC', 'RAISE6SEC', 'RAISE60SEC', 'RAISE5MIN', 'RAISEREG',
+           'LOWER1SEC', 'LOWER6SEC', 'LOWER60SEC', 'LOWER5MIN', 'LOWERREG']
+PARTITION_COLS = ['year', 'month', 'region']
+# bumped whenever the stored columns change; each layout lives in its own sub directory
+STORE_LAYOUT = 'v2'
+
+# time column used for partitioning and key columns of each dataset
+DATASETS = {'settled': {'time_column': 'interval_5',
+                        'columns': ['interval_5', 'region', 'market', 'settled_5min']},
+            'predispatch': {'time_column': 'from_datetime',
+                            'columns': ['from_datetime', 'interval_30', 'region', 'market', 'forecast_30min']}}
+
+
+def _layout_dir(store_dir=None):
+    return os.path.join(store_dir or STORE_DIR, STORE_LAYOUT)
+
+
+def _manifest_path(store_dir=None):
+    return os.path.join(_layout_dir(store_dir), 'manifest.json')
+
+
+def load_manifest(store_dir=None):
+    '''
+    Returns {dataset: {source url: {'rows': n, 'ingested': timestamp}}} for every source file already in the store.
+    '''
+    path = _manifest_path(store_dir)
+    manifest = {dataset: {} for dataset in DATASETS}
+    if os.path.exists(path):
+        with open(path) as f:
+            manifest.update(json.load(f))
+    return manifest
+
+
+def _save_manifest(manifest, store_dir=None):
+    path = _manifest_path(store_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path + '.tmp', path)
+
+
+def ingest_frame(dataset, source_url, data, store_dir=None, part=0):
+    '''
+    Writes tidy price rows (in the loader schema, see DATASETS) from one source file into the partitioned dataset.
+    Files are named after the source url so ingesting the same source twice overwrites rather than duplicates.
+    '''
+    time_column = DATASETS[dataset]['time_column']
+    data = data.filter(DATASETS[dataset]['columns'])
+    if len(data) == 0:
+        return 0
+    data = data.assign(year = data[time_column].dt.year,
+                       month = data[time_column].dt.month,
+                       region = data.region.astype(str))
+    source_hash = hashlib.sha1(source_url.encode()).hexdigest()[:16]
+    data.to_parquet(os.path.join(_layout_dir(store_dir), dataset),
+                    partition_cols = PARTITION_COLS,
+                    index = False,
+                    basename_template = f'{source_hash}-{part}-{{i}}.parquet',
+                    existing_data_behavior = 'overwrite_or_ignore')
+    return len(data)
+
+
+def mark_ingested(manifest, dataset, source_url, rows, store_dir=None):
+    manifest[dataset][source_url] = {'rows': int(rows), 'ingested': datetime.datetime.now().isoformat()}
+    _save_manifest(manifest, store_dir)
+
+
+def read_dataset(dataset, start, end, regions=None, store_dir=None):
+    '''
+    Reads rows of dataset with start <= time column <= end, pruning partitions and row groups on the way.
+    Returns an empty frame if nothing is stored.
+    '''
+    start = pd.to_datetime(start)
+    end = pd.to_datetime(end)
+    columns = DATASETS[dataset]['columns']
+    time_column = DATASETS[dataset]['time_column']
+    path = os.path.join(_layout_dir(store_dir), dataset)
+    if not os.path.isdir(path):
+        return pd.DataFrame(columns = columns)
+
+    filters = [('year', '>=', start.year), ('year', '<=', end.year),
+               (time_column, '>=', start), (time_column, '<=', end)]
+    if regions is not None:
+        filters.append(('region', 'in', list(regions)))
+    data = pd.read_parquet(path, filters = filters)
+    data = data.assign(region = pd.Categorical(data.region.astype(str), categories = REGIONS),
+                       market = pd.Categorical(data.market.astype(str), categories = MARKETS)).filter(columns)
+    return data.drop_duplicates().sort_values(by = columns[:-1]).reset_index(drop=True)
+
+
+def read_table(dataset, start, end, regions=None, markets=None, store_dir=None):
+    '''
+    Arrow version of read_dataset: the rows of dataset with start <= time column <= end as a pyarrow Table, with
+    the filters pushed down to the partitions and row groups and nothing converted to pandas. Duplicate rows are
+    not removed and the rows are in file order (see price_arrow for both). Returns None if nothing is stored.
+    '''
+    import pyarrow.dataset as ds
+
+    start = pd.to_datetime(start)
+    end = pd.to_datetime(end)
+    time_column = DATASETS[dataset]['time_column']
+    path = os.path.join(_layout_dir(store_dir), dataset)
+    if not os.path.isdir(path):
+        return None
+
+    data = ds.dataset(path, format = 'parquet', partitioning = 'hive')
+    expression = ((ds.field('year') >= start.year) & (ds.field('year') <= end.year) &
+                  (ds.field(time_column) >= start) & (ds.field(time_column) <= end))
+    if regions is not None:
+        expression &= ds.field('region').isin(list(regions))
+    if markets is not None:
+        expression &= ds.field('market').isin(list(markets))
+    return data.to_table(columns = DATASETS[dataset]['columns'], filter = expression)
+
+
+def read_settled_prices(start, end, regions=None, store_dir=None):
+    '''
+    Returns settled prices with start < interval_5 <= end in the loader schema (without the 30 min columns),
+    or None unless every 5 min interval of the range is stored for every region.
+    '''
+    start = pd.to_datetime(start)
+    end = pd.to_datetime(end)
+    regions = REGIONS if regions is None else list(regions)
+    data = (read_dataset('settled', start, end, regions, store_dir)
+            .query('interval_5 > @start')
+            .reset_index(drop=True)
+           )
+    expected_intervals = len(pd.date_range(start.floor('5min') + pd.Timedelta('5min'), end, freq='5min'))
+    intervals_per_region = data.groupby('region', observed=True).interval_5.nunique().reindex(regions).fillna(0)
+    if expected_intervals == 0 or (intervals_per_region < expected_intervals).any():
+        return None
+    return data
+
+
+def read_predispatch_prices(start, end, regions=None, store_dir=None):
+    '''
+    Returns predispatch runs with from_datetime and interval_30 within [start, end] in the loader schema,
+    or None unless a run is stored for every half hour of the range.
+    '''
+    start = pd.to_datetime(start)
+    end = pd.to_datetime(end)
+    data = (read_dataset('predispatch', start, end, regions, store_dir)
+            .query('interval_30 >= @start')
+            .query('interval_30 <= @end')
+            .reset_index(drop=True)
+           )
+    # the last run with an interval inside the range starts half an hour before the end
+    expected_runs = pd.date_range(start.ceil('30min'), (end - pd.Timedelta('30min')).floor('30min'), freq='30min')
+    if len(data) == 0 or not expected_runs.isin(data.from_datetime.unique()).all():
+        return None
+    return data
+
+
+def _covered_until(dataset, start, end, store_dir=None):
+    data = read_dataset(dataset, start, end, store_dir=store_dir)
+    if len(data) == 0:
+        return pd.to_datetime(start)
+    return data[DATASETS[dataset]['time_column']].max()
+
+
+def sync_settled_prices(start, end, store_dir=None):
+    '''
+    Fills the settled dataset for [start, end] from MMSDM monthly archives, then Public_Prices daily files, then
+    TradingIS 5 min files for whatever the daily files do not cover yet. Already ingested files are skipped.
+    '''
+    import predispatch_daily
+
+    start = pd.to_datetime(start)
+    end = pd.to_datetime(end)
+    manifest = load_manifest(store_dir)
+    ingested = manifest['settled']
+
+    # monthly archives (only published once the month is over)
+    for url in predispatch_daily.get_dispatch_price_archive_files(start, end).links.values:
+        if url in ingested:
+            continue
+        try:
+            rows = 0
+            for i, chunk in enumerate(predispatch_daily.iter_nemweb_file_chunks(url, **predispatch_daily.ARCHIVE_PRICE_FILTER)):
+                rows += ingest_frame('settled', url, predispatch_daily.tidy_settled_prices(chunk), store_dir, part=i)
+        except Exception as e:
+            print(f'Skipping {url}: {e}')
+            continue
+        mark_ingested(manifest, 'settled', url, rows, store_dir)
+
+    # daily public prices
+    later_end = end + pd.Timedelta('1d')
+    public_prices_list = (predispatch_daily.get_public_prices_list()
+                          .query('end >= @start')
+                          .query('start <= @later_end')
+                         )
+    urls = [url for url in public_prices_list.links.values if url not in ingested]
+    tables = predispatch_daily.get_nemweb_files([dict(url = url, **predispatch_daily.PUBLIC_PRICES_FILTER) for url in urls])
+    for url, table in zip(urls, tables):
+        rows = ingest_frame('settled', url, predispatch_daily.tidy_settled_prices(table), store_dir)
+        mark_ingested(manifest, 'settled', url, rows, store_dir)
+
+    # 5 min files, only after the latest interval already stored
+    covered_until = _covered_until('settled', start, end, store_dir)
+    recent_prices_list = (predispatch_daily.get_tradingis_reports_list()
+                          .query('start >= @covered_until')
+                          .query('end <= @end')
+                         )
+    urls = [url for url in recent_prices_list.links.values if url not in ingested]
+    tables = predispatch_daily.get_nemweb_files([dict(url = url, **predispatch_daily.TRADINGIS_PRICE_FILTER) for url in urls])
+    for url, table in zip(urls, tables):
+        rows = ingest_frame('settled', url, predispatch_daily.tidy_settled_prices(table), store_dir)
+        mark_ingested(manifest, 'settled', url, rows, store_dir)
+
+
+def sync_predispatch_prices(start, end, store_dir=None):
+    '''
+    Fills the predispatch dataset for [start, end] from PREDISP_ALL_DATA monthly archives and the current
+    Predispatch_Reports files. Already ingested files are skipped.
+    '''
+    import predispatch_daily
+
+    manifest = load_manifest(store_dir)
+    ingested = manifest['predispatch']
+    list_of_files = predispatch_daily.get_required_pd_files_list(start, end)
+
+    for url in list_of_files.query('source == "archive"').url.values:
+        if url in ingested:
+            continue
+        try:
+            rows = 0
+            for i, chunk in enumerate(predispatch_daily.iter_nemweb_file_chunks(url, **predispatch_daily.ARCHIVE_PD_FILTER)):
+                data = predispatch_daily.tidy_predispatch_prices(predispatch_daily.crunch_archive_predispatch_data(chunk))
+                rows += ingest_frame('predispatch', url, data, store_dir, part=i)
+        except Exception as e:
+            print(f'Skipping {url}: {e}')
+            continue
+        mark_ingested(manifest, 'predispatch', url, rows, store_dir)
+
+    urls = [url for url in list_of_files.query('source == "current"').url.values if url not in ingested]
+    tables = predispatch_daily.get_nemweb_files([dict(url = url, **predispatch_daily.CURRENT_PD_FILTER) for url in urls])
+    for url, table in zip(urls, tables):
+        data = predispatch_daily.tidy_predispatch_prices(predispatch_daily.crunch_current_predispatch_data(table))
+        rows = ingest_frame('predispatch', url, data, store_dir)
+        mark_ingested(manifest, 'predispatch', url, rows, store_dir)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Local NEMWEB price store.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    sync_parser = subparsers.add_parser('sync', help='Incrementally fill the store from NEMWEB.')
+    sync_parser.add_argument('--start', required=True)
+    sync_parser.add_argument('--end', default=str(datetime.date.today() + datetime.timedelta(days=1)))
+    sync_parser.add_argument('--dataset', choices=['settled', 'predispatch', 'all'], default='all')
+    sync_parser.add_argument('--store-dir', default=None)
+    args = parser.parse_args(argv)
+
+    if args.dataset in ('settled', 'all'):
+        sync_settled_prices(args.start, args.end, args.store_dir)
+    if args.dataset in ('predispatch', 'all'):
+        sync_predispatch_prices(args.start, args.end, args.store_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+'''
+Plans which NEMWEB files to download for a date range before fetching anything.
+
+Each source covers a fixed window per file:
+
+    settled prices       MMSDM DISPATCHPRICE        one month          (month start, next month start]
+                         Public_Prices              one market day     (day 4am, next day 4am]
+                         TradingIS_Reports          one 5 min interval (last two days or so)
+    predispatch prices   MMSDM PREDISP_ALL_DATA     the runs of one month
+                         Predispatch_Reports        one run            (last two days or so)
+
+The range is cut at month starts and each piece is planned without asking NEMWEB anything it does not need to:
+
+    1. the month's archive, if its table is already in nemweb_cache
+    2. the cached daily / 5 min (or half hourly) files, if together they cover the piece
+    3. otherwise whichever is fewer bytes of the month's archive (if a HEAD request finds it published) and, for
+       each market day, the day's Public_Prices file or its TradingIS files (from the directory listings, which
+       nemweb_listing keeps for a while). REQUEST_OVERHEAD bytes are counted per file so hundreds of small files
+       are not chosen over one slightly bigger file, and cached files count as free
+
+So a range loaded before is planned (and loaded) offline, and a monthly archive is never downloaded just to find
+out it does not cover the range. Parts of the range no source covers show up in the plan as 'missing'. Only a 404
+counts as a file not being there: any other error while checking one is raised (after nemweb_fetch.request's
+retries) rather than planning around a file that may well exist.
+
+A plan is a dataframe with one row per file (source, url, start, end, bytes), start and end being the part of the
+range the file is used for. describe_plan summarises it:
+
+    python source_planner.py settled --start 2022-09-28 --end 2022-10-03
+'''
+
+import os
+import argparse
+import numpy as np
+import pandas as pd
+import nemweb_cache
+import nemweb_listing
+
+REQUEST_OVERHEAD = int(os.environ.get('NEMWEB_REQUEST_OVERHEAD', 20_000))
+# used when a listing or HEAD request does not give a file's size
+ESTIMATED_BYTES = {'archive': 50e6, 'public_prices': 500e3, 'tradingis': 5e3,
+                   'predispatch_archive': 500e6, 'predispatch_reports': 100e3}
+PLAN_COLUMNS = ['source', 'url', 'start', 'end', 'bytes']
+# Public_Prices files are named for the market day, which runs from 4am to 4am
+MARKET_DAY_START = pd.Timedelta('4h')
+
+
+def _rows(source, urls, starts, ends, sizes):
+    sizes = pd.Series(sizes, dtype=float).fillna(ESTIMATED_BYTES[source]).values
+    return pd.DataFrame({'source': source, 'url': list(urls), 'start': list(starts), 'end': list(ends), 'bytes': sizes})
+
+
+def _cost(rows):
+    return rows.bytes.sum() + REQUEST_OVERHEAD * len(rows)
+
+
+def _missing(start, end):
+    return pd.DataFrame({'source': ['missing'], 'url': [None], 'start': [start], 'end': [end], 'bytes': [0.0]})
+
+
+def _month_pieces(start, end):
+    months = [month for month in pd.date_range(start.floor('1d').replace(day=1), end, freq='MS') if start < month < end]
+    edges = [start] + months + [end]
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def _gaps(expected, available, step):
+    # contiguous runs of the expected times that are not available, as (first - step, last) ranges
+    missing = expected[~expected.isin(available)]
+    if len(missing) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(missing.values) != np.timedelta64(step)) + 1
+    return [(run[0] - step, run[-1]) for run in np.split(missing, breaks)]
+
+
+def _plan_days(start, end, daily_files, interval_files):
+    # cheapest of the day's Public_Prices file and its TradingIS files for each market day of (start, end]
+    rows = []
+    day_starts = pd.date_range((start - MARKET_DAY_START).ceil('1d'), end, freq='1d') + MARKET_DAY_START
+    days = [start] + [day for day in day_starts if start < day < end] + [end]
+    for day_start, day_end in zip(days[:-1], days[1:]):
+        options = []
+        # the file named for day D covers (D 4am, D+1 4am]
+        daily = daily_files[daily_files.start == (day_start - MARKET_DAY_START).floor('1d')].head(1)
+        if len(daily):
+            options.append(_rows('public_prices', daily.links, [day_start], [day_end], daily['size']))
+        intervals = interval_files[(interval_files.end > day_start) & (interval_files.end <= day_end)]
+        expected = pd.date_range(day_start + pd.Timedelta('5min'), day_end, freq='5min')
+        gaps = _gaps(expected, intervals.end, pd.Timedelta('5min'))
+        if not gaps:
+            options.append(_rows('tradingis', intervals.links, intervals.start, intervals.end, intervals['size']))
+        if options:
+            rows.append(min(options, key=_cost))
+        else:
+            # neither is complete, take the intervals there are
+            rows.append(_rows('tradingis', intervals.links, intervals.start, intervals.end, intervals['size']))
+            rows.extend(_missing(gap_start, gap_end) for gap_start, gap_end in gaps)
+    return pd.concat(rows, ignore_index=True) if rows else pd.DataFrame(columns=PLAN_COLUMNS)
+
+
+def _table_filters():
+    import predispatch_daily
+    return {'archive': predispatch_daily.ARCHIVE_PRICE_FILTER,
+            'public_prices': predispatch_daily.PUBLIC_PRICES_FILTER,
+            'tradingis': predispatch_daily.TRADINGIS_PRICE_FILTER,
+            'predispatch_archive': predispatch_daily.ARCHIVE_PD_FILTER,
+            'predispatch_reports': predispatch_daily.CURRENT_PD_FILTER}
+
+
+def _is_cached(source, urls, cached):
+    # whether each url's table for source is in nemweb_cache (cached is its {key: url})
+    table_filter = _table_filters()[source]
+    return np.array([nemweb_cache.make_cache_key(url, **table_filter) in cached for url in urls], dtype=bool)
+
+
+def _cached_files(source, directory, cached):
+    # the files of a CURRENT directory whose tables are cached, as a listing frame, found without any network
+    links = [url for url in cached.values() if f'/reports/current/{directory}/' in url.lower()]
+    links = [link for link, is_cached in zip(links, _is_cached(source, links, cached)) if is_cached]
+    return pd.DataFrame({'links': pd.Series(links, dtype=object), 'size': 0.0})
+
+
+def _without_cached_bytes(files, source, cached):
+    # cached files cost nothing to download
+    return files.assign(size = files['size'].mask(_is_cached(source, files.links, cached), 0.0))
+
+
+def plan_settled_prices(start, end):
+    '''
+    Files to download for settled prices with start < interval_5 <= end (see the module docstring).
+    '''
+    import predispatch_daily
+
+    start = pd.to_datetime(start)
+    end = pd.to_datetime(end)
+    cached = nemweb_cache.cached_urls()
+    cached_daily = predispatch_daily.get_public_prices_list(_cached_files('public_prices', 'public_prices', cached))
+    cached_intervals = (predispatch_daily.get_tradingis_reports_list(_cached_files('tradingis', 'tradingis_reports', cached))
+                        .drop_duplicates(subset='end'))
+    daily_files = interval_files = None
+    pieces = []
+    for piece_start, piece_end in _month_pieces(start, end):
+        url = predispatch_daily.dispatch_price_archive_url(piece_start)
+        if _is_cached('archive', [url], cached)[0]:
+            pieces.append(_rows('archive', [url], [piece_start], [piece_end], [0.0]))
+            continue
+        days = _plan_days(piece_start, piece_end, cached_daily, cached_intervals)
+        if (days.source != 'missing').all():
+            pieces.append(days)
+            continue
+        options = []
+        size = nemweb_listing.get_file_size(url)
+        if size is not None:
+            options.append(_rows('archive', [url], [piece_start], [piece_end], [size]))
+        if daily_files is None:
+            daily_files = _without_cached_bytes(predispatch_daily.get_public_prices_list(), 'public_prices', cached)
+            interval_files = _without_cached_bytes(predispatch_daily.get_tradingis_reports_list(), 'tradingis', cached)
+            interval_files = interval_files.drop_duplicates(subset='end')
+        days = _plan_days(piece_start, piece_end, daily_files, interval_files)
+        # an incomplete set of daily and 5 min files only beats having no archive at all
+        if not options or (days.source != 'missing').all():
+            options.append(days)
+        pieces.append(min(options, key=_cost))
+    return (pd.concat(pieces, ignore_index=True)
+            .sort_values(by=['start', 'end'], kind='stable')
+            .reset_index(drop=True)
+            .filter(PLAN_COLUMNS)
+           )
+
+
+def _with_runs(reports):
+    # the run time is in the file name
+    return reports.assign(run = reports.start + pd.Timedelta('5min')).drop_duplicates(subset='run')
+
+
+def _plan_runs(piece_start, piece_end, reports):
+    # the half hourly reports of the runs in [piece_start, piece_end), and the runs none is there for
+    # (runs at the end of a piece belong to the next piece, and a run starting at the end of the range has no
+    # intervals within it)
+    last_run = piece_end - pd.Timedelta('30min')
+    runs = reports[(reports.run >= piece_start) & (reports.run <= last_run)].sort_values(by='run')
+    expected = pd.date_range(piece_start.ceil('30min'), last_run, freq='30min')
+    rows = [_rows('predispatch_reports', runs.links, runs.run, runs.run, runs['size'])]
+    rows.extend(_missing(gap_start + pd.Timedelta('30min'), gap_end)
+                for gap_start, gap_end in _gaps(expected, runs.run, pd.Timedelta('30min')))
+    return pd.concat(rows, ignore_index=True)
+
+
+def plan_predispatch_prices(start, end):
+    '''
+    Files to download for predispatch runs starting within [start, end] (see the module docstring).
+    '''
+    import predispatch_daily
+
+    start = pd.to_datetime(start)
+    end = pd.to_datetime(end)
+    cached = nemweb_cache.cached_urls()
+    cached_reports = _with_runs(predispatch_daily.get_predispatch_reports_list(
+        _cached_files('predispatch_reports', 'predispatch_reports', cached)))
+    reports = None
+    pieces = []
+    for piece_start, piece_end in _month_pieces(start, end):
+        url = predispatch_daily.predispatch_price_archive_url(piece_start)
+        if _is_cached('predispatch_archive', [url], cached)[0]:
+            pieces.append(_rows('predispatch_archive', [url], [piece_start], [piece_end], [0.0]))
+            continue
+        runs = _plan_runs(piece_start, piece_end, cached_reports)
+        if (runs.source != 'missing').all():
+            pieces.append(runs)
+            continue
+        options = []
+        size = nemweb_listing.get_file_size(url)
+        if size is not None:
+            options.append(_rows('predispatch_archive', [url], [piece_start], [piece_end], [size]))
+        if reports is None:
+            reports = _with_runs(_without_cached_bytes(predispatch_daily.get_predispatch_reports_list(),
+                                                       'predispatch_reports', cached))
+        runs = _plan_runs(piece_start, piece_end, reports)
+        if not options or (runs.source != 'missing').all():
+            options.append(runs)
+        pieces.append(min(options, key=_cost))
+    return (pd.concat(pieces, ignore_index=True)
+            .sort_values(by=['start', 'end'], kind='stable')
+            .reset_index(drop=True)
+            .filter(PLAN_COLUMNS)
+           )
+
+
+def describe_plan(plan):
+    '''
+    One row per stretch of consecutive files from the same source: source, start, end, files and MB.
+    '''
+    if len(plan) == 0:
+        return pd.DataFrame(columns=['source', 'start', 'end', 'files', 'mb'])
+    stretch = (plan.source != plan.source.shift()).cumsum()
+    return (plan
+            .groupby(stretch)
+            .agg(source=('source', 'first'), start=('start', 'min'), end=('end', 'max'),
+                 files=('url', 'count'), mb=('bytes', lambda b: round(b.sum() / 1e6, 3)))
+            .reset_index(drop=True)
+           )
+
+
+def format_plan(plan):
+    summary = describe_plan(plan)
+    return (f'{len(plan.url.dropna())} files, {plan.bytes.sum() / 1e6:.1f} MB:\n' +
+            summary.to_string(index=False))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Show which NEMWEB files a date range would be loaded from.')
+    parser.add_argument('dataset', choices=['settled', 'predispatch'])
+    parser.add_argument('--start', required=True)
+    parser.add_argument('--end', required=True)
+    args = parser.parse_args(argv)
+    plan = (plan_settled_prices if args.dataset == 'settled' else plan_predispatch_prices)(args.start, args.end)
+    print(format_plan(plan))
+
+
+if __name__ == '__main__':
+    main()
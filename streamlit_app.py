@@ -1,19 +1,28 @@
+import os
 import pandas as pd
 import datetime
 import streamlit as st
-import predispatch_daily
+import app_data
+import chart_snapshots
+import instrumentation
 
 st.title('Back to NEM Future 🕥🔁😎')
+
+# keeps snapshots of the recent days' charts up to date in the background of this server process
+if os.environ.get('NEMWEB_SNAPSHOT_SCHEDULER', '1') != '0':
+    chart_snapshots.start_scheduler()
+
 # def do_at_start():
 #     st.set_page_config(layout="wide")
 #     return None
 
 # do_at_start()
 
-# market_selected = st.selectbox('Market',
-#                                 ('Energy','LOWER5MIN', 'LOWER60SEC', 'LOWER6SEC', 'LOWERREG',
-#                                 'RAISE5MIN','RAISE60SEC', 'RAISE6SEC', 'RAISEREG')
-#                                 )
+# all markets are loaded together, so switching market (or state) reuses the same data
+market_selected = st.selectbox('Market',
+                                ('Energy','LOWER5MIN', 'LOWER60SEC', 'LOWER6SEC', 'LOWERREG',
+                                'RAISE5MIN','RAISE60SEC', 'RAISE6SEC', 'RAISEREG')
+                                )
 
 # show_future_settled = st.checkbox('Show future settled prices')
 
@@ -47,10 +56,47 @@ with st.sidebar:
 start = pd.to_datetime(selected_date)
 end =  selected_date + pd.Timedelta('1d')
 
-new_fig = predispatch_daily.create_forecast_vs_actuals_chart(actuals = predispatch_daily.get_trading_price_NEMWEB(start, end),
-                                       predispatch = predispatch_daily.get_predispatch_price_NEMWEB(start, end),
-                                       state = state_selected)
+render_start = datetime.datetime.now()
+# pre-rendered charts of recent days are served straight away, unless Refresh was just pressed
+snapshot = None
+if not st.session_state.pop('skip_snapshot', False):
+    snapshot = chart_snapshots.load_snapshot(start, state_selected, market_selected.upper())
+
+# data and charts are shared between all sessions, so only the first visitor of a range downloads it
+with instrumentation.collect() as spans:
+    if snapshot is not None:
+        new_fig, snapshot_meta = snapshot
+        # snapshots written before the payload was kept with them go without
+        payload = snapshot_meta.get('payload')
+    else:
+        with st.spinner('getting data...'):
+            progress_bar = st.empty()
+            new_fig, payload = app_data.get_chart(start, end, state = state_selected, market = market_selected.upper(),
+                                                  on_wait = lambda: st.info('Another session is already loading this data, waiting for it...'),
+                                                  progress_callback = lambda fraction, text: progress_bar.progress(fraction, text),
+                                                  with_payload = True)
+            progress_bar.empty()
 
 st.plotly_chart(new_fig, use_container_width =True)
+# worked out once when the chart or snapshot was built, not on every rerun
+st.caption((f"{payload['frames']} predispatch runs, {payload['points']} points, "
+            f"{payload['json_bytes']/1e6:.1f} MB sent, " if payload is not None else '') +
+           f"loaded and rendered in {(datetime.datetime.now() - render_start).total_seconds():.1f}s" +
+           (f", snapshot of {datetime.datetime.fromtimestamp(snapshot_meta['built']):%H:%M}" if snapshot is not None else ''))
+
+def refresh():
+    app_data.refresh(start, end)
+    st.session_state['skip_snapshot'] = True
+
+# only files published since the last load are downloaded when today is refreshed
+st.button("Refresh", on_click = refresh)
 
-st.button("Refresh")
\ No newline at end of file
+# timings of each stage of this run (spans of other sessions loading at the same time can show up too)
+if st.sidebar.checkbox('Show timings'):
+    with st.expander('Timings', expanded = True):
+        if spans:
+            st.dataframe(instrumentation.summarise(spans))
+            st.download_button('Download spans (json)', instrumentation.to_json(spans),
+                               file_name = 'spans.json', mime = 'application/json')
+        else:
+            st.write('Everything on this page came from the cache.')
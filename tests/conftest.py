@@ -0,0 +1,51 @@
+'''
+Shared fixtures: a synthetic NEMWEB tree (see benchmarks/nemweb_fixtures.py) served by the local stand-in for
+nemweb.com.au, with the cache, store and spool dirs of every test in its own tmp_path.
+'''
+
+import os
+import sys
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [REPO_DIR, os.path.join(REPO_DIR, 'benchmarks')]
+
+import nemweb_fixtures
+from nemweb_server import NemwebServer
+import nemweb_cache
+import nemweb_fetch
+import nemweb_listing
+import price_store
+
+
+@pytest.fixture(scope='session')
+def nemweb_root(tmp_path_factory):
+    return nemweb_fixtures.build_fixtures(str(tmp_path_factory.mktemp('nemweb')))
+
+
+@pytest.fixture
+def start_nemweb(tmp_path, monkeypatch):
+    '''
+    start_nemweb(root) serves the fixture tree in root and points the loaders at it for the rest of the test.
+    '''
+    monkeypatch.setattr(nemweb_cache, 'CACHE_DIR', str(tmp_path / 'cache'))
+    monkeypatch.setattr(price_store, 'STORE_DIR', str(tmp_path / 'store'))
+    monkeypatch.setattr(nemweb_fetch, 'SPOOL_DIR', str(tmp_path / 'spool'))
+    monkeypatch.setattr(nemweb_fetch, 'MAX_PROCESSES', 0)
+    servers = []
+    def start(root):
+        server = NemwebServer(root).start()
+        servers.append(server)
+        monkeypatch.setattr(nemweb_listing, 'NEMWEB_HOST', server.url)
+        nemweb_listing.clear_listings()
+        return server
+    yield start
+    nemweb_listing.clear_listings()
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def nemweb(nemweb_root, start_nemweb):
+    return start_nemweb(nemweb_root)
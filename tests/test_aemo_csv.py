@@ -0,0 +1,74 @@
+'''
+aemo_csv: the streaming C/I/D parser.
+'''
+
+import io
+import zipfile
+import pandas as pd
+import aemo_csv
+
+REPORT = b'''C,NEMP.WORLD,PUBLIC_PRICES,AEMO,PUBLIC,2022/10/01,04:05:00,0000000001,PUBLIC_PRICES,0000000001
+I,DREGION,,3,SETTLEMENTDATE,RUNNO,REGIONID,RRP,FLAG
+D,DREGION,,3,"2022/10/01 04:05:00",1,NSW1,101.5,
+D,DREGION,,3,"2022/10/01 04:05:00",1,QLD1,99.25,
+D,DREGION,,3,"2022/10/01 04:10:00",1,NSW1,-20,
+I,DREGION,CASESOLUTION,2,SETTLEMENTDATE,RUNNO,INTERVENTION
+D,DREGION,CASESOLUTION,2,"2022/10/01 04:05:00",1,0
+I,DREGION,,4,SETTLEMENTDATE,RUNNO,REGIONID,RRP,RAISE1SECRRP
+D,DREGION,,4,"2022/10/01 04:15:00",1,NSW1,88,0.5
+C,"END OF REPORT",9
+'''
+
+
+def _lines(text=REPORT):
+    return io.BytesIO(text).readlines()
+
+
+def test_only_the_requested_table_is_read():
+    chunks = list(aemo_csv.iter_table_chunks(_lines(), 3, 'CASESOLUTION'))
+    assert len(chunks) == 1
+    assert list(chunks[0].columns) == ['I', 'DREGION', 'CASESOLUTION', '2', 'SETTLEMENTDATE', 'RUNNO', 'INTERVENTION']
+    assert chunks[0].INTERVENTION.tolist() == [0]
+
+
+def test_each_i_record_starts_a_chunk_with_its_header():
+    # the table name is empty, so filter on the record type instead; a new I record (version 4) adds a column
+    chunks = list(aemo_csv.iter_table_chunks(_lines(), 2, 'DREGION'))
+    assert [len(chunk) for chunk in chunks] == [3, 1, 1]
+    assert 'RAISE1SECRRP' not in chunks[0].columns
+    assert chunks[2].RAISE1SECRRP.tolist() == [0.5]
+    assert chunks[0].RRP.tolist() == [101.5, 99.25, -20]
+
+
+def test_dates_are_converted_and_empty_columns_dropped():
+    data = aemo_csv.read_aemo_table(_lines(), 4, '3')
+    assert data.SETTLEMENTDATE.dtype == 'datetime64[ns]'
+    assert data.SETTLEMENTDATE.tolist() == list(pd.to_datetime(['2022-10-01 04:05', '2022-10-01 04:05',
+                                                                '2022-10-01 04:10']))
+    assert data.REGIONID.tolist() == ['NSW1', 'QLD1', 'NSW1']
+    assert 'FLAG' not in data.columns
+
+
+def test_chunksize_splits_and_keeps_every_column():
+    chunks = list(aemo_csv.iter_table_chunks(_lines(), 4, '3', chunksize=2))
+    assert [len(chunk) for chunk in chunks] == [2, 1]
+    assert all('FLAG' in chunk.columns for chunk in chunks)
+
+
+def test_missing_table_gives_an_empty_frame():
+    assert len(aemo_csv.read_aemo_table(_lines(), 3, 'NOTTHERE')) == 0
+
+
+def test_zips_inside_zips_are_read():
+    def zipped(members):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as z:
+            for name, content in members.items():
+                z.writestr(name, content)
+        return buffer.getvalue()
+
+    outer = zipfile.ZipFile(io.BytesIO(zipped({'PUBLIC_PRICES_1.zip': zipped({'PUBLIC_PRICES_1.CSV': REPORT}),
+                                               'PUBLIC_PRICES_2.zip': zipped({'PUBLIC_PRICES_2.CSV': REPORT})})))
+    chunks = [chunk for name in outer.namelist()
+              for chunk in aemo_csv.iter_zip_member_chunks(outer, name, 3, 'CASESOLUTION')]
+    assert len(chunks) == 2
@@ -0,0 +1,27 @@
+'''
+app_data: charts shared between sessions, served from the fixture NEMWEB (see conftest.py).
+'''
+
+import pytest
+import app_data
+import predispatch_daily
+
+
+@pytest.fixture
+def store():
+    app_data.clear()
+    yield
+    app_data.clear()
+
+
+def test_chart_payload_is_worked_out_once(nemweb, store, monkeypatch):
+    calls = []
+    payload_stats = predispatch_daily.chart_payload_stats
+    monkeypatch.setattr(predispatch_daily, 'chart_payload_stats', lambda fig: calls.append(fig) or payload_stats(fig))
+
+    fig, payload = app_data.get_chart('2022-09-10', '2022-09-11', with_payload=True)
+    assert payload == payload_stats(fig)
+    # reruns get the stored chart and payload without serialising the figure again
+    assert app_data.get_chart('2022-09-10', '2022-09-11', with_payload=True) == (fig, payload)
+    assert app_data.get_chart('2022-09-10', '2022-09-11') is fig
+    assert len(calls) == 1
@@ -0,0 +1,40 @@
+'''
+export_prices against the local stand-in for NEMWEB (see benchmarks/nemweb_server.py). The fixtures have the
+September 2022 archives, Public_Prices up to 6 October and predispatch reports from 6 October only, so the first
+days of October have settled prices but no predispatch runs.
+'''
+
+import os
+import pandas as pd
+import export_prices
+
+
+def test_export_range_with_predispatch_gap(nemweb, tmp_path):
+    path = str(tmp_path / 'predispatch.parquet')
+    rows = export_prices.export_prices('predispatch', '2022-09-28', '2022-10-03', path, use_store=False)
+
+    data = pd.read_parquet(path)
+    assert rows == len(data) > 0
+    # only the september runs, october has none until the 6th
+    assert data.from_datetime.min() == pd.Timestamp('2022-09-28')
+    assert data.from_datetime.max() < pd.Timestamp('2022-10-01')
+    assert not os.path.exists(path + '.tmp')
+
+
+def test_export_range_with_no_predispatch_runs(nemweb, tmp_path):
+    path = str(tmp_path / 'predispatch.csv')
+    rows = export_prices.export_prices('predispatch', '2022-10-01', '2022-10-03', path, 'csv', use_store=False)
+
+    assert rows == 0
+    assert list(pd.read_csv(path).columns) == ['from_datetime', 'interval_30', 'region', 'market', 'forecast_30min']
+
+
+def test_export_settled_across_months(nemweb, tmp_path):
+    path = str(tmp_path / 'settled.parquet')
+    rows = export_prices.export_prices('settled', '2022-09-28', '2022-10-03', path, regions=['NSW'],
+                                       markets=['ENERGY'], use_store=False)
+
+    data = pd.read_parquet(path)
+    expected = pd.date_range('2022-09-28 00:05', '2022-10-03', freq='5min')
+    assert rows == len(data) == len(expected)
+    assert (data.interval_5.values == expected.values).all()
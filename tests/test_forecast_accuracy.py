@@ -0,0 +1,40 @@
+'''
+forecast_accuracy over the price store, synced from the fixture NEMWEB (see conftest.py).
+'''
+
+import nemweb_fetch
+import price_store
+import forecast_accuracy
+
+
+def _spawn_workers(monkeypatch, tmp_path):
+    # spawned workers start from this environment, so they read the test's store
+    monkeypatch.setattr(nemweb_fetch, 'PROCESS_START_METHOD', 'spawn')
+    monkeypatch.setenv('NEMWEB_STORE_DIR', str(tmp_path / 'store'))
+
+
+def test_empty_store_gives_an_empty_summary(nemweb, monkeypatch, tmp_path):
+    _spawn_workers(monkeypatch, tmp_path)
+    statistics = forecast_accuracy.forecast_accuracy('2022-01-01', '2022-02-01', max_workers=1)
+    assert len(statistics) == 0
+    assert list(statistics.columns) == ['market', 'region', 'lead', 'hour'] + forecast_accuracy.STATISTICS
+    assert len(forecast_accuracy.summarise(statistics)) == 0
+
+
+def test_empty_range(nemweb):
+    assert len(forecast_accuracy.forecast_accuracy('2022-09-10', '2022-09-10', max_workers=1)) == 0
+
+
+def test_statistics_from_the_store(nemweb, monkeypatch, tmp_path):
+    _spawn_workers(monkeypatch, tmp_path)
+    price_store.sync_settled_prices('2022-09-10', '2022-09-13')
+    price_store.sync_predispatch_prices('2022-09-10', '2022-09-13')
+
+    statistics = forecast_accuracy.forecast_accuracy('2022-09-10', '2022-09-11', markets=['ENERGY'], max_workers=1)
+    assert set(statistics.market) == {'ENERGY'}
+    assert set(statistics.region) == set(price_store.REGIONS)
+    # one run each half hour of the day, scored until the store ends
+    by_lead = forecast_accuracy.summarise(statistics)
+    assert by_lead.lead.min() == 1
+    assert (by_lead.n[by_lead.lead == 1] == 48 * len(price_store.REGIONS)).all()
+    assert (by_lead.mae > 0).all()
@@ -0,0 +1,57 @@
+'''
+live_tail: a range reaching past the fixture NEMWEB's now, refreshed after NEMWEB has moved on by six hours.
+'''
+
+import pandas as pd
+import pytest
+import nemweb_fixtures
+import live_tail
+import predispatch_daily
+
+START, END = pd.Timestamp('2022-10-07 12:00'), pd.Timestamp('2022-10-08 12:00')
+LATER = '2022-10-08 06:00'
+
+
+@pytest.fixture(scope='module')
+def later_root(tmp_path_factory):
+    return nemweb_fixtures.build_fixtures(str(tmp_path_factory.mktemp('later')), now=LATER)
+
+
+@pytest.fixture
+def tails():
+    live_tail.clear_tails()
+    yield
+    live_tail.clear_tails()
+
+
+def test_settled_prices_are_topped_up(nemweb, start_nemweb, later_root, tails):
+    first = live_tail.get_settled_prices(START, END)
+    assert first.interval_5.max() == pd.Timestamp(nemweb_fixtures.NOW)
+
+    later = start_nemweb(later_root)
+    topped_up = live_tail.get_settled_prices(START, END)
+    # the listing and the 5 min files published since
+    assert later.stats()['requests'] == 1 + 72
+
+    assert (topped_up.groupby('region').interval_5.nunique() ==
+            len(pd.date_range(START + pd.Timedelta('5min'), LATER, freq='5min'))).all()
+    held = topped_up[topped_up.interval_5 <= first.interval_5.max()].reset_index(drop=True)
+    pd.testing.assert_frame_equal(held, first)
+    # the half hour averages include the new intervals
+    recomputed = predispatch_daily.add_settled_30min(topped_up.drop(columns='settled_30min'))
+    pd.testing.assert_series_equal(topped_up.settled_30min, recomputed.settled_30min, check_dtype=False)
+
+
+def test_predispatch_prices_are_topped_up(nemweb, start_nemweb, later_root, tails):
+    first = live_tail.get_predispatch_prices(START, END)
+    assert first.from_datetime.max() == pd.Timestamp('2022-10-07 23:30')
+
+    later = start_nemweb(later_root)
+    topped_up = live_tail.get_predispatch_prices(START, END)
+    assert later.stats()['requests'] == 1 + 12
+
+    new_runs = pd.date_range('2022-10-08 00:00', '2022-10-08 05:30', freq='30min')
+    assert set(topped_up.from_datetime) == set(first.from_datetime) | set(new_runs)
+    assert topped_up.interval_30.max() <= END
+    held = topped_up[topped_up.from_datetime <= first.from_datetime.max()].reset_index(drop=True)
+    pd.testing.assert_frame_equal(held, first)
@@ -0,0 +1,123 @@
+'''
+nemweb_cache: reading and writing tables, checksums, the size budget and tables streamed in chunk by chunk.
+'''
+
+import os
+import time
+import pandas as pd
+import aemo_csv
+import nemweb_cache
+import predispatch_daily
+
+ARCHIVE_URL = 'http://nemweb/Data_Archive/Wholesale_Electricity/MMSDM/2022/PUBLIC_DVD_DISPATCHPRICE_202209010000.zip'
+CURRENT_URL = 'http://nemweb/Reports/CURRENT/Public_Prices/PUBLIC_PRICES_202210010000_20221002040500.zip'
+
+
+
+def _table(n=100):
+    return pd.DataFrame({'SETTLEMENTDATE': pd.date_range('2022-10-01 00:05', periods=n, freq='5min'),
+                         'REGIONID': 'NSW1', 'RRP': range(n)})
+
+
+def _write(key, url, cache_dir, n=100):
+    nemweb_cache.write_cached_table(key, _table(n), url, cache_dir=cache_dir, max_bytes=10**9)
+
+
+def test_written_table_reads_back_with_filters(tmp_path):
+    _write('k', CURRENT_URL, str(tmp_path))
+    pd.testing.assert_frame_equal(nemweb_cache.read_cached_table('k', cache_dir=str(tmp_path)), _table())
+    filtered = nemweb_cache.read_cached_table('k', cache_dir=str(tmp_path), filters=[('RRP', '>=', 90)])
+    assert filtered.RRP.tolist() == list(range(90, 100))
+    assert nemweb_cache.read_cached_table('other', cache_dir=str(tmp_path)) is None
+    assert nemweb_cache.cached_urls(str(tmp_path)) == {'k': CURRENT_URL}
+
+
+def test_changed_entries_of_current_files_are_discarded(tmp_path):
+    _write('k', CURRENT_URL, str(tmp_path))
+    data_path = str(tmp_path / 'k.parquet')
+    _table(50).to_parquet(data_path)
+    assert nemweb_cache.read_cached_table('k', cache_dir=str(tmp_path)) is None
+    assert not os.path.exists(data_path)
+
+
+def test_archive_entries_are_not_checksummed(tmp_path):
+    # monthly archives never change, so their (much bigger) entries are read without hashing them first
+    _write('k', ARCHIVE_URL, str(tmp_path))
+    _table(50).to_parquet(str(tmp_path / 'k.parquet'))
+    assert len(nemweb_cache.read_cached_table('k', cache_dir=str(tmp_path))) == 50
+
+
+def test_least_recently_used_tables_are_evicted(tmp_path):
+    cache_dir = str(tmp_path)
+    for i, key in enumerate(['old', 'used', 'new']):
+        _write(key, CURRENT_URL, cache_dir)
+        os.utime(str(tmp_path / f'{key}.parquet'), (time.time() - 100 + i, time.time() - 100 + i))
+    # reading an entry makes it the most recently used
+    nemweb_cache.read_cached_table('used', cache_dir=cache_dir)
+    entry_bytes = os.path.getsize(str(tmp_path / 'new.parquet'))
+
+    assert nemweb_cache.evict_cache(max_bytes=2 * entry_bytes, cache_dir=cache_dir) == 1
+    assert not nemweb_cache.has_cached_table('old', cache_dir)
+    assert nemweb_cache.has_cached_table('used', cache_dir) and nemweb_cache.has_cached_table('new', cache_dir)
+    assert nemweb_cache.clear_cache(cache_dir) == 2
+
+
+def test_repeat_requests_are_served_from_the_cache(nemweb):
+    url = predispatch_daily.get_public_prices_list().links.values[0]
+    before = nemweb.stats()
+    first = predispatch_daily.get_nemweb_file(url, **predispatch_daily.PUBLIC_PRICES_FILTER)
+    downloaded = nemweb.stats()
+    second = predispatch_daily.get_nemweb_file(url, **predispatch_daily.PUBLIC_PRICES_FILTER)
+    assert downloaded['requests'] == before['requests'] + 1
+    assert nemweb.stats() == downloaded
+    pd.testing.assert_frame_equal(first.reset_index(drop=True), second.reset_index(drop=True))
+
+
+HEADER = b'I,DISPATCH,PRICE,4,SETTLEMENTDATE,REGIONID,RUNNO,RRP,FLAG,RAISE1SECRRP\n'
+
+
+def _lines(rows):
+    return [b'C,NEMP.WORLD,DISPATCH,AEMO,PUBLIC\n', HEADER] + [
+        f'D,DISPATCH,PRICE,4,"2022/09/01 00:{5 * i:02d}:00",NSW1,{runno},{100 + i},{flag},{raise1}\n'.encode()
+        for i, (runno, flag, raise1) in enumerate(rows)] + [b'C,"END OF REPORT",12\n']
+
+
+def test_streamed_table_keeps_columns_that_start_later(tmp_path):
+    # FLAG and RAISE1SECRRP only get values after the first chunk, and RUNNO turns from int to float on a blank
+    lines = _lines([(1, '', '')] * 5 + [(1, 'X', 1.5), (1, 'X', 1.5), ('', 'X', 2.5), (1, '', 1.5), (1, 'Y', 1.5)])
+    chunks = list(aemo_csv.iter_table_chunks(lines, 3, 'PRICE', chunksize=3))
+    assert len(chunks) == 4
+    assert all(list(chunk.columns) == list(chunks[0].columns) for chunk in chunks)
+
+    key = nemweb_cache.make_cache_key('http://nemweb/test.zip', 'PRICE')
+    passed = list(nemweb_cache.cache_table_chunks(key, aemo_csv.iter_table_chunks(lines, 3, 'PRICE', chunksize=3),
+                                                  'http://nemweb/test.zip', cache_dir=str(tmp_path)))
+    assert len(passed) == 4
+
+    cached = nemweb_cache.read_cached_table(key, cache_dir=str(tmp_path))
+    expected = aemo_csv.read_aemo_table(lines, 3, 'PRICE').reset_index(drop=True)
+    assert cached is not None
+    assert list(cached.columns) == list(expected.columns)
+    pd.testing.assert_frame_equal(cached, expected, check_dtype=False)
+    assert cached.RUNNO.dtype == float
+    assert list(cached.FLAG.fillna('')) == [''] * 5 + ['X', 'X', 'X', '', 'Y']
+
+
+def test_streamed_table_with_a_column_never_filled(tmp_path):
+    lines = _lines([(1, '', 1.5)] * 7)
+    key = nemweb_cache.make_cache_key('http://nemweb/test.zip', 'PRICE')
+    list(nemweb_cache.cache_table_chunks(key, aemo_csv.iter_table_chunks(lines, 3, 'PRICE', chunksize=3),
+                                         'http://nemweb/test.zip', cache_dir=str(tmp_path)))
+    cached = nemweb_cache.read_cached_table(key, cache_dir=str(tmp_path))
+    assert len(cached) == 7
+    assert cached.FLAG.isna().all()
+
+
+def test_cache_entry_widens_to_later_chunks(tmp_path):
+    chunks = [pd.DataFrame({'a': [1, 2], 'b': [None, None]}),
+              pd.DataFrame({'a': [3.5, None], 'b': ['x', 'y'], 'c': [1, 2]})]
+    key = nemweb_cache.make_cache_key('http://nemweb/test.zip', 'T')
+    list(nemweb_cache.cache_table_chunks(key, iter(chunks), 'http://nemweb/test.zip', cache_dir=str(tmp_path)))
+    cached = nemweb_cache.read_cached_table(key, cache_dir=str(tmp_path))
+    pd.testing.assert_frame_equal(cached, pd.DataFrame({'a': [1.0, 2.0, 3.5, None], 'b': [None, None, 'x', 'y'],
+                                                        'c': [None, None, 1.0, 2.0]}))
@@ -0,0 +1,33 @@
+'''
+nemweb_fetch: parsing in the process pool of a multi threaded process.
+'''
+
+import threading
+import instrumentation
+import nemweb_fetch
+import predispatch_daily
+
+
+def test_workers_started_while_a_lock_is_held(nemweb, monkeypatch):
+    # a worker forked while another thread holds the instrumentation lock would wait for it forever in
+    # call_collecting; the pool starts its workers on the first submit
+    monkeypatch.setattr(nemweb_fetch, 'MAX_PROCESSES', 2)
+    nemweb_fetch._reset_process_pool()
+    pool = nemweb_fetch._get_process_pool()
+    with instrumentation._lock:
+        pool.submit(int).result()
+
+    urls = list(predispatch_daily.get_public_prices_list().links[:2])
+    results = []
+    loader = threading.Thread(target=lambda: results.extend(
+        nemweb_fetch.fetch_and_process(urls, predispatch_daily.parse_nemweb_zip,
+                                       [predispatch_daily.PUBLIC_PRICES_FILTER] * len(urls))), daemon=True)
+    try:
+        loader.start()
+        loader.join(timeout=60)
+        assert not loader.is_alive(), 'parsing in the process pool hung'
+        assert [len(table) for table in results] == [288 * 5] * 2
+    finally:
+        for process in list(pool._processes.values()):
+            process.kill()
+        nemweb_fetch._reset_process_pool()
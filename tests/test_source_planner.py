@@ -0,0 +1,85 @@
+'''
+source_planner against the fixture NEMWEB (see conftest.py): the September 2022 archives, Public_Prices for the
+market days from 30 September to 6 October and the last two days of TradingIS and Predispatch reports.
+'''
+
+import pandas as pd
+import pytest
+import requests
+import nemweb_fixtures
+import nemweb_listing
+import predispatch_daily
+import source_planner
+
+
+def _sources(plan):
+    return list(source_planner.describe_plan(plan).source)
+
+
+def test_cheaper_daily_file_beats_the_archive(nemweb):
+    # the month's archive is there too, but one daily file covers the range for far fewer bytes
+    plan = source_planner.plan_settled_prices('2022-09-30 04:00', '2022-10-01')
+    assert list(plan.source) == ['public_prices']
+    assert plan.url[0].endswith('public_prices_202209300000_20221001040500.zip')
+
+
+def test_archive_where_no_daily_files(nemweb):
+    plan = source_planner.plan_settled_prices('2022-09-15', '2022-09-16')
+    assert list(plan.source) == ['archive']
+    assert (plan.start[0], plan.end[0]) == (pd.Timestamp('2022-09-15'), pd.Timestamp('2022-09-16'))
+
+
+def test_cheaper_half_hourly_reports_beat_the_archive(tmp_path, start_nemweb):
+    # reports from 29 September, so both the archive and the reports cover the end of the month
+    start_nemweb(nemweb_fixtures.build_fixtures(str(tmp_path / 'nemweb'), now='2022-10-02', current_days=3))
+    plan = source_planner.plan_predispatch_prices('2022-09-30 12:00', '2022-10-01')
+    assert set(plan.source) == {'predispatch_reports'}
+    assert list(plan.start) == list(pd.date_range('2022-09-30 12:00', '2022-09-30 23:30', freq='30min'))
+
+
+def test_missing_archive_falls_back_to_current_files(nemweb):
+    # the October archive is a 404, so only the listings are used
+    plan = source_planner.plan_settled_prices('2022-10-06 12:00', '2022-10-07 18:00')
+    assert _sources(plan) == ['public_prices', 'tradingis']
+    assert 'missing' not in set(plan.source)
+
+
+def test_daily_files_cover_the_market_day(nemweb):
+    # the file named for a day covers it from 4am, the morning before comes from the previous day's file
+    plan = source_planner.plan_settled_prices('2022-10-02', '2022-10-03')
+    assert list(plan.source) == ['public_prices', 'public_prices']
+    assert [url.split('_')[-2][:8] for url in plan.url] == ['20221001', '20221002']
+    assert list(plan.end) == [pd.Timestamp('2022-10-02 04:00'), pd.Timestamp('2022-10-03')]
+
+    prices = predispatch_daily.get_trading_price_NEMWEB('2022-10-02', '2022-10-03', use_store=False)
+    expected = pd.date_range('2022-10-02 00:05', '2022-10-03', freq='5min')
+    assert (prices.groupby('region').interval_5.nunique() == len(expected)).all()
+
+
+def test_gaps_are_planned_as_missing(nemweb):
+    plan = source_planner.plan_predispatch_prices('2022-09-28', '2022-10-07')
+    assert _sources(plan) == ['predispatch_archive', 'missing', 'predispatch_reports']
+    gap = plan[plan.source == 'missing'].iloc[0]
+    assert (gap.start, gap.end) == (pd.Timestamp('2022-10-01'), pd.Timestamp('2022-10-05 23:30'))
+
+
+def test_errors_other_than_404_are_raised(nemweb, monkeypatch):
+    def unavailable(url):
+        raise requests.HTTPError('503 Server Error')
+    monkeypatch.setattr(nemweb_listing, 'get_file_size', unavailable)
+    with pytest.raises(requests.HTTPError):
+        source_planner.plan_settled_prices('2022-09-15', '2022-09-16')
+
+
+@pytest.mark.parametrize('start, end', [('2022-09-03', '2022-09-10'), ('2022-10-06 12:00', '2022-10-07 18:00')])
+def test_cached_range_is_planned_offline(nemweb, start, end):
+    online = predispatch_daily.get_trading_price_NEMWEB(start, end, use_store=False)
+    planned = source_planner.plan_settled_prices(start, end)
+
+    nemweb.shutdown()
+    nemweb.server_close()
+    nemweb_listing.clear_listings()
+    offline = source_planner.plan_settled_prices(start, end)
+    assert list(offline.url) == list(planned.url)
+    assert (offline.bytes == 0).all()
+    pd.testing.assert_frame_equal(predispatch_daily.get_trading_price_NEMWEB(start, end, use_store=False), online)
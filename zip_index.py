@@ -0,0 +1,86 @@
+'''
+Timestamp index of the members of multi-file NEMWEB zips.
+
+Bundles such as the daily PredispatchIS archives hold one zipped report per run, named after the time it was
+published (e.g. PUBLIC_PREDISPATCHIS_202210010930_20221001090240.zip). The member names are parsed and sorted once
+per url, and lookups for the report in force at a time (as_of) or for all reports in a time range are binary
+searches, so only the members needed are decompressed.
+'''
+
+import collections
+import threading
+import numpy as np
+import pandas as pd
+
+MAX_INDEXES = 256
+
+# url -> index, least recently used first
+_indexes = collections.OrderedDict()
+_lock = threading.Lock()
+
+
+def member_timestamps(names):
+    '''
+    Timestamps of zip members, taken from the last '_' separated part of the names
+    (or the one before it, for names that end in something else).
+    '''
+    names = pd.Series(names, dtype=object)
+    stems = names.str.rsplit('.', n=1).str[0]
+    try:
+        return pd.DatetimeIndex(pd.to_datetime(stems.str.rsplit('_', n=1).str[-1]))
+    except (ValueError, TypeError):
+        return pd.DatetimeIndex(pd.to_datetime(names.str.rsplit('_', n=2).str[-2]))
+
+
+def build_index(names):
+    '''
+    Returns {'timestamps': sorted datetime64 array, 'names': member names in the same order}.
+    '''
+    names = np.asarray(names, dtype=object)
+    timestamps = member_timestamps(names).values
+    order = np.argsort(timestamps, kind='mergesort')
+    return {'timestamps': timestamps[order], 'names': names[order]}
+
+
+def get_index(z, url=None):
+    '''
+    Member index of the open ZipFile z, reused for later calls with the same url.
+    '''
+    if url is not None:
+        with _lock:
+            if url in _indexes:
+                _indexes.move_to_end(url)
+                return _indexes[url]
+
+    index = build_index(z.namelist())
+
+    if url is not None:
+        with _lock:
+            _indexes[url] = index
+            while len(_indexes) > MAX_INDEXES:
+                _indexes.popitem(last=False)
+    return index
+
+
+def member_as_of(index, as_of):
+    '''
+    Name of the latest member with timestamp <= as_of. Raises KeyError if every member is later than as_of.
+    '''
+    position = np.searchsorted(index['timestamps'], np.datetime64(pd.to_datetime(as_of)), side='right') - 1
+    if position < 0:
+        raise KeyError(f'No member as of {as_of}')
+    return index['names'][position]
+
+
+def members_between(index, start=None, end=None):
+    '''
+    Names of the members with start <= timestamp <= end (either bound may be None), in time order.
+    '''
+    first = 0 if start is None else np.searchsorted(index['timestamps'], np.datetime64(pd.to_datetime(start)), side='left')
+    last = len(index['names']) if end is None else np.searchsorted(index['timestamps'], np.datetime64(pd.to_datetime(end)), side='right')
+    return list(index['names'][first:last])
+
+
+def clear_indexes():
+    with _lock:
+        _indexes.clear()